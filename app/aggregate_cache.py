@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class AggregateCache:
+    """ Thread-safe, size-bounded LRU cache with a time-to-live for computed city aggregates.
+
+    Keys are tuples whose first element is the city (e.g. (city_value, temp_value)), which allows
+    every entry for a single city to be invalidated at once.
+
+    Concurrent misses of the same key in get_or_compute are computed once: the first caller computes the value while
+    the others wait for its result (single-flight), so the callbacks fired together for a newly selected city share
+    one aggregation.
+    """
+
+    def __init__(self, max_size=256, ttl=3600):
+        """
+        Args:
+            max_size (int): Maximum number of entries held before the least recently used entry is evicted
+            ttl (float): Number of seconds an entry remains valid. None disables expiry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+        # Futures of the values being computed, by key
+        self._inflight = {}
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.waits = 0
+
+    def get(self, key, default=None):
+        """ Return the cached value for key, or default if it is missing or has expired
+        Args:
+            key (tuple): Cache key
+            default: Value returned when the key is not cached
+        Returns:
+            The cached value or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, created = entry
+            if self.ttl is not None and time.monotonic() - created > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            # Mark the entry as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_entry(self, key):
+        """ Return the cached value for key along with its age, ignoring the TTL (for stale-while-revalidate reads)
+        Args:
+            key (tuple): Cache key
+        Returns:
+            tuple: (value, age in seconds), or None if the key is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, created = entry
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value, time.monotonic() - created
+
+    def set(self, key, value):
+        """ Store a value in the cache, evicting the least recently used entries if the cache is full
+        Args:
+            key (tuple): Cache key
+            value: Value to be cached
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """ Return the cached value for key, computing and caching it on a miss. Only one caller computes a missing
+        key at a time; the others wait for its value (or its exception)
+        Args:
+            key (tuple): Cache key
+            compute (callable): Function with no arguments which returns the value to be cached
+        Returns:
+            The cached or freshly computed value
+        """
+        missing = object()
+        with self._lock:
+            value = self.get(key, missing)
+            if value is not missing:
+                return value
+
+            # Wait for the caller already computing the key, if any
+            waiting = key in self._inflight
+            if waiting:
+                self.waits += 1
+                future = self._inflight[key]
+            else:
+                future = self._inflight[key] = Future()
+        if waiting:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as error:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(error)
+            raise
+
+        # Cache the value before releasing the waiters, so later callers hit the cache
+        with self._lock:
+            self.set(key, value)
+            del self._inflight[key]
+        future.set_result(value)
+        return value
+
+    def invalidate(self, city_value=None):
+        """ Remove entries from the cache
+        Args:
+            city_value (str): Only remove the entries for this city. If None, the whole cache is cleared
+        Returns:
+            int: The number of entries removed
+        """
+        with self._lock:
+            if city_value is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+
+            keys = [k for k in self._entries if k[0] == city_value]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+
+    def stats(self):
+        """ Return the cache counters
+        Returns:
+            dict: hits, misses, evictions, expirations, waits (for a value computed by another caller), size and hit
+                ratio of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "waits": self.waits,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+            }
@@ -0,0 +1,310 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+import requests
+
+from aggregate_cache import AggregateCache
+from instrumentation import span
+
+
+logger = logging.getLogger(__name__)
+
+class HistoryCache:
+    """ Persistent cache of Apixu daily history keyed by (city, date).
+    Past days never change, so entries never expire.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the SQLite file used to store the cache (":memory:" for a non-persistent cache)
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS History (City TEXT, Date TEXT, Day TEXT, PRIMARY KEY (City, Date))")
+            self._connection.commit()
+
+    def get_many(self, city_value, dates):
+        """ Get the cached days for a city
+        Args:
+            city_value (str): Name of the city
+            dates (list): List of datetime.date
+        Returns:
+            dict: Date string (YYYY-MM-DD) to the Apixu forecastday dict, for the dates which are cached
+        """
+        keys = [d.strftime('%Y-%m-%d') for d in dates]
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT Date, Day FROM History WHERE City = ? AND Date IN ({})".format(", ".join("?" * len(keys))),
+                [city_value] + keys).fetchall()
+        return {date: json.loads(day) for date, day in rows}
+
+    def set(self, city_value, day):
+        """ Store a day of history for a city
+        Args:
+            city_value (str): Name of the city
+            day (dict): Apixu forecastday dict (with a "date" key)
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO History (City, Date, Day) VALUES (?, ?, ?)",
+                (city_value, day['date'], json.dumps(day)))
+            self._connection.commit()
+
+
+class ApixuWeather:
+    """ Apixu weather API client which fetches history days concurrently and caches the results.
+
+    History for past days is stored in a persistent HistoryCache and the forecast is held in a short-TTL cache, so
+    a warm render needs at most the forecast call. The base URL can be pointed at a local fake Apixu server.
+
+    The API key is taken from the GLOBALWARMING_APIXU_KEY environment variable, or read from the file named by
+    GLOBALWARMING_APIXU_KEY_FILE, unless one is passed in.
+    """
+
+    def __init__(self,
+                 api_key=None,
+                 api_key_file=None,
+                 base_url="https://api.apixu.com/v1",
+                 timeout=5,
+                 max_workers=8,
+                 history_cache_path="apixu_history_cache.sqlite",
+                 forecast_ttl=15 * 60,
+                 forecast_max_stale=6 * 60 * 60,
+                 shared_cache=None):
+        """
+        Args:
+            api_key (str): Apixu API key. Defaults to the GLOBALWARMING_APIXU_KEY environment variable
+            api_key_file (str): Path of a file containing the Apixu API key, read once on first use when no key is
+                given. Defaults to the GLOBALWARMING_APIXU_KEY_FILE environment variable
+            base_url (str): Base URL of the Apixu API
+            timeout (float): Timeout in seconds of each API request
+            max_workers (int): Number of API requests issued concurrently
+            history_cache_path (str): Path of the SQLite file of the persistent history cache
+            forecast_ttl (float): Seconds a forecast is considered fresh
+            forecast_max_stale (float): Seconds a stale forecast may still be served while it is refreshed in the
+                background. 0 disables stale-while-revalidate
+            shared_cache (SharedCache): Hold the forecasts in this cache shared by the worker processes on the host,
+                rather than in a cache of this process
+        """
+        self.api_key_file = api_key_file or os.environ.get("GLOBALWARMING_APIXU_KEY_FILE")
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._api_key = api_key or os.environ.get("GLOBALWARMING_APIXU_KEY")
+        self._session = requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.history_cache = HistoryCache(history_cache_path)
+        self.forecast_ttl = forecast_ttl
+        self.forecast_max_stale = forecast_max_stale
+
+        # Forecast freshness is checked against forecast_ttl here so stale entries remain available. The history cache
+        # is an SQLite file, so it is already shared by every worker using the same path
+        if shared_cache is not None:
+            self.forecast_cache = shared_cache
+        else:
+            self.forecast_cache = AggregateCache(max_size=512, ttl=None)
+        self._revalidating = set()
+        self._revalidating_lock = threading.Lock()
+
+        # Number of upstream requests made, for monitoring
+        self.upstream_calls = 0
+        self._calls_lock = threading.Lock()
+
+    @property
+    def api_key(self):
+        """ The Apixu API key, read from the key file the first time it is needed
+        Raises:
+            RuntimeError: If no key is configured, or the key file cannot be read or is empty
+        """
+        if self._api_key is None:
+            if not self.api_key_file:
+                raise RuntimeError("No Apixu API key: set GLOBALWARMING_APIXU_KEY to the key or "
+                                   "GLOBALWARMING_APIXU_KEY_FILE to the path of a file containing it")
+            try:
+                with open(self.api_key_file) as file:
+                    api_key = file.read().strip()
+            except OSError as error:
+                raise RuntimeError("Cannot read the Apixu API key file {}: {}".format(self.api_key_file, error))
+            if not api_key:
+                raise RuntimeError("The Apixu API key file {} is empty".format(self.api_key_file))
+            self._api_key = api_key
+        return self._api_key
+
+    def _get(self, method, **params):
+        """ Call an Apixu API method
+        Args:
+            method (str): API method (e.g. "history" or "forecast")
+            params: Query string parameters
+        Returns:
+            dict: The decoded JSON response
+        """
+        params['key'] = self.api_key
+        with self._calls_lock:
+            self.upstream_calls += 1
+        with span("upstream_request", api="apixu", method=method):
+            response = self._session.get("{}/{}.json".format(self.base_url, method), params=params,
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+
+    def history(self, city_value, date):
+        """ Get the weather history of a single day
+        Args:
+            city_value (str): Name of the city
+            date (datetime.date): Day to fetch
+        Returns:
+            list: The Apixu forecastday dicts of the day
+        """
+        return self._get("history", q=city_value, dt=date.strftime('%Y-%m-%d'))['forecast']['forecastday']
+
+    def fetch_history(self, city_value, date):
+        """ Fetch the weather history of a single day from the API and store it in the persistent cache
+        Args:
+            city_value (str): Name of the city
+            date (datetime.date): Day to fetch
+        Returns:
+            list: The Apixu forecastday dicts of the day
+        """
+        days = self.history(city_value, date)
+        for day in days:
+            self.history_cache.set(city_value, day)
+        return days
+
+    def fetch_forecast(self, city_value, days=6):
+        """ Fetch the weather forecast from the API and store it in the forecast cache
+        Args:
+            city_value (str): Name of the city
+            days (int): Number of days to forecast (including today)
+        Returns:
+            list: The Apixu forecastday dicts of the forecast
+        """
+        forecast = self._get("forecast", q=city_value, days=days)['forecast']['forecastday']
+        self.forecast_cache.set((city_value, days), forecast)
+        return forecast
+
+    def forecast(self, city_value, days=6):
+        """ Get the weather forecast from today, served from the forecast cache when it is fresh.
+        A stale forecast is returned immediately and refreshed in the background (stale-while-revalidate).
+        Args:
+            city_value (str): Name of the city
+            days (int): Number of days to forecast (including today)
+        Returns:
+            list: The Apixu forecastday dicts of the forecast
+        """
+        entry = self.forecast_cache.get_entry((city_value, days))
+        if entry is not None:
+            forecast, age = entry
+            if age <= self.forecast_ttl:
+                return forecast
+            if age <= self.forecast_ttl + self.forecast_max_stale:
+                self._revalidate(city_value, days)
+                return forecast
+
+        return self.fetch_forecast(city_value, days)
+
+    def _revalidate(self, city_value, days):
+        """ Refresh a stale forecast in the background, unless a refresh for it is already running
+        Args:
+            city_value (str): Name of the city
+            days (int): Number of days to forecast (including today)
+        """
+        key = (city_value, days)
+        with self._revalidating_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        def refresh():
+            try:
+                self.fetch_forecast(city_value, days)
+            finally:
+                with self._revalidating_lock:
+                    self._revalidating.discard(key)
+
+        self._executor.submit(refresh)
+
+    def missing_history(self, city_value, today, history_days=7):
+        """ Get the past days whose history is not in the persistent cache yet
+        Args:
+            city_value (str): Name of the city
+            today (datetime.date): Today's date
+            history_days (int): Number of past days of history
+        Returns:
+            list: Dates of the missing days, each costing one upstream request
+        """
+        dates = [today - datetime.timedelta(days=i) for i in range(1, history_days + 1)]
+        cached = self.history_cache.get_many(city_value, dates)
+        return [d for d in dates if d.strftime('%Y-%m-%d') not in cached]
+
+    def refresh(self, city_value, today, history_days=7, forecast_days=6):
+        """ Fetch a fresh forecast and any missing history days for a city, e.g. from the background scheduler
+        Args:
+            city_value (str): Name of the city
+            today (datetime.date): Today's date
+            history_days (int): Number of past days of history
+            forecast_days (int): Number of days to forecast (including today)
+        Returns:
+            int: Number of upstream requests made
+        """
+        missing = self.missing_history(city_value, today, history_days)
+        for d in missing:
+            self.fetch_history(city_value, d)
+        self.fetch_forecast(city_value, forecast_days)
+
+        return len(missing) + 1
+
+    def recent_days(self, city_value, today, history_days=7, forecast_days=6):
+        """ Get the history of the past days and the forecast from today, issuing the uncached requests concurrently.
+        The requests are waited for up to twice the request timeout in total. Days which fail or are still pending
+        by then are left out (a pending day is still cached when it arrives), and a failed forecast falls back to the
+        cached one whatever its age, or to no forecast, so a slow or failing API degrades the result rather than
+        failing it
+        Args:
+            city_value (str): Name of the city
+            today (datetime.date): Today's date
+            history_days (int): Number of past days of history
+            forecast_days (int): Number of days to forecast (including today)
+        Returns:
+            tuple: (list of history forecastday dicts sorted by date, list of forecast forecastday dicts)
+        """
+        dates = [today - datetime.timedelta(days=i) for i in range(1, history_days + 1)]
+
+        # Past days are served from the persistent cache where possible
+        cached = self.history_cache.get_many(city_value, dates)
+        missing = [d for d in dates if d.strftime('%Y-%m-%d') not in cached]
+
+        # A missing API key is a configuration error rather than an unavailable API, so it is raised here instead of
+        # degrading the result
+        self.api_key
+
+        # Fetch the forecast and any missing history days concurrently, with a single deadline for all of them
+        forecast_future = self._executor.submit(self.forecast, city_value, forecast_days)
+        history_futures = [self._executor.submit(self.fetch_history, city_value, d) for d in missing]
+        done, pending = wait([forecast_future] + history_futures, timeout=self.timeout * 2)
+
+        history = list(cached.values())
+        for d, future in zip(missing, history_futures):
+            if future in done and future.exception() is None:
+                history.extend(future.result())
+            else:
+                logger.warning("History of %s on %s unavailable (%s)", city_value, d,
+                               "timed out" if future in pending else future.exception())
+
+        if forecast_future in done and forecast_future.exception() is None:
+            forecast = forecast_future.result()
+        else:
+            logger.warning("Forecast of %s unavailable (%s), serving the cached forecast", city_value,
+                           "timed out" if forecast_future in pending else forecast_future.exception())
+            entry = self.forecast_cache.get_entry((city_value, forecast_days))
+            forecast = entry[0] if entry is not None else []
+
+        history = sorted(history, key=lambda day: day['date'])
+        return history, forecast
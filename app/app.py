@@ -1,12 +1,36 @@
+import time
+start_time = time.perf_counter()
+
+import logging
+import os
+import threading
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
+from dash.dependencies import ClientsideFunction
 from dash.dependencies import Input
 from dash.dependencies import Output
+from dash.dependencies import State
+from dash.exceptions import PreventUpdate
+from flask import Response
+from flask import g
+from flask import jsonify
+from flask import request
+from export import EXPORT_FORMATS
+from export import encode
+from figures import unit_figure
+from figures import unit_trace
+from instrumentation import metrics
+from instrumentation import profiler
+from instrumentation import timed
+from shared_cache import SharedCache
+from weather_records import RECENT_WEATHER_COLUMNS
 from weather_records import WeatherRecords
 
 
+logger = logging.getLogger(__name__)
+
 app = dash.Dash(__name__)
 
 external_css = [
@@ -16,8 +40,44 @@ external_css = [
 for css in external_css:
     app.css.append_css({"external_url": css})
 
-# Initialise WeatherRecords
-wr = WeatherRecords()
+# City aggregates and forecasts are cached on disk and shared by every gunicorn worker on the host, so each is computed
+# once per host rather than once per worker
+shared_cache = SharedCache(
+    os.environ.get('GLOBALWARMING_CACHE_DIR', 'shared_cache'),
+    max_bytes=int(os.environ.get('GLOBALWARMING_CACHE_MB', 256)) * 1024 * 1024)
+
+# Initialise WeatherRecords. The city menu is read from the on-disk city index, and the database is only connected
+# to on first use
+wr = WeatherRecords(shared_cache=shared_cache)
+
+# City shown when the page loads. The other cities are searched server-side as the user types
+default_city = 'New York, New York, United States'
+
+# Maximum number of cities overlaid in the comparison graph
+max_compare_cities = 10
+
+# Maximum number of bulk exports streamed at once by each worker process, as each holds a database connection
+export_slots = threading.BoundedSemaphore(int(os.environ.get('GLOBALWARMING_MAX_EXPORTS', 2)))
+
+# Maximum number of points of each monthly history line, downsampled with LTTB (a city has up to ~720 months)
+max_monthly_points = 400
+
+
+@app.server.before_first_request
+def start_background_tasks():
+    # Keep the forecasts of the most popular cities warm in the background, and rebuild the city and station indexes
+    # if the city data has changed. Started in each worker process once it serves traffic, rather than at import time.
+    # Only the worker holding the scheduler lock calls Apixu, so the quota is shared rather than spent per worker
+    wr.start_refresh_scheduler(top_n=20, interval=10 * 60,
+                               lock_path=os.path.join(shared_cache.directory, "locks", "refresh_scheduler.lock"))
+    threading.Thread(target=refresh_indexes, name="IndexRefresh", daemon=True).start()
+
+
+def refresh_indexes():
+    wr.refresh_city_index()
+    wr.refresh_station_index()
+    wr.refresh_co2_index()
+
 
 # Define the app layout
 app.layout = html.Div([
@@ -44,8 +104,9 @@ app.layout = html.Div([
                     ),
                     dcc.Dropdown(
                         id='city-selector',
-                        options=[{'label': i, 'value': i} for i in wr.cities],
-                        value='New York, New York, United States',
+                        options=[{'label': default_city, 'value': default_city}],
+                        value=default_city,
+                        placeholder="Type to search for a city",
                         clearable=False
                     )
                 ],
@@ -66,6 +127,21 @@ app.layout = html.Div([
                     )
                 ]
             ),
+
+            # Map of the nearby weather stations. Clicking a station selects its city
+            html.Div(
+                [
+                    html.P(
+                        ["Nearby Stations"],
+                        style={"font-weight": "600"}
+                    ),
+                    dcc.Graph(
+                        id='station-map',
+                        config={'displayModeBar': False}
+                    )
+                ],
+                style={"padding-top": "20px"}
+            ),
         ],
         className="three columns",
         style={
@@ -117,9 +193,67 @@ app.layout = html.Div([
                 className="row",
             ),
 
-            # Main lineplot of temperature over time
+            # Row of trend and decadal anomaly figures, from the precomputed climatology of the city
             html.Div(
-                [dcc.Graph(id='temperature-graphic')]
+                [
+                    html.P(id="trend-kpi", className="twelve columns kpi_text"),
+                    html.P(id="anomaly-kpi", className="twelve columns kpi_text sub_text"),
+                ],
+                className="row",
+            ),
+
+            # Main lineplot of temperature over time, by year or by month, optionally overlaid with the national CO2
+            # emissions of the city's country
+            html.Div(
+                [
+                    dcc.RadioItems(
+                        id='resolution-selector',
+                        options=[{'label': i, 'value': i} for i in ["Yearly", "Monthly"]],
+                        value='Yearly',
+                        labelStyle={'display': 'inline-block', 'padding-right': '10px'}
+                    ),
+                    dcc.Checklist(
+                        id='co2-overlay',
+                        options=[{'label': 'National CO2 emissions', 'value': 'co2'}],
+                        value=[],
+                        labelStyle={'display': 'inline-block'}
+                    ),
+                    dcc.Graph(id='temperature-graphic')
+                ]
+            ),
+
+            # Monthly history of the selected city in both units, fetched when monthly resolution is selected
+            dcc.Store(id='city-monthly'),
+
+            # Historical summary of the selected city in both units, rendered in the browser (assets/weather.js)
+            dcc.Store(id='city-summary'),
+
+            # Comparison of the yearly temperatures of several cities
+            html.Div(
+                [
+                    html.H3(
+                        ["Compare Cities"],
+                        style={"text-align": "center"}
+                    ),
+                    dcc.Dropdown(
+                        id='compare-selector',
+                        options=[{'label': default_city, 'value': default_city}],
+                        value=[default_city],
+                        multi=True,
+                        placeholder="Type to add cities to compare (up to {})".format(max_compare_cities)
+                    ),
+                    dcc.RadioItems(
+                        id='compare-variable',
+                        options=[
+                            {'label': 'Average', 'value': 'AvgTemp'},
+                            {'label': 'Maximum', 'value': 'MaxTemp'},
+                            {'label': 'Minimum', 'value': 'MinTemp'}],
+                        value='AvgTemp',
+                        labelStyle={'display': 'inline-block', 'padding-right': '10px'}
+                    ),
+                    dcc.Graph(id='comparison-graphic'),
+                    dcc.Store(id='comparison-data')
+                ]
             ),
 
             # 5-day forecast
@@ -136,7 +270,8 @@ app.layout = html.Div([
                     # 5-day forecast graphic
                     html.Div(
                         [
-                            dcc.Graph(id='forecast-graphic')
+                            dcc.Graph(id='forecast-graphic'),
+                            dcc.Store(id='forecast-data')
                         ]
                     )
                 ]
@@ -153,122 +288,341 @@ app.layout = html.Div([
 ])
 
 
-# Callbacks to update tile values
-@app.callback(
-    Output("tile1", "children"),
-    [Input('city-selector', 'value'),
-    Input('temp-selector', 'value')],
-)
-def tile1_callback(city_value, temp_value):
-    return wr.calc_temp_change(city_value, temp_value, "MinTemp")
+# Time every request, including the serialisation of callback responses which the callback spans do not cover
+@app.server.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
 
 
+@app.server.after_request
+def record_request_time(response):
+    if request.path.endswith('_dash-update-component'):
+        # The output is sent by the client, so only registered callbacks get their own series
+        body = request.get_json(silent=True) or {}
+        endpoint = body.get('output')
+        if endpoint not in app.callback_map:
+            endpoint = 'unknown'
+    else:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if 'request_start' in g:
+        metrics.observe('http_request', time.perf_counter() - g.request_start, endpoint=endpoint,
+                        status=response.status_code)
+    return response
+
+
+# Cache, backend and API client statistics, read when the metrics are scraped
+@metrics.register_collector
+def collect_runtime_stats():
+    return {'{}_{}'.format(component, key): value
+            for component, stats in wr.runtime_stats().items() for key, value in stats.items()}
+
+
+# Prometheus metrics endpoint
+@app.server.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Sampling profiler endpoints, only served when the app is started with GLOBALWARMING_PROFILER=1, e.g.
+# POST /debug/profiler/start?interval=0.01, POST /debug/profiler/stop, then GET /debug/profiler for the collapsed stacks
+if os.environ.get('GLOBALWARMING_PROFILER') == '1':
+    @app.server.route('/debug/profiler/start', methods=['POST'])
+    def start_profiler():
+        started = profiler.start(request.args.get('interval', type=float))
+        return jsonify({'running': True, 'started': started})
+
+    @app.server.route('/debug/profiler/stop', methods=['POST'])
+    def stop_profiler():
+        stopped = profiler.stop()
+        return jsonify({'running': False, 'stopped': stopped, 'samples': profiler.samples})
+
+    @app.server.route('/debug/profiler')
+    def profiler_report():
+        return Response(profiler.collapsed(request.args.get('limit', type=int)), mimetype='text/plain')
+
+
+# City search endpoint, e.g. /api/cities?q=new+york&limit=20&offset=0
+@app.server.route('/api/cities')
+def search_cities():
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    results, total = wr.search_cities(query, limit, offset)
+    return jsonify({'results': results, 'total': total, 'limit': limit, 'offset': offset})
+
+
+# Nearest station endpoint, e.g. /api/stations/nearest?lat=40.7&lon=-74.0&k=5
+@app.server.route('/api/stations/nearest')
+def nearest_stations():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None:
+        return jsonify({'error': 'lat and lon are required'}), 400
+    k = min(max(request.args.get('k', 5, type=int), 1), 100)
+    return jsonify({'results': wr.nearest_stations(lat, lon, k)})
+
+
+# Stations within a radius endpoint, e.g. /api/stations/within?lat=40.7&lon=-74.0&radius_km=50
+@app.server.route('/api/stations/within')
+def stations_within():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None:
+        return jsonify({'error': 'lat and lon are required'}), 400
+    radius_km = min(max(request.args.get('radius_km', 50, type=float), 0), 2000)
+    return jsonify({'results': wr.stations_within(lat, lon, radius_km)})
+
+
+# Bulk export endpoint streaming the yearly or monthly series of some or all cities, e.g.
+# /api/export?city=New+York,+New+York,+United+States&city=Paris,+Ile-de-France,+France&resolution=monthly&format=csv
+# &start_year=1980&end_year=2018&columns=AvgTempC,NumberStations. Without a city every city is exported. Each export
+# holds a database connection until it is sent, so only a few run at once
+@app.server.route('/api/export')
+def export_series():
+    from backends import EXPORT_COLUMNS
+
+    file_format = request.args.get('format', 'csv')
+    resolution = request.args.get('resolution', 'yearly')
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be one of {}'.format(', '.join(EXPORT_FORMATS))}), 400
+    if resolution not in ('yearly', 'monthly'):
+        return jsonify({'error': 'resolution must be yearly or monthly'}), 400
+    columns = request.args.get('columns')
+    if columns is not None:
+        columns = columns.split(',')
+        unknown = [c for c in columns if c not in EXPORT_COLUMNS]
+        if unknown:
+            return jsonify({'error': 'unknown columns {}, expected {}'.format(unknown, list(EXPORT_COLUMNS))}), 400
+    city_values = request.args.getlist('city') or None
+    if city_values is not None:
+        unknown = [c for c in city_values if wr.city_id(c) is None]
+        if unknown:
+            return jsonify({'error': 'unknown cities {}'.format(unknown)}), 404
+    if file_format == 'arrow':
+        try:
+            import pyarrow
+        except ImportError:
+            return jsonify({'error': 'arrow exports require pyarrow'}), 501
+
+    if not export_slots.acquire(blocking=False):
+        return jsonify({'error': 'too many exports in progress, retry later'}), 429
+    try:
+        names, batches = wr.export_series(city_values, resolution, request.args.get('start_year', type=int),
+                                          request.args.get('end_year', type=int), columns)
+    except BaseException:
+        export_slots.release()
+        raise
+    metrics.inc('exports', format=file_format, resolution=resolution)
+
+    # Stream the chunks as they are encoded. Once the response is closed (sent, or the client disconnected) the
+    # database cursor is closed and the export slot freed
+    def release():
+        batches.close()
+        export_slots.release()
+
+    response = Response(encode(file_format, names, batches), mimetype=EXPORT_FORMATS[file_format], headers={
+        'Content-Disposition': 'attachment; filename=globalwarming-{}.{}'.format(resolution, file_format)})
+    response.call_on_close(release)
+    return response
+
+
+# Callback to populate the city menu with the best matches as the user types, and to select the city of a station
+# clicked on the map
 @app.callback(
-    Output("tile2", "children"),
-    [Input('city-selector', 'value'),
-    Input('temp-selector', 'value')],
+    [Output('city-selector', 'options'),
+    Output('city-selector', 'value')],
+    [Input('city-selector', 'search_value'),
+    Input('station-map', 'clickData')],
+    [State('city-selector', 'value')]
 )
-def tile2_callback(city_value, temp_value):
-    return wr.calc_temp_change(city_value, temp_value, "MaxTemp")
+@timed('callback', expected=(PreventUpdate,), callback='update_city_options')
+def update_city_options(search_value, click_data, city_value):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+
+    # Select the city of the clicked station (the city is resolved from the station's CityId, not its name)
+    if 'station-map.clickData' in triggered and click_data:
+        point = click_data['points'][0]
+        city_value = wr.nearest_city(point['lat'], point['lon']) or city_value
+        return [{'label': city_value, 'value': city_value}], city_value
+
+    if not search_value:
+        raise PreventUpdate
 
+    # Keep the selected city in the options so the dropdown can still display it
+    results, _ = wr.search_cities(search_value, limit=20)
+    if city_value and city_value not in results:
+        results.append(city_value)
+    return [{'label': i, 'value': i} for i in results], dash.no_update
 
+
+# Callback to draw the stations around the selected city
 @app.callback(
-    Output("tile3", "children"),
-    [Input('city-selector', 'value'),
-    Input('temp-selector', 'value')],
+    Output('station-map', 'figure'),
+    [Input('city-selector', 'value')]
 )
-def tile3_callback(city_value, temp_value):
-    return wr.calc_temp_change(city_value, temp_value, "AvgTemp")
+@timed('callback', expected=(PreventUpdate,), callback='update_station_map')
+def update_station_map(city_value):
+    stations = wr.stations_near_city(city_value)
+
+    # Highlight the stations of the selected city
+    selected = [s["City"] == city_value for s in stations]
+    trace = go.Scattergeo(
+        lat=[s["Lat"] for s in stations],
+        lon=[s["Lon"] for s in stations],
+        text=[s["City"] for s in stations],
+        hoverinfo='text',
+        mode='markers',
+        marker={
+            'size': [9 if i else 6 for i in selected],
+            'color': ["#EF553B" if i else "#506784" for i in selected]
+        }
+    )
 
+    # Zoom the map to the stations, with a margin of 1 degree
+    lats = [s["Lat"] for s in stations] or [0]
+    lons = [s["Lon"] for s in stations] or [0]
 
-# Callbacks to update tile year ranges
+    return {
+        'data': [trace],
+        'layout': {
+            'geo': {
+                'projection': {'type': 'mercator'},
+                'lataxis': {'range': [min(lats) - 1, max(lats) + 1]},
+                'lonaxis': {'range': [min(lons) - 1, max(lons) + 1]},
+                'showcountries': True
+            },
+            'margin': {'l': 0, 'r': 0, 't': 0, 'b': 0},
+            'height': 250
+        }
+    }
+
+
+# Callback to calculate the historical summary of a city (tiles, year range and linechart data) in a single request.
+# The national CO2 emissions for the overlay are looked up in memory for the same years, so they add no query
 @app.callback(
+    [Output('city-summary', 'data'),
     Output("tile1_year_range", "children"),
-    [Input('city-selector', 'value')],
+    Output("tile2_year_range", "children"),
+    Output("tile3_year_range", "children")],
+    [Input('city-selector', 'value')]
 )
-def tile1_year_range_callback(city_value):
-    return wr.calc_year_range(city_value)
+@timed('callback', expected=(PreventUpdate,), callback='update_city_summary')
+def update_city_summary(city_value):
+    summary = wr.city_summary(city_value)
+    summary = dict(summary, co2=wr.city_co2(city_value, summary["years"]))
+    return [summary] + [summary["year_range"]] * 3
 
 
+# Callback to fetch the monthly history of a city, downsampled to a fixed number of points per line. Nothing is
+# fetched while yearly resolution is selected
 @app.callback(
-    Output("tile2_year_range", "children"),
-    [Input('city-selector', 'value')],
+    Output('city-monthly', 'data'),
+    [Input('city-selector', 'value'),
+    Input('resolution-selector', 'value')]
+)
+@timed('callback', expected=(PreventUpdate,), callback='update_city_monthly')
+def update_city_monthly(city_value, resolution):
+    if resolution != "Monthly":
+        raise PreventUpdate
+
+    df = wr.city_monthly(city_value)
+    traces = [unit_trace(i, df['Date'].values, df[i], max_points=max_monthly_points, date_unit="M", mode='lines')
+              for i in ["MaxTemp", "MinTemp", "AvgTemp"]]
+    return unit_figure(traces, {'title': city_value})
+
+
+# Client-side callback to render the tiles and historical temperature linechart in the selected unit, so switching
+# unit or toggling the CO2 overlay does not make a request
+app.clientside_callback(
+    ClientsideFunction(namespace='weather', function_name='renderSummary'),
+    [Output("tile1", "children"),
+    Output("tile2", "children"),
+    Output("tile3", "children"),
+    Output("trend-kpi", "children"),
+    Output("anomaly-kpi", "children"),
+    Output('temperature-graphic', 'figure')],
+    [Input('city-summary', 'data'),
+    Input('temp-selector', 'value'),
+    Input('city-monthly', 'data'),
+    Input('resolution-selector', 'value'),
+    Input('co2-overlay', 'value')]
 )
-def tile2_year_range_callback(city_value):
-    return wr.calc_year_range(city_value)
 
 
+# Callback to populate the comparison menu with the best matches as the user types
 @app.callback(
-    Output("tile3_year_range", "children"),
-    [Input('city-selector', 'value')],
+    Output('compare-selector', 'options'),
+    [Input('compare-selector', 'search_value')],
+    [State('compare-selector', 'value')]
 )
-def tile3_year_range_callback(city_value):
-    return wr.calc_year_range(city_value)
+@timed('callback', expected=(PreventUpdate,), callback='update_compare_options')
+def update_compare_options(search_value, city_values):
+    if not search_value:
+        raise PreventUpdate
 
+    # Keep the selected cities in the options so the dropdown can still display them
+    results, _ = wr.search_cities(search_value, limit=20)
+    selected = [c for c in city_values or [] if c not in results]
+    return [{'label': i, 'value': i} for i in selected + results]
 
-# Callback to generate historical temperature linechart
+
+# Callback to calculate the yearly temperatures of the cities being compared, read with a single batched query
 @app.callback(
-    Output('temperature-graphic', 'figure'),
-    [Input('city-selector', 'value'),
+    Output('comparison-data', 'data'),
+    [Input('compare-selector', 'value'),
+    Input('compare-variable', 'value')]
+)
+@timed('callback', expected=(PreventUpdate,), callback='update_comparison')
+def update_comparison(city_values, temp_var):
+    city_values = (city_values or [])[:max_compare_cities]
+    df = wr.calc_cities_df(city_values, "Fahrenheit")
+
+    # One line per city
+    traces = [unit_trace(city_value, city_df['Year'].values, city_df[temp_var], mode='lines')
+              for city_value, city_df in df.groupby('City', sort=False)]
+    return unit_figure(traces, {'yaxis': {'title': 'Temperature'}, 'legend': {'orientation': 'h'}})
+
+
+# Client-side callback to render the comparison in the selected unit
+app.clientside_callback(
+    ClientsideFunction(namespace='weather', function_name='renderFigure'),
+    Output('comparison-graphic', 'figure'),
+    [Input('comparison-data', 'data'),
     Input('temp-selector', 'value')]
 )
-def update_graph(city_value, temp_value):
-    # Temperature variables to display on the graph
-    temp_vars = ["MaxTemp", "MinTemp", "AvgTemp"]
 
-    # Calculate df for the city
-    df = wr.calc_city_df(city_value, temp_value)
+
+# Callback to update 5 day forecast, in both units so switching unit is handled client-side
+@app.callback(
+    Output('forecast-data', 'data'),
+    [Input('city-selector', 'value')]
+)
+@timed('callback', expected=(PreventUpdate,), callback='update_forecast')
+def update_forecast(city_value):
+    # Get 7 day history + 5 day forecast
+    df = wr.get_recent_weather(city_value, "Fahrenheit")
+
+    # Temperature variables to display on the graph - the baseline year is only added for cities with daily records
+    baseline = [c for c in df.columns if c not in RECENT_WEATHER_COLUMNS]
+    temp_vars = ["Last 7 Days", "Forecast"] + baseline
 
     # Create lineplot for each temp variable
-    traces = []
-    for i in temp_vars:
-        traces.append(go.Scatter(
-                x=df['Year'],
-                y=df[i],
-                name=i
-        ))
+    traces = [unit_trace(str(i), df['Date'], df[i]) for i in temp_vars]
 
     # Generate and return the plot
-    return {
-        'data': traces,
-        'layout': {
-            'title': df.City[0]
-        }
-    }
+    return unit_figure(traces, {'title': city_value})
 
 
-# Callback to update 5 day forecast
-@app.callback(
+# Client-side callback to render the forecast in the selected unit
+app.clientside_callback(
+    ClientsideFunction(namespace='weather', function_name='renderFigure'),
     Output('forecast-graphic', 'figure'),
-    [Input('city-selector', 'value'),
+    [Input('forecast-data', 'data'),
     Input('temp-selector', 'value')]
 )
-def update_forecast(city_value, temp_value):
-    # Get 7 day history + 5 day forecast
-    df = wr.get_recent_weather(city_value, temp_value)
 
-    # Temperature variables to display on the graph - if there isn't any historical data, just plot the MaxTemp and forecast
-    if df.columns[-1] == "MaxTemp":
-        temp_vars = ["Last 7 Days", "Forecast"]
-    else:
-        temp_vars = ["Last 7 Days", "Forecast", df.columns[-1]]
-
-    # Create lineplot for each temp variable
-    traces = []
-    for i in temp_vars:
-        traces.append(go.Scatter(
-                x=df['Date'],
-                y=df[i],
-                name=i
-        ))
-    # Generate and return the plot
-    return {
-        'data': traces,
-        'layout': {
-            'title': city_value
-        }
-    }
 
+logger.info("App ready in %.2fs", time.perf_counter() - start_time)
 
 if __name__ == '__main__':
     app.run_server(debug=True, dev_tools_hot_reload=True)
@@ -0,0 +1,115 @@
+// Build a plotly figure from a payload of traces holding their y values in both units (figures.unit_figure)
+function unitFigure(payload, tempValue) {
+    var traces = payload.traces.map(function(trace) {
+        return Object.assign({}, trace, {'y': trace.y[tempValue]});
+    });
+    return {'data': traces, 'layout': payload.layout};
+}
+
+// Add the national CO2 emissions of the city's country to a figure, on a second y axis. Monthly figures have date x
+// values, so each year's emissions are placed mid-year
+function withCO2(figure, co2, years, monthly) {
+    var trace = {
+        'type': 'scatter',
+        'mode': 'lines',
+        'name': 'CO2 (' + co2.country + ')',
+        'x': monthly ? years.map(function(year) { return year + '-07-01'; }) : years,
+        'y': co2.emissions,
+        'yaxis': 'y2',
+        'line': {'dash': 'dot', 'color': '#7f7f7f'}
+    };
+    var layout = Object.assign({}, figure.layout, {
+        'yaxis2': {'title': 'CO2 emissions (Mt)', 'overlaying': 'y', 'side': 'right', 'showgrid': false}
+    });
+    return {'data': figure.data.concat([trace]), 'layout': layout};
+}
+
+// Format a temperature difference with its sign, e.g. +0.25°C
+function signedTemp(value, tempValue) {
+    return (value > 0 ? '+' : '') + value.toFixed(2) + (tempValue === 'Celsius' ? '°C' : '°F');
+}
+
+// Describe the linear trends of a city (WeatherRecords.city_summary), with their 95% confidence interval
+function trendText(unit, tempValue) {
+    var parts = [['Min', 'MinTemp'], ['Max', 'MaxTemp'], ['Avg', 'AvgTemp']].filter(function(pair) {
+        return unit.trends[pair[1]];
+    }).map(function(pair) {
+        var trend = unit.trends[pair[1]];
+        var text = pair[0] + ' ' + signedTemp(trend.per_decade, tempValue);
+        if (trend.low !== null && trend.high !== null) {
+            text += ' (' + trend.low.toFixed(2) + ' to ' + trend.high.toFixed(2) + ')';
+        }
+        return text;
+    });
+    return parts.length ? 'Trend per decade: ' + parts.join(', ') : '';
+}
+
+// Describe the decadal anomalies of a city's average temperature against the 1961-1990 baseline
+function anomalyText(decades, unit, tempValue) {
+    var parts = decades.map(function(decade, i) {
+        var anomaly = unit.anomalies[i];
+        return anomaly === null || anomaly === undefined ? null : decade + 's ' + signedTemp(anomaly, tempValue);
+    }).filter(function(text) { return text !== null; });
+    return parts.length ? 'Avg temperature vs 1961-1990: ' + parts.join(', ') : '';
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    weather: {
+        // Render the tiles, trend and anomaly figures and historical temperature linechart from the city summary
+        // (WeatherRecords.city_summary), or from the monthly series of the same city when monthly resolution is
+        // selected, with the CO2 overlay if it is checked and the city's country has emissions data
+        renderSummary: function(summary, tempValue, monthly, resolution, overlay) {
+            if (!summary) {
+                return [null, null, null, '', '', {'data': [], 'layout': {}}];
+            }
+
+            // Temperature variables to display on the graph
+            var tempVars = ["MaxTemp", "MinTemp", "AvgTemp"];
+            var unit = summary.units[tempValue];
+
+            // Create lineplot for each temp variable. The monthly series is only used once it has arrived for the
+            // selected city
+            var figure;
+            var showMonthly = resolution === "Monthly" && monthly && monthly.layout.title === summary.city;
+            if (showMonthly) {
+                figure = unitFigure(monthly, tempValue);
+            } else {
+                figure = {
+                    'data': tempVars.map(function(i) {
+                        return {
+                            'type': 'scatter',
+                            'x': summary.years,
+                            'y': unit.values[i],
+                            'name': i
+                        };
+                    }),
+                    'layout': {
+                        'title': summary.city
+                    }
+                };
+            }
+
+            if (overlay && overlay.indexOf('co2') >= 0 && summary.co2) {
+                figure = withCO2(figure, summary.co2, summary.years, showMonthly);
+            }
+
+            // Return the tile values (min, max, avg), the trend and anomaly figures and the plot
+            return [
+                unit.changes.MinTemp,
+                unit.changes.MaxTemp,
+                unit.changes.AvgTemp,
+                trendText(unit, tempValue),
+                anomalyText(summary.decades, unit, tempValue),
+                figure
+            ];
+        },
+
+        // Render a figure payload in the selected unit, so switching unit only swaps the y values in the browser
+        renderFigure: function(payload, tempValue) {
+            if (!payload) {
+                return {'data': [], 'layout': {}};
+            }
+            return unitFigure(payload, tempValue);
+        }
+    }
+});
@@ -0,0 +1,642 @@
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pymysql.cursors
+
+from connection_pool import ConnectionPool
+from instrumentation import metrics
+from instrumentation import span
+
+
+logger = logging.getLogger(__name__)
+
+# Temperature columns of the exported series (export_series), with the aggregate of the monthly StationRecords each is
+# calculated from in the monthly series. The yearly series read the same columns of CityYearSummary
+EXPORT_COLUMNS = {
+    'MaxTempF': "MAX(StationRecords.MaxTemp)",
+    'MinTempF': "MIN(StationRecords.MinTemp)",
+    'AvgTempF': "AVG(StationRecords.Temp)",
+    'MaxTempC': "ROUND((MAX(StationRecords.MaxTemp) - 32) * 5 / 9, 3)",
+    'MinTempC': "ROUND((MIN(StationRecords.MinTemp) - 32) * 5 / 9, 3)",
+    'AvgTempC': "ROUND((AVG(StationRecords.Temp) - 32) * 5 / 9, 3)",
+    'NumberStations': "COUNT(DISTINCT StationRecords.StationId)"
+}
+
+
+class MySQLBackend:
+    """ Weather data backend reading the globalwarming MySQL database through a connection pool.
+
+    All backends provide the same methods (data_version, load_cities, load_stations, city_summary, cities_summary,
+    city_climatology, city_records, cities_records, city_daily_baseline, load_country_co2 and export_series), so
+    WeatherRecords can be pointed at any of them.
+    """
+
+    def __init__(self, host='localhost', user='root', password='', db='globalwarming',
+                 pool_min_size=1, pool_max_size=10, pool_timeout=10, pool_recycle=3600, slow_query_seconds=0.5):
+        """
+        Args:
+            host (str): MySQL host
+            user (str): MySQL user
+            password (str): MySQL password
+            db (str): Database name
+            pool_min_size (int): Number of database connections kept open
+            pool_max_size (int): Maximum number of concurrent database connections
+            pool_timeout (float): Seconds to wait for a free database connection
+            pool_recycle (float): Seconds after which a database connection is replaced
+            slow_query_seconds (float): Queries taking longer than this are logged with their SQL and row count.
+                None disables the slow query log
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.db = db
+        self.slow_query_seconds = slow_query_seconds
+
+        # Pool of reusable database connections shared by all callbacks
+        self.pool = ConnectionPool(
+            self.connect,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            recycle=pool_recycle)
+
+    def connect(self):
+        """ Open a new connection to the app database. Used by the connection pool.
+        Returns:
+            pymysql.connections.Connection: Connection in autocommit mode so pooled connections always see fresh data
+        """
+        return pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            db=self.db,
+            charset='utf8mb4',
+            autocommit=True,
+            cursorclass=pymysql.cursors.DictCursor)
+
+    def run_sql_query(self, sql, params=None, name="query"):
+        """ Run an SQL query against the app database and return the results in a pandas DataFrame.
+        Args:
+            sql (str): SQL query to be run on the database
+            params (list): Values for the %s placeholders in the query
+            name (str): Name of the query, used to label its timings in the metrics
+
+        Todo:
+            Implement exception handling in case of database connection error
+
+        Returns:
+            pd.DataFrame: The results of the SQL query as a pandas DataFrame
+        """
+
+        # Borrow a connection from the pool and query the database. The pool wait is tracked by the pool's own stats
+        with self.pool.connection() as connection:
+            with span("sql_query", query=name) as timing:
+                df = pd.read_sql(sql, connection, params=params)
+        df = df.reset_index()
+
+        # Log slow queries with their SQL so they can be explained
+        if self.slow_query_seconds is not None and timing.elapsed >= self.slow_query_seconds:
+            metrics.inc("slow_queries", query=name)
+            logger.warning("Slow query %s took %.3fs and returned %d rows: %s params=%s",
+                           name, timing.elapsed, len(df), " ".join(sql.split()), params)
+
+        # Return the results as a dataframe
+        return df
+
+    def stream_query(self, sql, params=None, name="query", batch_size=5000):
+        """ Run an SQL query with an unbuffered server-side cursor (SSCursor) and yield its rows in batches, so large
+        results are never held in memory.
+
+        The pooled connection is held until every row has been read. If the consumer stops early (e.g. the client of
+        an export disconnects) the connection is closed rather than returned to the pool, as the rest of the result
+        would otherwise have to be read off it first.
+
+        Args:
+            sql (str): SQL query to be run on the database
+            params (list): Values for the %s placeholders in the query
+            name (str): Name of the query, used to label its timings in the metrics
+            batch_size (int): Number of rows per batch
+        Returns:
+            generator: Lists of up to batch_size row tuples
+        """
+        connection = self.pool.checkout()
+        completed = False
+        try:
+            cursor = connection.cursor(pymysql.cursors.SSCursor)
+
+            # Give slow clients more than the default 60s to read before the server gives up sending the rows
+            cursor.execute("SET SESSION net_write_timeout = 600")
+
+            # Timed until the server starts sending rows, as the rest depends on how fast the client reads them
+            with span("sql_query", query=name):
+                cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+
+            # Restore the timeout before the connection is reused by other queries
+            with connection.cursor() as reset:
+                reset.execute("SET SESSION net_write_timeout = DEFAULT")
+            completed = True
+        finally:
+            self.pool.checkin(connection, discard=not completed)
+
+    def stats(self):
+        """ Return the database connection pool metrics (wait time, in-use, created etc.)
+        Returns:
+            dict: The pool statistics
+        """
+        return self.pool.stats()
+
+    def data_version(self, name="Cities"):
+        """ Get the version of a dataset, bumped by the pipeline whenever it changes
+        Args:
+            name (str): Name of the dataset in the DataVersion table (e.g. Cities or CountryYearCO2)
+        Returns:
+            str: The version, or "0" if the dataset has never been versioned
+        """
+        df = self.run_sql_query("SELECT Version FROM DataVersion WHERE Name = %s", [name], name="data_version")
+        return str(int(df.Version[0])) if len(df) else "0"
+
+    def load_cities(self):
+        """ Get the cities in the database
+        Returns:
+            pd.DataFrame: CityId and City (the dropdown label) of every city
+        """
+        select_cities = """
+            SELECT CityId, Label as City
+            FROM Cities
+            ORDER BY CityId"""
+        return self.run_sql_query(select_cities, name="load_cities")
+
+    def load_stations(self):
+        """ Get the location of every station mapped to a city
+        Returns:
+            pd.DataFrame: StationId, CityId, Lat and Lon of each station
+        """
+        select_stations = """
+            SELECT StationId, CityId, Lat, Lon
+            FROM StationDetails
+            WHERE CityId IS NOT NULL AND Lat IS NOT NULL AND Lon IS NOT NULL"""
+        df = self.run_sql_query(select_stations, name="load_stations")
+        df[['Lat', 'Lon']] = df[['Lat', 'Lon']].astype(float)
+
+        return df.loc[:, ['StationId', 'CityId', 'Lat', 'Lon']]
+
+    def load_country_co2(self):
+        """ Get the precomputed national CO2 emissions of the countries of the cities, and the country of each city
+        Returns:
+            tuple: (pd.DataFrame of Country, Year and Emissions from CountryYearCO2, pd.DataFrame of CityId and
+                Country of the cities in those countries)
+        """
+        co2 = self.run_sql_query(
+            "SELECT Country, Year, Emissions FROM CountryYearCO2 ORDER BY Country, Year", name="load_country_co2")
+        city_countries = self.run_sql_query("""
+            SELECT CityId, Country
+            FROM Cities
+            WHERE Country IN (SELECT DISTINCT Country FROM CountryYearCO2)
+            ORDER BY CityId""", name="load_city_countries")
+
+        return co2.loc[:, ['Country', 'Year', 'Emissions']], city_countries.loc[:, ['CityId', 'Country']]
+
+    def city_summary(self, city_id, temp_value="Celsius"):
+        """ Read the precomputed yearly temperatures of a city from the CityYearSummary table
+        Args:
+            city_id (int): CityId of the city
+            temp_value (str): Whether the data is to be displayed as Fahrenheit or Celsius.
+        Returns:
+            pd.DataFrame: Year, AvgTemp, MaxTemp and MinTemp for each year
+        """
+        suffix = "C" if temp_value == "Celsius" else "F"
+
+        select_data = """
+        SELECT
+            Year,
+            AvgTemp{0} as AvgTemp,
+            MaxTemp{0} as MaxTemp,
+            MinTemp{0} as MinTemp
+        FROM CityYearSummary
+        WHERE CityId = %s
+        ORDER BY Year
+        """.format(suffix)
+
+        return self.run_sql_query(select_data, [city_id], name="city_summary")
+
+    def cities_summary(self, city_ids, temp_value="Celsius"):
+        """ Read the precomputed yearly temperatures of several cities from the CityYearSummary table in one query
+        Args:
+            city_ids (list): CityIds of the cities
+            temp_value (str): Whether the data is to be displayed as Fahrenheit or Celsius.
+        Returns:
+            pd.DataFrame: CityId, Year, AvgTemp, MaxTemp and MinTemp for each city-year
+        """
+        suffix = "C" if temp_value == "Celsius" else "F"
+
+        select_data = """
+        SELECT
+            CityId,
+            Year,
+            AvgTemp{0} as AvgTemp,
+            MaxTemp{0} as MaxTemp,
+            MinTemp{0} as MinTemp
+        FROM CityYearSummary
+        WHERE CityId IN ({1})
+        ORDER BY CityId, Year
+        """.format(suffix, ", ".join(["%s"] * len(city_ids)))
+
+        return self.run_sql_query(select_data, list(city_ids), name="cities_summary")
+
+    def city_climatology(self, city_id):
+        """ Read the precomputed trend and anomaly statistics of a city from the CityClimatology and
+        CityDecadeAnomaly tables
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            tuple: (pd.DataFrame of the CityClimatology row, pd.DataFrame of Decade, AvgTempF and AnomalyF)
+        """
+        climatology = self.run_sql_query(
+            "SELECT * FROM CityClimatology WHERE CityId = %s", [city_id], name="city_climatology")
+        decades = self.run_sql_query(
+            "SELECT Decade, AvgTempF, AnomalyF FROM CityDecadeAnomaly WHERE CityId = %s ORDER BY Decade", [city_id],
+            name="city_decades")
+
+        return climatology.drop(columns='index'), decades.drop(columns='index')
+
+    def city_records(self, city_id):
+        """ Get the monthly records of every station in a city, in degrees Fahrenheit
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            pd.DataFrame: StationId, Year, Month, MaxTemp, MinTemp and AvgTemp of each station-month
+        """
+        select_data = """
+        SELECT
+            StationRecords.StationId as StationId,
+            StationRecords.Year as Year,
+            StationRecords.Month as `Month`,
+            StationRecords.MaxTemp as MaxTemp,
+            StationRecords.MinTemp as MinTemp,
+            StationRecords.Temp as AvgTemp
+        FROM StationDetails
+        JOIN StationRecords ON StationRecords.StationId = StationDetails.StationId
+        WHERE StationDetails.CityId = %s
+        """
+
+        return self.run_sql_query(select_data, [city_id], name="city_records")
+
+    def cities_records(self, city_ids):
+        """ Get the monthly records of every station in several cities in one query, in degrees Fahrenheit
+        Args:
+            city_ids (list): CityIds of the cities
+        Returns:
+            pd.DataFrame: CityId, StationId, Year, Month, MaxTemp, MinTemp and AvgTemp of each station-month
+        """
+        select_data = """
+        SELECT
+            StationDetails.CityId as CityId,
+            StationRecords.StationId as StationId,
+            StationRecords.Year as Year,
+            StationRecords.Month as `Month`,
+            StationRecords.MaxTemp as MaxTemp,
+            StationRecords.MinTemp as MinTemp,
+            StationRecords.Temp as AvgTemp
+        FROM StationDetails
+        JOIN StationRecords ON StationRecords.StationId = StationDetails.StationId
+        WHERE StationDetails.CityId IN ({})
+        """.format(", ".join(["%s"] * len(city_ids)))
+
+        return self.run_sql_query(select_data, list(city_ids), name="cities_records")
+
+    def city_daily_baseline(self, city_id):
+        """ Read the daily maximum temperatures of a city in the first year of its daily records (either 60's, 70's or
+        80's) from the CityDailyBaseline table, in degrees Fahrenheit
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            pd.DataFrame: DayOfYear (1 to 365, 29 February excluded), Year and MaxTemp
+        """
+        select_data = """
+        SELECT DayOfYear, Year, MaxTemp
+        FROM CityDailyBaseline
+        WHERE CityId = %s
+        ORDER BY DayOfYear
+        """
+
+        df = self.run_sql_query(select_data, [city_id], name="city_daily_baseline")
+
+        return df.loc[:, ['DayOfYear', 'Year', 'MaxTemp']]
+
+    def export_series(self, resolution="yearly", city_ids=None, start_year=None, end_year=None, columns=None,
+                      batch_size=5000):
+        """ Stream the yearly or monthly temperature series of cities, for the export API. The city, year range and
+        column selections are part of the query, and the rows are read with a server-side cursor
+        Args:
+            resolution (str): "yearly" (read from CityYearSummary) or "monthly" (aggregated from StationRecords)
+            city_ids (list): CityIds of the cities. None exports every city
+            start_year (int): First year exported. None for no lower bound
+            end_year (int): Last year exported. None for no upper bound
+            columns (list): Temperature columns exported, from EXPORT_COLUMNS. None exports them all
+            batch_size (int): Number of rows per batch
+        Returns:
+            generator: Lists of up to batch_size row tuples of City, CityId, Year, Month (monthly only) and the
+                columns, ordered by CityId and date
+        """
+        columns = list(EXPORT_COLUMNS) if columns is None else columns
+        city_table = "CityYearSummary" if resolution == "yearly" else "StationDetails"
+        year_table = "CityYearSummary" if resolution == "yearly" else "StationRecords"
+
+        # Filters pushed down into the query
+        conditions = []
+        params = []
+        if city_ids is not None:
+            conditions.append("{}.CityId IN ({})".format(city_table, ", ".join(["%s"] * len(city_ids))))
+            params.extend(city_ids)
+        if start_year is not None:
+            conditions.append("{}.Year >= %s".format(year_table))
+            params.append(start_year)
+        if end_year is not None:
+            conditions.append("{}.Year <= %s".format(year_table))
+            params.append(end_year)
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+        # The yearly series are read in primary key order, so the server streams them without sorting
+        if resolution == "yearly":
+            select_data = """
+            SELECT Cities.Label as City, CityYearSummary.CityId as CityId, CityYearSummary.Year as Year, {}
+            FROM CityYearSummary
+            JOIN Cities ON Cities.CityId = CityYearSummary.CityId
+            {}
+            ORDER BY CityYearSummary.CityId, CityYearSummary.Year
+            """.format(", ".join("CityYearSummary.{0} as {0}".format(c) for c in columns), where)
+        else:
+            select_data = """
+            SELECT Cities.Label as City, StationDetails.CityId as CityId, StationRecords.Year as Year,
+                StationRecords.Month as `Month`, {}
+            FROM StationRecords
+            JOIN StationDetails ON StationRecords.StationId = StationDetails.StationId
+            JOIN Cities ON Cities.CityId = StationDetails.CityId
+            {}
+            GROUP BY StationDetails.CityId, Cities.Label, StationRecords.Year, StationRecords.Month
+            ORDER BY StationDetails.CityId, StationRecords.Year, StationRecords.Month
+            """.format(", ".join("{} as {}".format(EXPORT_COLUMNS[c], c) for c in columns), where)
+
+        return self.stream_query(select_data, params, name="export_" + resolution, batch_size=batch_size)
+
+
+class FeatherBackend:
+    """ Read-only weather data backend reading the columnar (Arrow IPC / Feather) store written by
+    `python -m pipeline columnar`. Files are memory-mapped and partitioned by CityId, and filters are pushed down
+    into the Arrow scan, so a request only reads the partition of the selected city.
+
+    Requires the optional pyarrow dependency.
+    """
+
+    def __init__(self, store_dir):
+        """
+        Args:
+            store_dir (str): Folder written by `python -m pipeline columnar`
+        """
+        # Imported here so pyarrow is only required when the columnar backend is used
+        import pyarrow.dataset as ds
+        import pyarrow.feather as feather
+        import pyarrow.fs as fs
+
+        self._ds = ds
+        self.store_dir = store_dir
+        filesystem = fs.LocalFileSystem(use_mmap=True)
+
+        self.cities_path = os.path.join(store_dir, "cities.feather")
+        self.cities = feather.read_table(self.cities_path, memory_map=True).to_pandas()
+        self.records = ds.dataset(
+            os.path.join(store_dir, "records"), format="ipc", partitioning="hive", filesystem=filesystem)
+        self.daily = ds.dataset(
+            os.path.join(store_dir, "daily"), format="ipc", partitioning="hive", filesystem=filesystem)
+
+        # Trend and anomaly statistics of every city, read on first use and again only when the store is rebuilt
+        self._climatology = None
+        self._climatology_version = None
+        self._climatology_lock = threading.Lock()
+
+    def stats(self):
+        """ Return backend metrics
+        Returns:
+            dict: Number of record and daily partition files
+        """
+        return {
+            "record_files": len(self.records.files),
+            "daily_files": len(self.daily.files)
+        }
+
+    def data_version(self, name="Cities"):
+        """ Get the version of the data, which changes whenever the store is rebuilt
+        Args:
+            name (str): Name of the dataset. Every dataset of the store is rebuilt together, so they share a version
+        Returns:
+            str: Size and modification time of the cities file
+        """
+        stat = os.stat(self.cities_path)
+        return "{}-{}".format(stat.st_size, int(stat.st_mtime))
+
+    def load_cities(self):
+        """ Get the cities in the store
+        Returns:
+            pd.DataFrame: CityId and City (the dropdown label) of every city
+        """
+        return self.cities.loc[:, ['CityId', 'City']].sort_values('CityId').reset_index(drop=True)
+
+    def load_stations(self):
+        """ Get the location of every station mapped to a city
+        Returns:
+            pd.DataFrame: StationId, CityId, Lat and Lon of each station
+        """
+        import pyarrow.feather as feather
+
+        return feather.read_table(os.path.join(self.store_dir, "stations.feather"), memory_map=True).to_pandas()
+
+    def load_country_co2(self):
+        """ The columnar store has no emissions data, so there is no CO2 overlay unless a CO2 index written by
+        `python -m pipeline co2 --index-out` is deployed with it
+        Returns:
+            tuple: Empty frames, see MySQLBackend.load_country_co2
+        """
+        return (pd.DataFrame({'Country': [], 'Year': [], 'Emissions': []}),
+                pd.DataFrame({'CityId': [], 'Country': []}))
+
+    def city_records(self, city_id):
+        """ Get the monthly records of every station in a city, in degrees Fahrenheit
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            pd.DataFrame: StationId, Year, Month, MaxTemp, MinTemp and AvgTemp of each station-month
+        """
+        ds = self._ds
+        table = self.records.to_table(
+            columns=['StationId', 'Year', 'Month', 'MaxTemp', 'MinTemp', 'Temp'],
+            filter=ds.field('CityId') == city_id)
+
+        return table.to_pandas().rename(columns={'Temp': 'AvgTemp'})
+
+    def cities_records(self, city_ids):
+        """ Get the monthly records of every station in several cities in a single scan, in degrees Fahrenheit
+        Args:
+            city_ids (list): CityIds of the cities
+        Returns:
+            pd.DataFrame: CityId, StationId, Year, Month, MaxTemp, MinTemp and AvgTemp of each station-month
+        """
+        ds = self._ds
+        table = self.records.to_table(
+            columns=['CityId', 'StationId', 'Year', 'Month', 'MaxTemp', 'MinTemp', 'Temp'],
+            filter=ds.field('CityId').isin(list(city_ids)))
+
+        return table.to_pandas().rename(columns={'Temp': 'AvgTemp'})
+
+    def _load_climatology(self):
+        """ Read the trend and anomaly statistics of every city, sorted by CityId so a city's rows can be found with a
+        binary search. The files are only read again when the data version of the store changes
+        Returns:
+            tuple: (climatology, decades) DataFrames indexed by CityId
+        """
+        import pyarrow.feather as feather
+
+        version = self.data_version()
+        with self._climatology_lock:
+            if self._climatology is None or version != self._climatology_version:
+                climatology = feather.read_table(
+                    os.path.join(self.store_dir, "climatology.feather"), memory_map=True).to_pandas()
+                decades = feather.read_table(
+                    os.path.join(self.store_dir, "decades.feather"), memory_map=True).to_pandas()
+                self._climatology = (
+                    climatology.sort_values('CityId', kind='mergesort').set_index('CityId', drop=False),
+                    decades.sort_values(['CityId', 'Decade']).set_index('CityId'))
+                self._climatology_version = version
+            return self._climatology
+
+    @staticmethod
+    def _city_rows(df, city_id):
+        """ Get the rows of a city from a frame indexed by a sorted CityId
+        Args:
+            df (pd.DataFrame): Frame indexed by CityId, sorted
+            city_id (int): CityId of the city
+        Returns:
+            pd.DataFrame: The rows of the city, with a default index
+        """
+        start, stop = df.index.searchsorted(city_id, side='left'), df.index.searchsorted(city_id, side='right')
+        return df.iloc[start:stop].reset_index(drop=True)
+
+    def city_climatology(self, city_id):
+        """ Get the precomputed trend and anomaly statistics of a city
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            tuple: (pd.DataFrame of the climatology row, pd.DataFrame of Decade, AvgTempF and AnomalyF)
+        """
+        climatology, decades = self._load_climatology()
+
+        return (self._city_rows(climatology, city_id),
+                self._city_rows(decades, city_id).loc[:, ['Decade', 'AvgTempF', 'AnomalyF']])
+
+    def city_summary(self, city_id, temp_value="Celsius"):
+        """ Calculate the yearly temperatures of a city
+        Args:
+            city_id (int): CityId of the city
+            temp_value (str): Whether the data is to be displayed as Fahrenheit or Celsius.
+        Returns:
+            pd.DataFrame: Year, AvgTemp, MaxTemp and MinTemp for each year
+        """
+        df = self.city_records(city_id)
+        df = df.groupby('Year').agg({'AvgTemp': 'mean', 'MaxTemp': 'max', 'MinTemp': 'min'}).reset_index()
+
+        if temp_value == "Celsius":
+            temps = ['AvgTemp', 'MaxTemp', 'MinTemp']
+            df[temps] = np.round((df[temps].values - 32) * 5 / 9, 3)
+
+        return df
+
+    def cities_summary(self, city_ids, temp_value="Celsius"):
+        """ Calculate the yearly temperatures of several cities with a single scan and groupby
+        Args:
+            city_ids (list): CityIds of the cities
+            temp_value (str): Whether the data is to be displayed as Fahrenheit or Celsius.
+        Returns:
+            pd.DataFrame: CityId, Year, AvgTemp, MaxTemp and MinTemp for each city-year
+        """
+        df = self.cities_records(city_ids)
+        df = df.groupby(['CityId', 'Year']).agg({'AvgTemp': 'mean', 'MaxTemp': 'max', 'MinTemp': 'min'}).reset_index()
+
+        if temp_value == "Celsius":
+            temps = ['AvgTemp', 'MaxTemp', 'MinTemp']
+            df[temps] = np.round((df[temps].values - 32) * 5 / 9, 3)
+
+        return df
+
+    def city_daily_baseline(self, city_id):
+        """ Get the daily maximum temperatures of a city in the first year of its daily records (either 60's, 70's or
+        80's), averaged across its stations, in degrees Fahrenheit
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            pd.DataFrame: DayOfYear (1 to 365, 29 February excluded), Year and MaxTemp
+        """
+        ds = self._ds
+        df = self.daily.to_table(columns=['Date', 'MaxTemp'], filter=ds.field('CityId') == city_id).to_pandas()
+        df['Date'] = pd.to_datetime(df.Date)
+        df = df[(df.Date.dt.year == df.Date.dt.year.min()) & ~((df.Date.dt.month == 2) & (df.Date.dt.day == 29))]
+
+        # Day of the year in a 365 day calendar
+        df['DayOfYear'] = df.Date.dt.dayofyear - (df.Date.dt.is_leap_year & (df.Date.dt.month > 2)).astype(int)
+        df['Year'] = df.Date.dt.year
+        df = df.groupby(['DayOfYear', 'Year']).MaxTemp.mean().round(2).reset_index()
+
+        return df.loc[:, ['DayOfYear', 'Year', 'MaxTemp']]
+
+    def export_series(self, resolution="yearly", city_ids=None, start_year=None, end_year=None, columns=None,
+                      batch_size=5000):
+        """ Stream the yearly or monthly temperature series of cities, for the export API. The cities are scanned and
+        aggregated one partition at a time, so exporting every city only holds one city's records in memory
+        Args:
+            See MySQLBackend.export_series
+        Returns:
+            generator: Lists of up to batch_size row tuples of City, CityId, Year, Month (monthly only) and the
+                columns, ordered by CityId and date
+        """
+        ds = self._ds
+        columns = list(EXPORT_COLUMNS) if columns is None else columns
+        keys = ['Year'] if resolution == "yearly" else ['Year', 'Month']
+        labels = self.cities.set_index('CityId').City
+        city_ids = sorted(labels.index) if city_ids is None else city_ids
+
+        for city_id in city_ids:
+            if city_id not in labels.index:
+                continue
+
+            # Filters pushed down into the Arrow scan
+            condition = ds.field('CityId') == city_id
+            if start_year is not None:
+                condition = condition & (ds.field('Year') >= start_year)
+            if end_year is not None:
+                condition = condition & (ds.field('Year') <= end_year)
+            df = self.records.to_table(
+                columns=['StationId', 'Year', 'Month', 'MaxTemp', 'MinTemp', 'Temp'], filter=condition).to_pandas()
+            if df.empty:
+                continue
+
+            df = df.groupby(keys).agg(
+                {'MaxTemp': 'max', 'MinTemp': 'min', 'Temp': 'mean', 'StationId': 'nunique'}).reset_index()
+            df = df.rename(columns={'MaxTemp': 'MaxTempF', 'MinTemp': 'MinTempF', 'Temp': 'AvgTempF',
+                                    'StationId': 'NumberStations'})
+            for temp in ['MaxTemp', 'MinTemp', 'AvgTemp']:
+                df[temp + 'C'] = np.round((df[temp + 'F'] - 32) * 5 / 9, 3)
+            df.insert(0, 'CityId', city_id)
+            df.insert(0, 'City', labels[city_id])
+
+            # Plain Python values, with missing values as None like the rows of a MySQL cursor
+            df = df.loc[:, ['City', 'CityId'] + keys + columns].astype(object)
+            rows = [tuple(row) for row in df.where(df.notnull(), None).values.tolist()]
+            for i in range(0, len(rows), batch_size):
+                yield rows[i:i + batch_size]
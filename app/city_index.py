@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+
+
+# Format of the index file, shared with the pipeline (data_wrangling/pipeline/cities.py)
+CITY_INDEX_FORMAT = 1
+
+
+class CityIndex:
+    """ Versioned on-disk index of the cities (dropdown label and CityId).
+
+    The index is a small JSON file written by `python -m pipeline cities --index-out` (or by the app the first time it
+    starts). It is read lazily on first use, so app processes start without querying the database, and it is only
+    rebuilt when the backend reports a different data version.
+    """
+
+    def __init__(self, path, source):
+        """
+        Args:
+            path (str): Path of the JSON index file
+            source (callable): Function with no arguments returning the backend used to (re)build the index. Only
+                called when the index has to be built
+        """
+        self.path = path
+        self.source = source
+        self._version = None
+        self._cities = None
+        self._city_ids = None
+        self._city_labels = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        """ Read the index file
+        Returns:
+            bool: True if a valid index was read
+        """
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if data.get("format") != CITY_INDEX_FORMAT:
+            return False
+
+        self._set(data["version"], data["cities"])
+        return True
+
+    def _set(self, version, rows):
+        """ Replace the in-memory index
+        Args:
+            version (str): Data version the index was built from
+            rows (list): [CityId, label] pairs
+        """
+        self._city_ids = {label: int(city_id) for city_id, label in rows}
+        self._city_labels = {int(city_id): label for city_id, label in rows}
+        self._cities = [label for _, label in rows]
+        self._version = version
+
+    def _build(self, backend, version):
+        """ Build the index from the backend and write it to disk
+        Args:
+            backend: Data backend (MySQLBackend or FeatherBackend)
+            version (str): Current data version of the backend
+        """
+        df = backend.load_cities()
+        rows = [[int(city_id), label] for city_id, label in zip(df.CityId, df.City)]
+        self._set(version, rows)
+
+        # Write to a temporary file first so other processes never read a half written index
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as file:
+            json.dump({"format": CITY_INDEX_FORMAT, "version": version, "cities": rows}, file)
+        os.replace(tmp_path, self.path)
+
+    def _ensure_loaded(self):
+        """ Read the index file on first use, building it from the backend if it does not exist """
+        if self._cities is not None:
+            return
+        with self._lock:
+            if self._cities is None and not self._read():
+                backend = self.source()
+                self._build(backend, backend.data_version())
+
+    @property
+    def version(self):
+        self._ensure_loaded()
+        return self._version
+
+    @property
+    def cities(self):
+        """ list: City dropdown labels, in CityId order """
+        self._ensure_loaded()
+        return self._cities
+
+    @property
+    def city_ids(self):
+        """ dict: City dropdown label to CityId """
+        self._ensure_loaded()
+        return self._city_ids
+
+    @property
+    def city_labels(self):
+        """ dict: CityId to city dropdown label """
+        self._ensure_loaded()
+        return self._city_labels
+
+    def refresh(self):
+        """ Rebuild the index if the data version of the backend has changed since it was built
+        Returns:
+            bool: True if the index was rebuilt
+        """
+        self._ensure_loaded()
+        backend = self.source()
+        version = backend.data_version()
+        with self._lock:
+            if version == self._version:
+                return False
+            self._build(backend, version)
+            return True
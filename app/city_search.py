@@ -0,0 +1,116 @@
+import bisect
+import re
+from collections import Counter
+
+
+class CitySearch:
+    """ In-memory typeahead index over the city dropdown labels.
+
+    Word prefixes are looked up in a sorted token list (bisect), and misspelt or mid-word queries fall back to a
+    trigram index. Results are ranked so that labels starting with the query come first, then labels with a word
+    starting with the query, then the closest trigram matches.
+    """
+
+    def __init__(self, cities, min_trigram_similarity=0.5):
+        """
+        Args:
+            cities (list): City dropdown labels (e.g. "New York, New York, United States")
+            min_trigram_similarity (float): Fraction of the query's trigrams a label must contain to be a fuzzy match
+        """
+        self.cities = list(cities)
+        self.min_trigram_similarity = min_trigram_similarity
+        self._normalised = [self.normalise(c) for c in self.cities]
+
+        # Sorted (token, city index) pairs for prefix lookups
+        self._tokens = sorted(
+            (token, i) for i, label in enumerate(self._normalised) for token in set(label.split()))
+        self._token_keys = [token for token, _ in self._tokens]
+
+        # Trigram to city indices for fuzzy lookups
+        self._trigrams = {}
+        for i, label in enumerate(self._normalised):
+            for trigram in self.trigrams(label):
+                self._trigrams.setdefault(trigram, []).append(i)
+
+    @staticmethod
+    def normalise(text):
+        """ Lower case text and replace punctuation with spaces
+        Args:
+            text (str): Label or query
+        Returns:
+            str: Normalised text
+        """
+        return " ".join(re.sub(r"[^\w]+", " ", text.lower()).split())
+
+    @staticmethod
+    def trigrams(text):
+        """ Get the trigrams of each word of a normalised text, padded so word starts are weighted
+        Args:
+            text (str): Normalised text
+        Returns:
+            set: Trigrams
+        """
+        trigrams = set()
+        for word in text.split():
+            word = "  {} ".format(word)
+            trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+        return trigrams
+
+    def _prefix_matches(self, query):
+        """ Get the cities with a word starting with each word of the query
+        Args:
+            query (str): Normalised query
+        Returns:
+            set: City indices
+        """
+        matches = None
+        for word in query.split():
+            start = bisect.bisect_left(self._token_keys, word)
+            end = bisect.bisect_left(self._token_keys, word + "￿", start)
+            found = set(i for _, i in self._tokens[start:end])
+            matches = found if matches is None else matches & found
+        return matches or set()
+
+    def _trigram_matches(self, query):
+        """ Get the cities sharing enough trigrams with the query
+        Args:
+            query (str): Normalised query
+        Returns:
+            dict: City index to trigram similarity (0 to 1)
+        """
+        query_trigrams = self.trigrams(query)
+        if not query_trigrams:
+            return {}
+
+        counts = Counter()
+        for trigram in query_trigrams:
+            counts.update(self._trigrams.get(trigram, ()))
+
+        return {i: n / len(query_trigrams) for i, n in counts.items()
+                if n / len(query_trigrams) >= self.min_trigram_similarity}
+
+    def search(self, query, limit=20, offset=0):
+        """ Search the cities
+        Args:
+            query (str): Text typed by the user
+            limit (int): Maximum number of results to return
+            offset (int): Number of results to skip, for pagination
+        Returns:
+            tuple: (list of matching labels, best first, total number of matches)
+        """
+        query = self.normalise(query or "")
+        if not query:
+            return [], 0
+
+        # Score each match: label prefix (3), word prefixes (2), otherwise the trigram similarity
+        scores = {}
+        for i in self._prefix_matches(query):
+            scores[i] = 3.0 if self._normalised[i].startswith(query) else 2.0
+        if len(query) >= 3:
+            for i, similarity in self._trigram_matches(query).items():
+                scores.setdefault(i, similarity)
+
+        # Rank by score, then shorter (less specific) labels first
+        ranked = sorted(scores, key=lambda i: (-scores[i], len(self.cities[i]), self.cities[i]))
+
+        return [self.cities[i] for i in ranked[offset:offset + limit]], len(ranked)
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+
+
+# Format of the index file, shared with the pipeline (data_wrangling/pipeline/co2.py)
+CO2_INDEX_FORMAT = 2
+
+
+class CO2Index:
+    """ In-memory index of the national CO2 emissions of each country, by year, and of the country of each city.
+
+    The emissions come from the precomputed CountryYearCO2 table, already aligned to the years of the city temperature
+    summaries, and are written to a small JSON file by `python -m pipeline co2 --index-out` (or by the app the first
+    time it needs them). Like the CityIndex, the file is read lazily on first use and only rebuilt when the backend
+    reports a different data version, so the emissions overlay never queries the database. The version combines the
+    Cities and CountryYearCO2 versions, so re-running `pipeline co2` is picked up as well as new cities.
+    """
+
+    def __init__(self, path, source):
+        """
+        Args:
+            path (str): Path of the JSON index file
+            source (callable): Function with no arguments returning the backend used to (re)build the index. Only
+                called when the index has to be built
+        """
+        self.path = path
+        self.source = source
+        self._version = None
+        self._emissions = None
+        self._countries = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        """ Read the index file
+        Returns:
+            bool: True if a valid index was read
+        """
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if data.get("format") != CO2_INDEX_FORMAT:
+            return False
+
+        self._set(data["version"], data["countries"], data["cities"])
+        return True
+
+    def _set(self, version, countries, cities):
+        """ Replace the in-memory index
+        Args:
+            version (str): Data version the index was built from
+            countries (dict): Country to {"years": [...], "emissions": [...]}
+            cities (list): [CityId, country] pairs
+        """
+        self._emissions = {country: dict(zip(series["years"], series["emissions"]))
+                           for country, series in countries.items()}
+        self._countries = {int(city_id): country for city_id, country in cities}
+        self._version = version
+
+    @staticmethod
+    def _backend_version(backend):
+        """ Get the current version of the index data from the backend
+        Args:
+            backend: Data backend (MySQLBackend or FeatherBackend)
+        Returns:
+            str: The Cities and CountryYearCO2 versions, e.g. "3.2"
+        """
+        return "{}.{}".format(backend.data_version('Cities'), backend.data_version('CountryYearCO2'))
+
+    def _build(self, backend, version):
+        """ Build the index from the backend and write it to disk
+        Args:
+            backend: Data backend (MySQLBackend or FeatherBackend)
+            version (str): Current data version of the backend
+        """
+        co2, city_countries = backend.load_country_co2()
+        countries = {}
+        for country, year, emissions in zip(co2.Country, co2.Year, co2.Emissions):
+            series = countries.setdefault(country, {"years": [], "emissions": []})
+            series["years"].append(int(year))
+            series["emissions"].append(None if emissions != emissions else round(float(emissions), 3))
+        cities = [[int(city_id), country] for city_id, country in zip(city_countries.CityId, city_countries.Country)
+                  if country in countries]
+        self._set(version, countries, cities)
+
+        # Write to a temporary file first so other processes never read a half written index
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as file:
+            json.dump({"format": CO2_INDEX_FORMAT, "version": version, "countries": countries, "cities": cities},
+                      file)
+        os.replace(tmp_path, self.path)
+
+    def _ensure_loaded(self):
+        """ Read the index file on first use, building it from the backend if it does not exist """
+        if self._emissions is not None:
+            return
+        with self._lock:
+            if self._emissions is None and not self._read():
+                backend = self.source()
+                self._build(backend, self._backend_version(backend))
+
+    @property
+    def version(self):
+        self._ensure_loaded()
+        return self._version
+
+    def country(self, city_id):
+        """ Get the country of a city
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            str: The country, or None if it has no emissions data
+        """
+        self._ensure_loaded()
+        return self._countries.get(city_id)
+
+    def emissions(self, country, years):
+        """ Get the emissions of a country in a list of years
+        Args:
+            country (str): Name of the country
+            years (list): Years to look up, e.g. the years of a city's temperature summary
+        Returns:
+            list: Emissions in million tonnes, None for the years without data
+        """
+        self._ensure_loaded()
+        by_year = self._emissions.get(country, {})
+        return [by_year.get(year) for year in years]
+
+    def refresh(self):
+        """ Rebuild the index if the data version of the backend has changed since it was built
+        Returns:
+            bool: True if the index was rebuilt
+        """
+        self._ensure_loaded()
+        backend = self.source()
+        version = self._backend_version(backend)
+        with self._lock:
+            if version == self._version:
+                return False
+            self._build(backend, version)
+            return True
@@ -0,0 +1,245 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """ Raised when a connection could not be checked out of the pool before the timeout expired """
+
+
+class ConnectionPool:
+    """ Thread-safe pool of reusable DB-API connections.
+
+    Connections are created by the connect callable passed in, so the pool works with pymysql as well as
+    sqlite3 (use check_same_thread=False) or any other DB-API driver.
+
+    Example:
+        pool = ConnectionPool(lambda: pymysql.connect(host='localhost', autocommit=True), max_size=10)
+        with pool.connection() as connection:
+            df = pd.read_sql(sql, connection)
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10, recycle=3600, health_check=None):
+        """
+        Args:
+            connect (callable): Function with no arguments which opens and returns a new connection
+            min_size (int): Number of connections opened up front and kept open
+            max_size (int): Maximum number of connections open at any one time
+            timeout (float): Seconds to wait for a free connection before raising PoolTimeout
+            recycle (float): Seconds after which a connection is closed and replaced. None disables recycling
+            health_check (callable): Function taking a connection and raising if it is unusable.
+                Defaults to ping() where the driver supports it, otherwise "SELECT 1"
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._health_check = health_check or self._default_health_check
+
+        # Idle connections are reused most recently returned first, creation times are tracked for recycling. They are
+        # keyed by the connection itself, since the id of a closed connection can be reused by a new one
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+        # Metrics exposed through stats()
+        self._metrics = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "recycled": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0
+        }
+
+        # Open the minimum number of connections
+        for _ in range(min_size):
+            self._size += 1
+            self._idle.append(self._open())
+
+    @staticmethod
+    def _default_health_check(connection):
+        """ Raise if the connection is no longer usable
+        Args:
+            connection: DB-API connection to be checked
+        """
+        if hasattr(connection, "ping"):
+            connection.ping(reconnect=False)
+        else:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def _open(self):
+        """ Open a new connection. The caller must already have reserved a slot by incrementing the pool size
+        Returns:
+            A new DB-API connection
+        """
+        try:
+            connection = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._created_at[connection] = time.monotonic()
+            self._metrics["created"] += 1
+        return connection
+
+    def _discard(self, connection):
+        """ Close a connection and release its slot in the pool
+        Args:
+            connection: DB-API connection to be closed
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+        with self._cond:
+            self._created_at.pop(connection, None)
+            self._size -= 1
+            self._metrics["closed"] += 1
+            self._cond.notify()
+
+    def _is_stale(self, connection):
+        """ Check whether the connection has exceeded the recycle age
+        Args:
+            connection: DB-API connection to be checked
+        Returns:
+            bool: True if the connection should be replaced
+        """
+        if self.recycle is None:
+            return False
+        created = self._created_at.get(connection, 0)
+        return time.monotonic() - created > self.recycle
+
+    def checkout(self):
+        """ Take a healthy connection from the pool, opening a new one if none are idle and the pool is not full
+        Raises:
+            PoolTimeout: If no connection became available within the timeout
+        Returns:
+            A DB-API connection which must be returned with checkin()
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            connection = None
+            open_new = False
+
+            # Wait for an idle connection or a free slot
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics["timeouts"] += 1
+                        raise PoolTimeout("Timed out after {}s waiting for a database connection".format(self.timeout))
+                    self._cond.wait(remaining)
+
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                if self._idle:
+                    connection = self._idle.pop()
+                else:
+                    # Reserve the slot while holding the lock so concurrent checkouts cannot exceed max_size
+                    self._size += 1
+                    open_new = True
+
+            if open_new:
+                connection = self._open()
+            else:
+                # Recycle stale connections and replace connections which fail the health check
+                if self._is_stale(connection):
+                    with self._cond:
+                        self._metrics["recycled"] += 1
+                    self._discard(connection)
+                    continue
+                try:
+                    self._health_check(connection)
+                except Exception:
+                    with self._cond:
+                        self._metrics["health_check_failures"] += 1
+                    self._discard(connection)
+                    continue
+
+            # Record wait time
+            waited = time.monotonic() - start
+            with self._cond:
+                self._metrics["checkouts"] += 1
+                self._metrics["wait_time_total"] += waited
+                self._metrics["wait_time_max"] = max(self._metrics["wait_time_max"], waited)
+
+            return connection
+
+    def checkin(self, connection, discard=False):
+        """ Return a connection to the pool
+        Args:
+            connection: DB-API connection taken with checkout()
+            discard (bool): Close the connection rather than reusing it (e.g. after a connection error)
+        """
+        if discard or self._closed or self._is_stale(connection):
+            self._discard(connection)
+            return
+
+        with self._cond:
+            self._idle.append(connection)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """ Context manager which checks a connection out of the pool and returns it afterwards.
+        The connection is discarded rather than reused if the block raises an exception.
+        """
+        connection = self.checkout()
+        try:
+            yield connection
+        except Exception:
+            self.checkin(connection, discard=True)
+            raise
+        else:
+            self.checkin(connection)
+
+    def close(self):
+        """ Close all idle connections and stop handing out new ones """
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+        for connection in idle:
+            self._discard(connection)
+
+    def stats(self):
+        """ Return the pool metrics
+        Returns:
+            dict: Pool size, connections in use and idle, and counters for created, closed, checkouts,
+                timeouts, health check failures, recycled connections and wait times (seconds)
+        """
+        with self._cond:
+            stats = dict(self._metrics)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["min_size"] = self.min_size
+            stats["max_size"] = self.max_size
+            stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+            return stats
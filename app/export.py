@@ -0,0 +1,119 @@
+# Streaming encoders of the bulk export API (/api/export). Each takes the column names and an iterator of row batches
+# (lists of tuples, as read from a server-side cursor) and yields encoded chunks, so an export is sent to the client
+# batch by batch and never held in memory. pyarrow is only imported for Arrow exports, as in FeatherBackend
+import csv
+import io
+import json
+from decimal import Decimal
+
+
+# Export formats and their content types. None of them is in Flask-Compress's default mimetypes, so the streamed
+# responses are not buffered for compression
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+# Columns exported as integers in Arrow. City is a string and every other column a float
+INTEGER_COLUMNS = {"CityId", "Year", "Month", "NumberStations"}
+
+
+def _plain_rows(batch):
+    """ Convert the Decimal values MySQL returns for aggregates into floats """
+    return [tuple(float(v) if isinstance(v, Decimal) else v for v in row) for row in batch]
+
+
+def csv_chunks(columns, batches):
+    """ Encode rows as CSV with a header line
+    Args:
+        columns (list): Column names
+        batches (iterable): Lists of row tuples
+    Returns:
+        generator: UTF-8 encoded chunks, one per batch
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(_plain_rows(batch))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+    # The header alone, when there are no rows
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def ndjson_chunks(columns, batches):
+    """ Encode rows as newline delimited JSON objects
+    Args:
+        columns (list): Column names
+        batches (iterable): Lists of row tuples
+    Returns:
+        generator: UTF-8 encoded chunks, one per batch
+    """
+    for batch in batches:
+        lines = [json.dumps(dict(zip(columns, row)), separators=(",", ":")) for row in _plain_rows(batch)]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink:
+    """ File-like object collecting the bytes written by an Arrow stream writer, so they can be yielded """
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def arrow_chunks(columns, batches):
+    """ Encode rows as an Arrow IPC stream, with one record batch per batch of rows
+    Args:
+        columns (list): Column names
+        batches (iterable): Lists of row tuples
+    Returns:
+        generator: Chunks of the stream (the schema, then one per record batch and the end of stream marker)
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([
+        (c, pa.string() if c == "City" else pa.int64() if c in INTEGER_COLUMNS else pa.float64()) for c in columns])
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    yield sink.take()
+
+    for batch in batches:
+        values = list(zip(*_plain_rows(batch)))
+        writer.write_batch(pa.record_batch(
+            [pa.array(values[i], type=field.type) for i, field in enumerate(schema)], schema=schema))
+        yield sink.take()
+
+    writer.close()
+    yield sink.take()
+
+
+def encode(file_format, columns, batches):
+    """ Encode an export in one of the EXPORT_FORMATS
+    Args:
+        file_format (str): "csv", "ndjson" or "arrow"
+        columns (list): Column names
+        batches (iterable): Lists of row tuples
+    Returns:
+        generator: Encoded chunks
+    """
+    encoders = {"csv": csv_chunks, "ndjson": ndjson_chunks, "arrow": arrow_chunks}
+    return encoders[file_format](columns, batches)
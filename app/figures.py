@@ -0,0 +1,126 @@
+# Figure data is built here as compact JSON-ready payloads rather than from go.Scatter traces of full pandas Series:
+# values are rounded to the precision displayed, long series are downsampled, and each trace carries its values in
+# both temperature units so the browser (assets/weather.js) switches unit by swapping y arrays without a request.
+# numpy is imported on first use, as in weather_records, so importing the app does not pay for it
+
+
+def compact_values(values, decimals=1):
+    """ Round numeric values for JSON, with missing values as null
+    Args:
+        values (array-like): Numeric values
+        decimals (int): Number of decimals kept
+    Returns:
+        list: Rounded floats, None where a value is missing
+    """
+    import numpy as np
+
+    values = np.round(np.asarray(values, dtype=float), decimals)
+    return [None if v != v else v for v in values.tolist()]
+
+
+def compact_labels(values, date_unit="D"):
+    """ Convert x values (years, dates or category labels) into short JSON values
+    Args:
+        values (array-like): Integers, dates or strings
+        date_unit (str): Precision of dates, "D" for YYYY-MM-DD or "M" for YYYY-MM
+    Returns:
+        list: Integers for integer values, otherwise strings
+    """
+    import numpy as np
+
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        return values.tolist()
+    if values.dtype.kind == "M":
+        return np.datetime_as_string(values, unit=date_unit).tolist()
+    return [str(v) for v in values]
+
+
+def lttb_indices(y, max_points):
+    """ Select the points of a series to keep with the Largest-Triangle-Three-Buckets algorithm, which preserves the
+    visual shape (peaks and troughs) of a line far better than taking every nth point
+    Args:
+        y (np.ndarray): Values of the series, at evenly spaced x positions, without missing values
+        max_points (int): Number of points to keep (at least 3)
+    Returns:
+        np.ndarray: Sorted indices of the points to keep
+    """
+    import numpy as np
+
+    n = len(y)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept, and one point is chosen from each bucket in between
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = np.empty(max_points, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # The average of the next bucket (or the last point) is the third vertex of the triangle
+        if i + 2 < len(edges):
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        # Keep the point of this bucket forming the largest triangle with the previously kept point
+        prev = selected[i]
+        areas = np.abs((x[prev] - next_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (next_y - y[prev]))
+        selected[i + 1] = start + int(np.argmax(areas))
+
+    return selected
+
+
+def unit_trace(name, x, temps_f, max_points=None, decimals=1, date_unit="D", **attributes):
+    """ Build a compact line trace with its y values in both temperature units
+    Args:
+        name (str): Trace name
+        x (array-like): x values
+        temps_f (array-like): Temperatures in degrees Fahrenheit
+        max_points (int): Downsample longer series to this number of points with LTTB. None keeps every point
+        decimals (int): Number of decimals of the temperatures
+        date_unit (str): Precision of date x values (see compact_labels)
+        attributes: Other plotly trace attributes (e.g. mode)
+    Returns:
+        dict: Trace with x, name and y as {"Fahrenheit": [...], "Celsius": [...]}
+    """
+    import numpy as np
+
+    x = np.asarray(x)
+    temps_f = np.asarray(temps_f, dtype=float)
+
+    # Downsample the points which have a value, so gaps do not skew the buckets
+    if max_points is not None and len(temps_f) > max_points:
+        present = np.flatnonzero(~np.isnan(temps_f))
+        keep = present[lttb_indices(temps_f[present], max_points)]
+        x, temps_f = x[keep], temps_f[keep]
+
+    trace = {
+        "type": "scatter",
+        "name": name,
+        "x": compact_labels(x, date_unit),
+        "y": {
+            "Fahrenheit": compact_values(temps_f, decimals),
+            "Celsius": compact_values((temps_f - 32) * 5 / 9, decimals)
+        }
+    }
+    trace.update(attributes)
+
+    return trace
+
+
+def unit_figure(traces, layout=None):
+    """ Build the payload of a figure whose traces are in both temperature units, rendered by
+    dash_clientside.weather.renderFigure
+    Args:
+        traces (list): Traces built with unit_trace
+        layout (dict): Plotly layout
+    Returns:
+        dict: The figure payload
+    """
+    return {"traces": traces, "layout": layout or {}}
@@ -0,0 +1,304 @@
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# Upper bounds (seconds) of the latency histogram buckets, from a cached lookup to a slow upstream call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_PREFIX = "globalwarming_"
+
+
+class MetricsRegistry:
+    """ Thread-safe registry of latency histograms and counters, rendered in the Prometheus text format.
+
+    Recording a span is a couple of clock reads, a bisect and a few additions under a lock, so the instrumentation
+    can be left on in production. Gauges (cache, pool and client statistics) are read from collectors at scrape time.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (tuple): Upper bounds in seconds of the histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        """ Set the HELP text of a metric
+        Args:
+            name (str): Metric name, without the prefix
+            help_text (str): Description of the metric
+        """
+        self._help[name] = help_text
+
+    def observe(self, name, seconds, **labels):
+        """ Record a duration in a histogram
+        Args:
+            name (str): Histogram name, without the prefix and the _seconds suffix
+            seconds (float): Duration
+            labels: Label values of the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def inc(self, name, value=1, **labels):
+        """ Increment a counter
+        Args:
+            name (str): Counter name, without the prefix and the _total suffix
+            value (float): Amount to add
+            labels: Label values of the series
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_collector(self, collector):
+        """ Register a function called at scrape time for gauges
+        Args:
+            collector (callable): Returns a dict of {gauge name: value} or {gauge name: {labels tuple: value}}
+        Returns:
+            callable: The collector, so this can be used as a decorator
+        """
+        self._collectors.append(collector)
+        return collector
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return "{" + ",".join('{}="{}"'.format(k, escape(v)) for k, v in pairs) + "}"
+
+    def _header(self, lines, name, metric, metric_type):
+        if name in self._help:
+            lines.append("# HELP {}{} {}".format(METRIC_PREFIX, metric, self._help[name]))
+        lines.append("# TYPE {}{} {}".format(METRIC_PREFIX, metric, metric_type))
+
+    def render(self):
+        """ Render every metric in the Prometheus text exposition format
+        Returns:
+            str: The metrics page
+        """
+        with self._lock:
+            histograms = {key: ([c for c in s[0]], s[1], s[2]) for key, s in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+
+        # Histograms, with cumulative bucket counts
+        for name in sorted({key[0] for key in histograms}):
+            metric = name + "_seconds"
+            self._header(lines, name, metric, "histogram")
+            for (series_name, labels), (counts, total, count) in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("{}{}_bucket{} {}".format(METRIC_PREFIX, metric, self._labels(labels, [("le", le)]),
+                                                           cumulative))
+                lines.append("{}{}_sum{} {}".format(METRIC_PREFIX, metric, self._labels(labels), repr(total)))
+                lines.append("{}{}_count{} {}".format(METRIC_PREFIX, metric, self._labels(labels), count))
+
+        # Counters
+        for name in sorted({key[0] for key in counters}):
+            self._header(lines, name, name + "_total", "counter")
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append("{}{}_total{} {}".format(METRIC_PREFIX, name, self._labels(labels), value))
+
+        # Gauges read at scrape time. A failing collector must not break the whole page
+        for collector in self._collectors:
+            try:
+                gauges = collector()
+            except Exception:
+                continue
+            for name, value in sorted(gauges.items()):
+                self._header(lines, name, name, "gauge")
+                series = value if isinstance(value, dict) else {(): value}
+                for labels, v in sorted(series.items()):
+                    if isinstance(v, (int, float)) and not isinstance(v, bool):
+                        lines.append("{}{}{} {}".format(METRIC_PREFIX, name, self._labels(labels), v))
+
+        return "\n".join(lines) + "\n"
+
+
+# Registry shared by the app, its backends and API clients
+metrics = MetricsRegistry()
+metrics.describe("sql_query", "Duration of SQL queries run by the MySQL backend")
+metrics.describe("upstream_request", "Duration of upstream API requests")
+metrics.describe("aggregation", "Duration of the data reads and aggregation steps of WeatherRecords")
+metrics.describe("callback", "Duration of the Dash callback functions")
+metrics.describe("http_request", "Duration of HTTP requests, including response serialisation")
+metrics.describe("errors", "Number of spans which raised an exception")
+metrics.describe("slow_queries", "Number of SQL queries slower than the slow query threshold")
+metrics.describe("exports", "Number of bulk exports started")
+
+
+class span:
+    """ Context manager timing a block of code into a histogram of the shared registry, e.g.
+
+        with span("aggregation", step="city_summary"):
+            ...
+
+    Exceptions are counted in globalwarming_errors_total (labelled with the span name) and re-raised.
+    """
+
+    __slots__ = ("name", "labels", "expected", "start", "elapsed")
+
+    def __init__(self, name, expected=(), **labels):
+        """
+        Args:
+            name (str): Histogram name
+            expected (tuple): Exception types used for control flow (e.g. Dash's PreventUpdate), not counted as errors
+            labels: Label values of the series
+        """
+        self.name = name
+        self.expected = expected
+        self.labels = labels
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        metrics.observe(self.name, self.elapsed, **self.labels)
+        if exc_type is not None and not issubclass(exc_type, self.expected):
+            metrics.inc("errors", span=self.name, **self.labels)
+        return False
+
+
+def timed(name, expected=(), **labels):
+    """ Decorator timing every call of a function with a span
+    Args:
+        name (str): Histogram name
+        expected (tuple): Exception types not counted as errors
+        labels: Label values of the series
+    Returns:
+        callable: The decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, expected, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SamplingProfiler:
+    """ Opt-in statistical profiler. A background thread samples the stack of every other thread at a fixed
+    interval and counts the collapsed stacks, which can be rendered as a flame graph (flamegraph.pl, speedscope).
+
+    Nothing runs until start() is called, and sampling only walks frames, so it is safe to toggle on a live server
+    for a short period.
+    """
+
+    def __init__(self, interval=0.01, max_stacks=20000):
+        """
+        Args:
+            interval (float): Seconds between samples
+            max_stacks (int): Maximum number of distinct stacks kept, to bound the memory used
+        """
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self.started = None
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        """ Start sampling, discarding the previous profile
+        Args:
+            interval (float): Seconds between samples. Defaults to the interval the profiler was created with
+        Returns:
+            bool: False if the profiler was already running
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self.interval = interval or self.interval
+            self._stacks = Counter()
+            self.samples = 0
+            self.started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """ Stop sampling. The profile is kept until the next start()
+        Returns:
+            bool: False if the profiler was not running
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return False
+            self._stop.set()
+            self._thread = None
+        thread.join()
+        return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            keys = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                keys.append(";".join(reversed(stack)))
+
+            # Counted under the lock, as collapsed() may be reading the stacks from a request thread
+            with self._lock:
+                for key in keys:
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+                self.samples += 1
+
+    def collapsed(self, limit=None):
+        """ Render the profile as collapsed stacks, one "frame;frame;frame count" line per stack
+        Args:
+            limit (int): Only include the most frequent stacks
+        Returns:
+            str: The collapsed stacks, most frequent first
+        """
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+        return "".join("{} {}\n".format(stack, count) for stack, count in stacks)
+
+
+# Profiler toggled through the app's debug endpoints, which are only served when GLOBALWARMING_PROFILER=1
+profiler = SamplingProfiler()
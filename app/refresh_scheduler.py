@@ -0,0 +1,258 @@
+import datetime
+import logging
+import threading
+import time
+from collections import Counter
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: every worker process runs its own scheduler
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """ Token bucket limiting the number of upstream API calls made by background refreshes """
+
+    def __init__(self, calls_per_minute=30, calls_per_day=None):
+        """
+        Args:
+            calls_per_minute (float): Sustained number of calls allowed per minute
+            calls_per_day (int): Daily quota of the API plan. None for no daily limit
+        """
+        self.rate = calls_per_minute / 60.0
+        self.capacity = max(1.0, float(calls_per_minute))
+        self.calls_per_day = calls_per_day
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._day = datetime.date.today()
+        self._calls_today = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, calls=1):
+        """ Take tokens for a number of calls if they are available
+        Args:
+            calls (int): Number of upstream calls about to be made
+        Returns:
+            bool: True if the calls are allowed
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # Reset the daily quota at midnight
+            today = datetime.date.today()
+            if today != self._day:
+                self._day = today
+                self._calls_today = 0
+
+            if self._tokens < calls:
+                return False
+            if self.calls_per_day is not None and self._calls_today + calls > self.calls_per_day:
+                return False
+
+            self._tokens -= calls
+            self._calls_today += calls
+            return True
+
+    def charge(self, calls):
+        """ Count calls which were made without being acquired first (e.g. more than were reserved), so they still
+        use up the rate and daily quota
+        Args:
+            calls (int): Number of upstream calls made
+        """
+        with self._lock:
+            self._tokens -= calls
+            self._calls_today += calls
+
+
+class RefreshScheduler:
+    """ Background thread which keeps the Apixu data of the most popular cities warm.
+
+    Callbacks report the cities users select with record(). Every interval the top_n cities are refreshed, so their
+    forecasts are served from the cache (stale-while-revalidate) rather than blocking on the network.
+
+    With a lock_path, only the worker process holding an exclusive lock on that file runs the refresh cycles, so the
+    Apixu quota is not spent once per gunicorn worker. The other workers try to take the lock every interval, and one
+    of them takes over if the holder exits.
+    """
+
+    def __init__(self, apixu, top_n=20, interval=10 * 60, popularity_decay=0.9, rate_limiter=None,
+                 min_backoff=30, max_backoff=60 * 60, lock_path=None):
+        """
+        Args:
+            apixu (ApixuWeather): Client whose caches are refreshed
+            top_n (int): Number of most popular cities to keep warm
+            interval (float): Seconds between refresh cycles
+            popularity_decay (float): Factor the popularity counts are multiplied by after each cycle, so recent
+                traffic counts more than old traffic
+            rate_limiter (RateLimiter): Limit on upstream calls. Defaults to 30 calls per minute
+            min_backoff (float): Seconds to wait after the first failed refresh
+            max_backoff (float): Maximum seconds to wait after repeated failures
+            lock_path (str): File locked by the one worker process which runs the refreshes. None to always run them
+        """
+        self.apixu = apixu
+        self.top_n = top_n
+        self.interval = interval
+        self.popularity_decay = popularity_decay
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.lock_path = lock_path
+        self._lock_file = None
+
+        self._popularity = Counter()
+        self._failures = {}
+        self._backoff_until = {}
+        self._global_backoff_until = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Counters for monitoring
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.rate_limited = 0
+
+    def record(self, city_value):
+        """ Record a request for a city
+        Args:
+            city_value (str): Name of the city selected by a user
+        """
+        with self._lock:
+            self._popularity[city_value] += 1
+
+    def popular_cities(self):
+        """ Get the most popular cities
+        Returns:
+            list: Names of the top_n cities, most popular first
+        """
+        with self._lock:
+            return [city for city, _ in self._popularity.most_common(self.top_n)]
+
+    def start(self):
+        """ Start the background refresh thread """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="RefreshScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stop the background refresh thread
+        Args:
+            timeout (float): Seconds to wait for the thread to finish
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_leader(self):
+        """ Take (or keep) the lock which elects the worker process running the refreshes
+        Returns:
+            bool: True if this process runs the refreshes
+        """
+        if self.lock_path is None or fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _run(self):
+        """ Refresh the popular cities every interval until stopped, if this process holds the scheduler lock """
+        while not self._stop.is_set():
+            try:
+                if self.is_leader():
+                    self.run_once()
+            except Exception:
+                logger.exception("Refresh cycle failed")
+            self._stop.wait(self.interval)
+
+    def _backoff(self, city_value, error):
+        """ Schedule the next attempt for a city after a failure, backing off exponentially
+        Args:
+            city_value (str): Name of the city which failed to refresh
+            error (Exception): The error raised by the refresh
+        """
+        failures = self._failures.get(city_value, 0) + 1
+        self._failures[city_value] = failures
+        delay = min(self.max_backoff, self.min_backoff * 2 ** (failures - 1))
+        self._backoff_until[city_value] = time.monotonic() + delay
+
+        # Back off globally if the API reports that the quota or rate limit has been hit
+        response = getattr(error, "response", None)
+        if response is not None and response.status_code in (403, 429):
+            self._global_backoff_until = time.monotonic() + delay
+        logger.warning("Refresh of %s failed (%s), retrying in %ss", city_value, error, delay)
+
+    def run_once(self, today=None):
+        """ Run a single refresh cycle over the most popular cities
+        Args:
+            today (datetime.date): Today's date. Defaults to the current date
+        Returns:
+            int: Number of cities refreshed
+        """
+        today = today or datetime.date.today()
+        refreshed = 0
+
+        for city_value in self.popular_cities():
+            now = time.monotonic()
+            if self._stop.is_set() or now < self._global_backoff_until:
+                break
+            if now < self._backoff_until.get(city_value, 0):
+                continue
+
+            # A refresh costs one forecast call plus one call per history day missing from the cache
+            calls = len(self.apixu.missing_history(city_value, today)) + 1
+            if not self.rate_limiter.try_acquire(calls):
+                self.rate_limited += 1
+                break
+
+            try:
+                made = self.apixu.refresh(city_value, today)
+            except (requests.RequestException, ValueError, KeyError) as error:
+                self.refresh_failures += 1
+                self._backoff(city_value, error)
+                continue
+
+            # Another request may have evicted history days in the meantime
+            if made > calls:
+                self.rate_limiter.charge(made - calls)
+
+            self._failures.pop(city_value, None)
+            self._backoff_until.pop(city_value, None)
+            self.refreshes += 1
+            refreshed += 1
+
+        # Decay the popularity counts so the ranking follows recent traffic
+        with self._lock:
+            for city_value in list(self._popularity):
+                self._popularity[city_value] *= self.popularity_decay
+                if self._popularity[city_value] < 0.01:
+                    del self._popularity[city_value]
+
+        return refreshed
+
+    def stats(self):
+        """ Return the scheduler counters
+        Returns:
+            dict: Number of tracked cities, refreshes, failures and rate limited cycles
+        """
+        with self._lock:
+            tracked = len(self._popularity)
+        return {
+            "tracked_cities": tracked,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "rate_limited": self.rate_limited,
+            "backing_off": sum(1 for t in self._backoff_until.values() if t > time.monotonic())
+        }
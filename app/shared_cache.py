@@ -0,0 +1,360 @@
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process single-flight, every worker computes its own misses
+    fcntl = None
+
+
+class SharedCache:
+    """ Cache of computed city aggregates shared by every worker process on the host, stored as files in a local
+    directory.
+
+    Values (DataFrames, arrays and dicts of them) are pickled with the highest protocol, which stores the NumPy
+    column buffers as raw bytes. Each file starts with a small header holding the time the value was computed, and
+    is written to a temporary file and renamed into place so readers never see a partial entry.
+
+    A miss takes an exclusive file lock on the key (fcntl.flock), so when several workers miss the same key at once
+    only one computes it and the others wait for and read its result (single-flight). When the directory grows past
+    max_bytes the least recently used entries (by modification time, refreshed on every hit) are deleted, down to
+    EVICT_TARGET of max_bytes so a full cache is not scanned again on the next few writes. Each process
+    keeps a running estimate of the size from its last scan of the directory plus the entries it has written since,
+    and only scans again when the estimate passes max_bytes or every EVICT_INTERVAL seconds, to catch up with the
+    entries written by the other workers.
+
+    Since the entries are unpickled, the directory is created private to the user (mode 0o700), and an existing
+    directory is only used if it belongs to the user and cannot be written by anyone else.
+
+    Keys are tuples whose first element is the city, like AggregateCache, so every entry for a city can be
+    invalidated at once.
+    """
+
+    HEADER = struct.Struct("<4sd")
+    MAGIC = b"GWC1"
+    LOCK_STRIPES = 256
+    EVICT_INTERVAL = 60
+    EVICT_TARGET = 0.9
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl=3600, lock_timeout=30):
+        """
+        Args:
+            directory (str): Directory of the cache files, created if it does not exist
+            max_bytes (int): Size of the cache files above which the least recently used entries are evicted
+            ttl (float): Number of seconds an entry remains valid. None disables expiry
+            lock_timeout (float): Seconds to wait for another worker computing the same key before computing it too
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._check_directory(directory)
+        os.makedirs(os.path.join(directory, "locks"), mode=0o700, exist_ok=True)
+
+        # Estimated size of the cache files, from the last scan plus the entries written since (None before the first
+        # scan)
+        self._size = None
+        self._scanned_at = 0.0
+
+        # Counters of this process, exposed through stats()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.computes = 0
+        self.waits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _check_directory(directory):
+        """ Create the cache directory private to the user, or check that an existing one is safe to unpickle from
+        Args:
+            directory (str): Directory of the cache files
+        Raises:
+            PermissionError: If the directory belongs to another user or can be written by the group or others
+        """
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        # Ownership and permission bits are not meaningful on Windows
+        if not hasattr(os, "getuid"):
+            return
+        stat = os.stat(directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise PermissionError("Shared cache directory {} must belong to uid {} and not be writable by the group or "
+                                  "others (owner uid {}, mode {:o})".format(directory, os.getuid(), stat.st_uid,
+                                                                            stat.st_mode & 0o777))
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.sha1(repr(value).encode("utf-8")).hexdigest()[:20]
+
+    def _path(self, key):
+        """ Path of the file of a key, prefixed by the digest of its city so a city's files can be found by name """
+        return os.path.join(self.directory, "{}-{}.bin".format(self._digest(key[0]), self._digest(key)))
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _read(self, path):
+        """ Read an entry file
+        Returns:
+            tuple: (value, age in seconds), or None if the file is missing or unreadable
+        """
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        if len(data) < self.HEADER.size:
+            return None
+        magic, created = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC:
+            return None
+        try:
+            value = pickle.loads(data[self.HEADER.size:])
+        except Exception:
+            return None
+
+        return value, time.time() - created
+
+    def get_entry(self, key):
+        """ Return the cached value for key along with its age, ignoring the TTL (for stale-while-revalidate reads)
+        Args:
+            key (tuple): Cache key
+        Returns:
+            tuple: (value, age in seconds), or None if the key is not cached
+        """
+        path = self._path(key)
+        entry = self._read(path)
+        if entry is None:
+            self._count("misses")
+            return None
+
+        # Mark the entry as recently used for the size-based eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return entry
+
+    def get(self, key, default=None):
+        """ Return the cached value for key, or default if it is missing or has expired
+        Args:
+            key (tuple): Cache key
+            default: Value returned when the key is not cached
+        Returns:
+            The cached value or default
+        """
+        path = self._path(key)
+        entry = self._read(path)
+        if entry is not None and self.ttl is not None and entry[1] > self.ttl:
+            self._count("expirations")
+            entry = None
+        if entry is None:
+            self._count("misses")
+            return default
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return entry[0]
+
+    def set(self, key, value):
+        """ Store a value in the cache, evicting the least recently used entries if the cache may be too large
+        Args:
+            key (tuple): Cache key
+            value: Picklable value to be cached
+        """
+        data = self.HEADER.pack(self.MAGIC, time.time()) + pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Write to a temporary file and rename it into place, which is atomic
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Only scan the directory when the estimated size passes max_bytes, or the last scan is too old to account
+        # for the entries written by the other workers
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            due = (self._size is None or self._size > self.max_bytes
+                   or time.monotonic() - self._scanned_at > self.EVICT_INTERVAL)
+        if due:
+            self.evict()
+
+    def get_or_compute(self, key, compute):
+        """ Return the cached value for key, computing and caching it on a miss. Only one worker computes a missing
+        key at a time; the others wait for its result
+        Args:
+            key (tuple): Cache key
+            compute (callable): Function with no arguments which returns the value to be cached
+        Returns:
+            The cached or freshly computed value
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self._key_lock(key) as waited:
+            if waited:
+                self._count("waits")
+
+            # Another worker may have computed the value since the miss
+            entry = self._read(self._path(key))
+            if entry is not None and (self.ttl is None or entry[1] <= self.ttl):
+                return entry[0]
+
+            value = compute()
+            self._count("computes")
+            self.set(key, value)
+
+        return value
+
+    def _key_lock(self, key):
+        """ Cross-process lock of a key. Keys share a fixed set of lock files, so lock files never accumulate """
+        stripe = int(self._digest(key)[:8], 16) % self.LOCK_STRIPES
+        return _FileLock(os.path.join(self.directory, "locks", "{}.lock".format(stripe)), self.lock_timeout)
+
+    def evict(self):
+        """ Delete the least recently used entries if the cache files exceed max_bytes, until they fit in EVICT_TARGET
+        of max_bytes
+        Returns:
+            int: The number of entries deleted
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        removed = 0
+        target = self.max_bytes * self.EVICT_TARGET if total > self.max_bytes else self.max_bytes
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._size = total
+            self._scanned_at = time.monotonic()
+            self.evictions += removed
+        return removed
+
+    def invalidate(self, city_value=None):
+        """ Remove entries from the cache, for every worker
+        Args:
+            city_value (str): Only remove the entries for this city. If None, the whole cache is cleared
+        Returns:
+            int: The number of entries removed
+        """
+        prefix = None if city_value is None else self._digest(city_value) + "-"
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".bin") or (prefix is not None and not entry.name.startswith(prefix)):
+                continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def stats(self):
+        """ Return the cache counters of this process and the size of the shared cache
+        Returns:
+            dict: hits, misses, computes, waits (for another worker's result), evictions, expirations, hit ratio,
+                number of entries and their total size in bytes
+        """
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith(".bin")]
+        size = 0
+        for entry in entries:
+            try:
+                size += entry.stat().st_size
+            except OSError:
+                pass
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "computes": self.computes,
+                "waits": self.waits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(entries),
+                "size_bytes": size,
+                "max_bytes": self.max_bytes
+            }
+
+
+class _FileLock:
+    """ Exclusive lock on a file shared between processes, with a timeout. Entering returns whether the lock had to be
+    waited for. If the lock cannot be taken in time (or fcntl is unavailable) the block runs without it """
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return False
+
+        self._file = open(self.path, "a")
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return False
+        except OSError:
+            pass
+
+        # Another worker holds the lock: poll until it is released or the timeout is reached
+        deadline = time.monotonic() + self.timeout
+        delay = 0.005
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                continue
+        return True
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._file is not None:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+        return False
@@ -0,0 +1,227 @@
+import os
+import threading
+
+import numpy as np
+
+
+# Mean radius of the Earth in km
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vectors(lat, lon):
+    """ Convert latitudes and longitudes to points on the unit sphere
+    Args:
+        lat (np.ndarray): Latitudes in degrees
+        lon (np.ndarray): Longitudes in degrees
+    Returns:
+        np.ndarray: (n, 3) array of x, y, z coordinates
+    """
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    """ Convert straight-line distances between unit vectors to great circle (haversine) distances
+    Args:
+        chord (np.ndarray): Chord lengths on the unit sphere
+    Returns:
+        np.ndarray: Distances in km
+    """
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km):
+    """ Convert a great circle distance to the equivalent chord length on the unit sphere
+    Args:
+        km (float): Distance in km
+    Returns:
+        float: Chord length
+    """
+    return 2 * np.sin(min(km / EARTH_RADIUS_KM, np.pi) / 2)
+
+
+class StationIndex:
+    """ Spatial index of the weather stations for nearest-station and radius lookups.
+
+    Stations are stored as unit vectors in a KD-tree (scipy's cKDTree). The straight-line distance between unit
+    vectors increases with the great circle distance, so nearest neighbours and radius queries in 3D give the same
+    answer as haversine distance. The station arrays are persisted to an .npz file with the data version they were
+    built from, and the tree is rebuilt from them on load (a few milliseconds for tens of thousands of stations).
+
+    Requires scipy.
+    """
+
+    def __init__(self, station_ids, city_ids, lat, lon, version=None):
+        """
+        Args:
+            station_ids (array-like): StationId of each station
+            city_ids (array-like): CityId of each station
+            lat (array-like): Latitude of each station in degrees
+            lon (array-like): Longitude of each station in degrees
+            version (str): Data version the stations were read from
+        """
+        from scipy.spatial import cKDTree
+
+        self.station_ids = np.asarray(station_ids).astype(str)
+        self.city_ids = np.asarray(city_ids, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.version = version
+        self.tree = cKDTree(to_unit_vectors(self.lat, self.lon))
+
+    @classmethod
+    def from_backend(cls, backend, version=None):
+        """ Build the index from the stations of a backend
+        Args:
+            backend: Data backend (MySQLBackend or FeatherBackend)
+            version (str): Data version of the backend
+        Returns:
+            StationIndex: The index
+        """
+        df = backend.load_stations()
+        return cls(df.StationId, df.CityId, df.Lat, df.Lon, version)
+
+    @classmethod
+    def load(cls, path):
+        """ Load an index saved with save()
+        Args:
+            path (str): Path of the .npz file
+        Returns:
+            StationIndex: The index, or None if the file does not exist or cannot be read
+        """
+        try:
+            with np.load(path) as data:
+                return cls(data['station_ids'], data['city_ids'], data['lat'], data['lon'], str(data['version']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, path):
+        """ Persist the station arrays and data version
+        Args:
+            path (str): Path of the .npz file
+        """
+        # Write to a temporary file first so other processes never read a half written index
+        tmp_path = "{}.{}.tmp.npz".format(path, os.getpid())
+        np.savez(tmp_path, station_ids=self.station_ids, city_ids=self.city_ids, lat=self.lat, lon=self.lon,
+                 version=np.array(self.version or ""))
+        os.replace(tmp_path, path)
+
+    def _results(self, indices, chords):
+        """ Build the result records of a query
+        Args:
+            indices (np.ndarray): Positions of the matching stations
+            chords (np.ndarray): Chord distances of the matching stations
+        Returns:
+            list: Dicts of StationId, CityId, Lat, Lon and DistanceKm, nearest first
+        """
+        distances = chord_to_km(chords)
+        return [
+            {
+                "StationId": str(self.station_ids[i]),
+                "CityId": int(self.city_ids[i]),
+                "Lat": float(self.lat[i]),
+                "Lon": float(self.lon[i]),
+                "DistanceKm": round(float(d), 3)
+            }
+            for i, d in zip(indices, distances)
+        ]
+
+    def nearest(self, lat, lon, k=5):
+        """ Find the k nearest stations to a point
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+            k (int): Number of stations to return
+        Returns:
+            list: Dicts of StationId, CityId, Lat, Lon and DistanceKm, nearest first
+        """
+        k = min(k, len(self.station_ids))
+        if k < 1:
+            return []
+
+        chords, indices = self.tree.query(to_unit_vectors([lat], [lon])[0], k=k)
+        return self._results(np.atleast_1d(indices), np.atleast_1d(chords))
+
+    def within(self, lat, lon, radius_km):
+        """ Find the stations within a radius of a point
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+            radius_km (float): Radius in km
+        Returns:
+            list: Dicts of StationId, CityId, Lat, Lon and DistanceKm, nearest first
+        """
+        point = to_unit_vectors([lat], [lon])[0]
+        indices = np.asarray(self.tree.query_ball_point(point, km_to_chord(radius_km)), dtype=int)
+        chords = np.linalg.norm(self.tree.data[indices] - point, axis=1)
+        order = np.argsort(chords)
+
+        return self._results(indices[order], chords[order])
+
+    def city_centre(self, city_id):
+        """ Get the mean location of the stations of a city
+        Args:
+            city_id (int): CityId of the city
+        Returns:
+            tuple: (lat, lon) in degrees, or None if the city has no located stations
+        """
+        mask = self.city_ids == city_id
+        if not mask.any():
+            return None
+
+        # Average the unit vectors rather than the angles so cities across the antimeridian are handled
+        x, y, z = self.tree.data[mask].mean(axis=0)
+        return float(np.degrees(np.arctan2(z, np.hypot(x, y)))), float(np.degrees(np.arctan2(y, x)))
+
+
+class LazyStationIndex:
+    """ Loads the persisted station index on first use, building it from the backend when the file is missing.
+    refresh() rebuilds it when the data version of the backend changes """
+
+    def __init__(self, path, source):
+        """
+        Args:
+            path (str): Path of the .npz index file
+            source (callable): Function with no arguments returning the backend used to build the index
+        """
+        self.path = path
+        self.source = source
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """ Get the index, loading or building it on first use
+        Returns:
+            StationIndex: The index
+        """
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    index = StationIndex.load(self.path)
+                    if index is None:
+                        index = self._build()
+                    self._index = index
+        return self._index
+
+    def _build(self):
+        """ Build the index from the backend and persist it
+        Returns:
+            StationIndex: The index
+        """
+        backend = self.source()
+        index = StationIndex.from_backend(backend, backend.data_version())
+        index.save(self.path)
+        return index
+
+    def refresh(self):
+        """ Rebuild the index if the data version of the backend has changed since it was built
+        Returns:
+            bool: True if the index was rebuilt
+        """
+        current = self.get()
+        if self.source().data_version() == current.version:
+            return False
+        with self._lock:
+            self._index = self._build()
+        return True
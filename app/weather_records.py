@@ -1,54 +1,268 @@
-import pandas as pd
-import pymysql.cursors
 import dash_html_components as html
 import datetime
-from apixu.client import ApixuClient
-import numpy as np
+import threading
+from aggregate_cache import AggregateCache
+from city_index import CityIndex
+from city_search import CitySearch
+from co2_index import CO2Index
+from figures import compact_values
+from instrumentation import timed
+
+# pandas, numpy, pymysql and requests are imported on first use rather than here, so the app starts (and every
+# worker process forks) without paying for them
+
+# Columns of the recent weather (get_recent_weather), before the baseline year column of cities with daily records
+RECENT_WEATHER_COLUMNS = ['Date', 'AvgHumid', 'AvgVisib', 'Condition', 'MaxWind', 'TotalPrecip', 'UV', 'MinTemp',
+                          'AvgTemp', 'Forecast', 'Last 7 Days']
 
 
 class WeatherRecords:
-    def __init__(self):
-        # Create menus and options
-        select_cities = """
-            SELECT CONCAT(IFNULL(StationDetails.City,''), ", ", IFNULL(StationDetails.State,''), ", ", IFNULL(StationDetails.Country,'')) as City
-            FROM StationDetails"""
-        df = self.run_sql_query(select_cities)
-
-        # Create menu options
-        self.cities = list(df.City.unique())
+    def __init__(self, backend=None, use_summary_table=True, apixu=None, city_index_path="city_index.json",
+                 station_index_path="station_index.npz", shared_cache=None, co2_index_path="co2_index.json"):
+        """
+        Args:
+            backend: Data backend (MySQLBackend or FeatherBackend). Defaults to MySQL, connected on first use
+            use_summary_table (bool): Read the precomputed yearly summary rather than aggregating the monthly records
+            apixu (ApixuWeather): Apixu client. Defaults to the live Apixu API, created on first use
+            city_index_path (str): Path of the on-disk city index, built from the backend if it does not exist
+            station_index_path (str): Path of the on-disk station location index, built from the backend if it does
+                not exist
+            shared_cache (SharedCache): Cache shared by the worker processes on the host, consulted on a miss of the
+                in-process cache before anything is computed, and used for the Apixu forecasts. None for no shared tier
+            co2_index_path (str): Path of the on-disk index of national CO2 emissions, built from the backend if it
+                does not exist
+        """
+        self._backend = backend
+        self._apixu = apixu
+        self._lazy_lock = threading.Lock()
+        self.use_summary_table = use_summary_table
+
+        # Versioned on-disk index of the city menu options and the lookup of dropdown label to CityId
+        self.city_index = CityIndex(city_index_path, lambda: self.backend)
         self.temperature_options = ["Celsius", "Fahrenheit"]
 
+        # National CO2 emissions by country and year for the history overlay, read from disk on first use
+        self.co2_index = CO2Index(co2_index_path, lambda: self.backend)
+
+        # Spatial index of the station locations, loaded on first use
+        self.station_index_path = station_index_path
+        self._station_index = None
+
+        # Cache of per-(city, unit) yearly aggregates shared by the tile, year range and graph callbacks, backed by
+        # the optional cache shared with the other worker processes
+        self.city_cache = AggregateCache(max_size=256, ttl=60 * 60)
+        self.shared_cache = shared_cache
+
+        # Typeahead search index over the city labels, rebuilt when the city index version changes
+        self._city_search = None
+        self._city_search_version = None
+
+        # Background refresh of popular cities, started with start_refresh_scheduler()
+        self.scheduler = None
+
+    @property
+    def backend(self):
+        """ Data backend, connected to the MySQL database on first use unless one was passed in """
+        if self._backend is None:
+            with self._lazy_lock:
+                if self._backend is None:
+                    from backends import MySQLBackend
+                    self._backend = MySQLBackend()
+        return self._backend
+
+    @property
+    def apixu(self):
+        """ Apixu client with cached history and forecast data, created on first use unless one was passed in """
+        if self._apixu is None:
+            with self._lazy_lock:
+                if self._apixu is None:
+                    from apixu_weather import ApixuWeather
+                    self._apixu = ApixuWeather(shared_cache=self.shared_cache)
+        return self._apixu
+
+    @property
+    def cities(self):
+        """ list: City dropdown labels, read lazily from the city index """
+        return self.city_index.cities
+
+    @property
+    def city_ids(self):
+        """ dict: City dropdown label to CityId, read lazily from the city index """
+        return self.city_index.city_ids
+
+    def search_cities(self, query, limit=20, offset=0):
+        """ Search the city labels for the typeahead city menu
+        Args:
+            query (str): Text typed by the user
+            limit (int): Maximum number of results to return
+            offset (int): Number of results to skip, for pagination
+        Returns:
+            tuple: (list of matching labels, best first, total number of matches)
+        """
+        version = self.city_index.version
+        if self._city_search is None or self._city_search_version != version:
+            with self._lazy_lock:
+                if self._city_search is None or self._city_search_version != version:
+                    self._city_search = CitySearch(self.cities)
+                    self._city_search_version = version
+
+        return self._city_search.search(query, limit, offset)
+
+    def refresh_city_index(self):
+        """ Rebuild the on-disk city index if the city data has changed since it was built
+        Returns:
+            bool: True if the index was rebuilt
+        """
+        return self.city_index.refresh()
+
+    def refresh_co2_index(self):
+        """ Rebuild the on-disk CO2 index if the city data has changed since it was built
+        Returns:
+            bool: True if the index was rebuilt
+        """
+        return self.co2_index.refresh()
 
-    def run_sql_query(self, sql):
-        """ Run an SQL query against the app database and return the results in a pandas DataFrame.
+    def city_co2(self, city_value, years):
+        """ Get the national CO2 emissions of a city's country in the years of its temperature summary, from the
+        in-memory CO2 index
         Args:
-            sql (str): SQL query to be run on the database
+            city_value (str): Name of the city
+            years (list): Years of the city's temperature summary
+        Returns:
+            dict: JSON serialisable country and emissions (million tonnes, None where missing) aligned to years, or
+                None if there is no emissions data for the city's country
+        """
+        country = self.co2_index.country(self.city_id(city_value))
+        if country is None:
+            return None
+
+        return {"country": country, "emissions": self.co2_index.emissions(country, years)}
+
+    def _lazy_station_index(self):
+        """ Create the loader of the station index on first use (numpy and scipy are only imported then) """
+        if self._station_index is None:
+            with self._lazy_lock:
+                if self._station_index is None:
+                    from station_index import LazyStationIndex
+                    self._station_index = LazyStationIndex(self.station_index_path, lambda: self.backend)
+        return self._station_index
+
+    @property
+    def station_index(self):
+        """ StationIndex: Spatial index of the station locations, loaded or built on first use """
+        return self._lazy_station_index().get()
+
+    def refresh_station_index(self):
+        """ Rebuild the on-disk station index if the station data has changed since it was built
+        Returns:
+            bool: True if the index was rebuilt
+        """
+        return self._lazy_station_index().refresh()
 
-        Todo:
-            Implement exception handling in case of database connection error
+    def _with_city_labels(self, stations):
+        """ Add the city dropdown label to station lookup results
+        Args:
+            stations (list): Dicts returned by the station index
+        Returns:
+            list: The same dicts with a City key
+        """
+        labels = self.city_index.city_labels
+        for station in stations:
+            station["City"] = labels.get(station["CityId"])
+        return stations
 
+    def nearest_stations(self, lat, lon, k=5):
+        """ Find the k nearest weather stations to a point
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+            k (int): Number of stations to return
         Returns:
-            pd.DataFrame: The results of the SQL query as a pandas DataFrame
+            list: Dicts of StationId, CityId, City, Lat, Lon and DistanceKm, nearest first
         """
+        return self._with_city_labels(self.station_index.nearest(lat, lon, k))
 
-        # Connect to the database
-        connection = pymysql.connect(
-            host='localhost',
-            user='root',
-            password='',
-            db='globalwarming',
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor)
+    def stations_within(self, lat, lon, radius_km):
+        """ Find the weather stations within a radius of a point
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+            radius_km (float): Radius in km
+        Returns:
+            list: Dicts of StationId, CityId, City, Lat, Lon and DistanceKm, nearest first
+        """
+        return self._with_city_labels(self.station_index.within(lat, lon, radius_km))
 
-        # Query database
-        df = pd.read_sql(sql, connection)
-        df = df.reset_index()
+    def nearest_city(self, lat, lon):
+        """ Find the city of the nearest weather station to a point, for "near me" and map selection
+        Args:
+            lat (float): Latitude in degrees
+            lon (float): Longitude in degrees
+        Returns:
+            str: The city dropdown label, or None if there are no stations
+        """
+        stations = self.nearest_stations(lat, lon, k=1)
+        return stations[0]["City"] if stations else None
 
-        # Close the connection to database
-        connection.close()
+    def stations_near_city(self, city_value, radius_km=300):
+        """ Find the weather stations around a city
+        Args:
+            city_value (str): The name of the city (e.g. "New York, New York, United States")
+            radius_km (float): Radius around the mean location of the city's stations in km
+        Returns:
+            list: Dicts of StationId, CityId, City, Lat, Lon and DistanceKm, nearest first
+        """
+        centre = self.station_index.city_centre(self.city_id(city_value))
+        if centre is None:
+            return []
+        return self.stations_within(centre[0], centre[1], radius_km)
 
-        # Return the results as a dataframe
-        return df
+    def start_refresh_scheduler(self, **kwargs):
+        """ Start a background scheduler which keeps the forecast data of the most popular cities warm
+        Args:
+            kwargs: Arguments passed to RefreshScheduler (e.g. top_n, interval, rate_limiter)
+        Returns:
+            RefreshScheduler: The running scheduler
+        """
+        if self.scheduler is None:
+            from refresh_scheduler import RefreshScheduler
+            self.scheduler = RefreshScheduler(self.apixu, **kwargs)
+        self.scheduler.start()
+
+        return self.scheduler
+
+    def city_id(self, city_value):
+        """ Resolve a city dropdown label to its CityId
+        Args:
+            city_value (str): The name of the city (e.g. "New York, New York, United States")
+        Returns:
+            int: The CityId, or None if the city is not in the database
+        """
+        return self.city_ids.get(city_value)
+
+    def pool_stats(self):
+        """ Return the backend metrics (for MySQL the connection pool wait time, in-use, created etc.)
+        Returns:
+            dict: The backend statistics
+        """
+        return self.backend.stats()
+
+    def runtime_stats(self):
+        """ Return the statistics of the caches, backend and Apixu client, skipping any not created yet so that
+        reading them never connects to the database or the API
+        Returns:
+            dict: Component name to its statistics
+        """
+        stats = {"city_cache": self.cache_stats()}
+        if self.shared_cache is not None:
+            stats["shared_cache"] = self.shared_cache.stats()
+        if self._backend is not None:
+            stats["backend"] = self._backend.stats()
+        if self._apixu is not None:
+            stats["forecast_cache"] = self._apixu.forecast_cache.stats()
+            stats["apixu"] = {"upstream_calls": self._apixu.upstream_calls}
+
+        return stats
 
     def fahrenheit_to_celsius(self, df, columns):
         """ Convert temperture from degrees Fahrenheit to degrees celsius
@@ -63,62 +277,212 @@ class WeatherRecords:
             pd.Dataframe: Returns the entire dataframe with the specified columns converted into degrees Celsius
         """
 
-        # For each specified column, convert the temperature from Fahrenheit to celsius
-        for i in columns:
-            df[i] = round((df.loc[:, i] - 32) * 5 / 9, 1)
+        import numpy as np
+
+        # Convert all of the specified columns from Fahrenheit to celsius in a single vectorised operation
+        columns = list(columns)
+        df[columns] = np.round((df[columns].values.astype(float) - 32) * 5 / 9, 1)
 
         return df
 
     def calc_city_df(self, city_value, temp_value="Celsius", temp_vars=["MaxTemp", "MinTemp", "AvgTemp"]):
-        """ Calculate and return the historical temperature data for a specified city.
+        """ Return the historical temperature data for a specified city, served from the aggregate cache.
         Args:
             city_value (str): The name of the city to be queried in the database.
             temp_value (str): Whether the data is to be displayed as Fahrenheit or Celsius.
             temp_vars (list): List of strings of the temperature metrics to display
-        Todo:
-            Make city_value default value (if none) to be dynamic based on the data in the dataset
-            Make SQL query iterable / programmatic based on the values in the temp_vars list. Current risk of mismatch
         Returns:
-            pd.DataFrame
+            pd.DataFrame: Year, AvgTemp, City, MaxTemp and MinTemp for each year
         """
+        # Only the Fahrenheit aggregate is cached. Celsius is a cheap conversion of the small yearly result
+        key = (city_value, "Fahrenheit")
+        if self.use_summary_table:
+            compute = lambda: self.read_city_summary(city_value)
+        else:
+            compute = lambda: self.aggregate_city_records(city_value)
+        df = self.cached(key, compute).copy()
 
-        select_data = """
-        SELECT
-            StationRecords.StationId as StationId,
-            StationRecords.Year as Year,
-            StationRecords.Month as `Month`,
-            StationRecords.MaxTemp as MaxTemp,
-            StationRecords.MinTemp as MinTemp,
-            StationRecords.Temp as AvgTemp,
-            CONCAT(IFNULL(StationDetails.City,''), ", ", IFNULL(StationDetails.State,''), ", ", IFNULL(StationDetails.Country,'')) as City
-        FROM StationRecords
-        JOIN StationDetails ON StationRecords.StationId = StationDetails.StationId
-        WHERE CONCAT(IFNULL(StationDetails.City,''), ", ", IFNULL(StationDetails.State,''), ", ", IFNULL(StationDetails.Country,''))  = {}
-        """.format(("'" + city_value + "'"))
+        if temp_value == "Celsius":
+            df = self.fahrenheit_to_celsius(df, temp_vars)
 
-        # Query database and create dataframe
-        df = self.run_sql_query(select_data)
+        return df
 
-        # Temperature variables
-        temp_vars = temp_vars
+    @timed("aggregation", step="calc_cities_df")
+    def calc_cities_df(self, city_values, temp_value="Celsius", temp_vars=["MaxTemp", "MinTemp", "AvgTemp"]):
+        """ Return the historical temperature data of several cities in long format (one row per city-year), for
+        overlaid traces. Cities in the aggregate cache are served from it, and the others are read with a single
+        batched query and aggregated together, so the cost grows with the rows read rather than the number of cities
+        Args:
+            city_values (list): Names of the cities to compare
+            temp_value (str): Whether the data is to be displayed as Fahrenheit or Celsius.
+            temp_vars (list): List of strings of the temperature metrics to display
+        Returns:
+            pd.DataFrame: Year, AvgTemp, City, MaxTemp and MinTemp for each city-year, in the order of city_values
+        """
+        import pandas as pd
+
+        # Unique cities in the order given, skipping any which are not in the database
+        city_values = [c for c in dict.fromkeys(city_values) if self.city_id(c) is not None]
+
+        frames = {}
+        missing = []
+        for city_value in city_values:
+            df = self.city_cache.get((city_value, "Fahrenheit"))
+            if df is None and self.shared_cache is not None:
+                df = self.shared_cache.get((city_value, "Fahrenheit"))
+                if df is not None:
+                    self.city_cache.set((city_value, "Fahrenheit"), df)
+            if df is None:
+                missing.append(city_value)
+            else:
+                frames[city_value] = df
+
+        # Read the uncached cities together and cache each one for the single city callbacks
+        if missing:
+            if self.use_summary_table:
+                computed = self.read_cities_summary(missing)
+            else:
+                computed = self.aggregate_cities_records(missing)
+            for city_value, df in computed.items():
+                self.city_cache.set((city_value, "Fahrenheit"), df)
+                if self.shared_cache is not None:
+                    self.shared_cache.set((city_value, "Fahrenheit"), df)
+                frames[city_value] = df
+
+        columns = ['Year', 'AvgTemp', 'City', 'MaxTemp', 'MinTemp']
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat([frames[c] for c in city_values], ignore_index=True)
 
-        # If temp_value is Celcius, convert the temperature values
         if temp_value == "Celsius":
             df = self.fahrenheit_to_celsius(df, temp_vars)
 
-        # Calculate min, max and average values for each year
-        df_max = df.groupby(['City', 'Year']).max().reset_index()
-        df_min = df.groupby(['City', 'Year']).min().reset_index()
-        df_avg = df.groupby(['City', 'Year']).mean().reset_index()
+        return df
+
+    def cached(self, key, compute):
+        """ Get a city aggregate from the in-process cache, then from the cache shared with the other worker
+        processes, computing it only if neither holds it (and then in only one worker at a time)
+        Args:
+            key (tuple): Cache key, (city_value, kind)
+            compute (callable): Function with no arguments which returns the aggregate
+        Returns:
+            The cached or freshly computed aggregate
+        """
+        if self.shared_cache is not None:
+            compute_shared = compute
+            compute = lambda: self.shared_cache.get_or_compute(key, compute_shared)
+        return self.city_cache.get_or_compute(key, compute)
+
+    def invalidate_city_cache(self, city_value=None):
+        """ Remove cached aggregates, e.g. after new StationRecords have been loaded. The shared cache is invalidated
+        for every worker, while the in-process caches of other workers expire with their TTL
+        Args:
+            city_value (str): Only invalidate this city. If None, every city is invalidated
+        Returns:
+            int: The number of cache entries removed
+        """
+        removed = self.city_cache.invalidate(city_value)
+        if self.shared_cache is not None:
+            removed += self.shared_cache.invalidate(city_value)
+        return removed
+
+    def cache_stats(self):
+        """ Return the hit/miss counters of the city aggregate cache
+        Returns:
+            dict: The cache statistics
+        """
+        return self.city_cache.stats()
+
+    @timed("aggregation", step="read_city_summary")
+    def read_city_summary(self, city_value):
+        """ Read the precomputed yearly temperatures of a city from the backend's summary
+        Args:
+            city_value (str): The name of the city to be queried in the database.
+        Returns:
+            pd.DataFrame: Year, AvgTemp, City, MaxTemp and MinTemp for each year in degrees Fahrenheit
+        """
+        # Query the backend and return the (already aggregated) results
+        df = self.backend.city_summary(self.city_id(city_value), "Fahrenheit")
+        df['City'] = city_value
+        df = df[['Year', 'AvgTemp', 'City', 'MaxTemp', 'MinTemp']]
+        df[['AvgTemp', 'MaxTemp', 'MinTemp']] = df[['AvgTemp', 'MaxTemp', 'MinTemp']].astype(float)
+
+        return df
+
+    @timed("aggregation", step="read_cities_summary")
+    def read_cities_summary(self, city_values):
+        """ Read the precomputed yearly temperatures of several cities from the backend's summary in one query
+        Args:
+            city_values (list): Names of the cities to be queried in the database
+        Returns:
+            dict: City name to a pd.DataFrame of Year, AvgTemp, City, MaxTemp and MinTemp in degrees Fahrenheit
+        """
+        # Query the backend once for every city and label the rows with the city names
+        city_names = {self.city_id(c): c for c in city_values}
+        df = self.backend.cities_summary(list(city_names), "Fahrenheit")
+        df['City'] = df.CityId.map(city_names)
+        df[['AvgTemp', 'MaxTemp', 'MinTemp']] = df[['AvgTemp', 'MaxTemp', 'MinTemp']].astype(float)
+
+        return self._split_cities(df, city_values)
+
+    @timed("aggregation", step="aggregate_city_records")
+    def aggregate_city_records(self, city_value):
+        """ Calculate and return the historical temperature data for a specified city from the monthly StationRecords.
+        Args:
+            city_value (str): The name of the city to be queried in the database.
+        Todo:
+            Make city_value default value (if none) to be dynamic based on the data in the dataset
+        Returns:
+            pd.DataFrame: Year, AvgTemp, City, MaxTemp and MinTemp for each year in degrees Fahrenheit
+        """
 
-        # Combine min, max and average values for the city into a single df
-        df = df_avg[['Year', 'AvgTemp', 'City']]
-        df = df.join(df_max.MaxTemp)
-        df = df.join(df_min.MinTemp)
-        df = df.reset_index(drop=True)
+        # Query the backend and create a float (NumPy-backed) dataframe of the temperatures
+        df = self.backend.city_records(self.city_id(city_value))
+        df = df[['Year', 'AvgTemp', 'MaxTemp', 'MinTemp']].astype(float)
+
+        # Calculate the average, max and min values for each year in a single pass
+        df = df.groupby('Year').agg({'AvgTemp': 'mean', 'MaxTemp': 'max', 'MinTemp': 'min'}).reset_index()
+        df['Year'] = df.Year.astype(int)
+        df['City'] = city_value
+        df = df[['Year', 'AvgTemp', 'City', 'MaxTemp', 'MinTemp']]
 
         return df
 
+    @timed("aggregation", step="aggregate_cities_records")
+    def aggregate_cities_records(self, city_values):
+        """ Calculate the historical temperature data of several cities from the monthly StationRecords, read in one
+        query and aggregated in a single groupby
+        Args:
+            city_values (list): Names of the cities to be queried in the database
+        Returns:
+            dict: City name to a pd.DataFrame of Year, AvgTemp, City, MaxTemp and MinTemp in degrees Fahrenheit
+        """
+        # Query the backend once for every city and create a float (NumPy-backed) dataframe of the temperatures
+        city_names = {self.city_id(c): c for c in city_values}
+        df = self.backend.cities_records(list(city_names))
+        df = df[['CityId', 'Year', 'AvgTemp', 'MaxTemp', 'MinTemp']].astype(float)
+
+        # Calculate the average, max and min values for each city and year in a single pass
+        df = df.groupby(['CityId', 'Year']).agg({'AvgTemp': 'mean', 'MaxTemp': 'max', 'MinTemp': 'min'}).reset_index()
+        df['Year'] = df.Year.astype(int)
+        df['City'] = df.CityId.astype(int).map(city_names)
+
+        return self._split_cities(df, city_values)
+
+    @staticmethod
+    def _split_cities(df, city_values):
+        """ Split a frame of several cities' yearly temperatures into one frame per city
+        Args:
+            df (pd.DataFrame): Year, AvgTemp, City, MaxTemp and MinTemp of each city-year
+            city_values (list): Names of the cities. Cities without any rows get an empty frame
+        Returns:
+            dict: City name to its pd.DataFrame of Year, AvgTemp, City, MaxTemp and MinTemp
+        """
+        df = df.loc[:, ['Year', 'AvgTemp', 'City', 'MaxTemp', 'MinTemp']]
+        groups = {city_value: group.reset_index(drop=True) for city_value, group in df.groupby('City', sort=False)}
+
+        return {c: groups.get(c, df.iloc[:0]) for c in city_values}
+
     def tile(self, color, text, id_value, id_year_range):
         """ Create the top row / div for the weather KPI tiles
 
@@ -168,7 +532,8 @@ class WeatherRecords:
         return year_range
 
     def calc_temp_change(self, city_value, temp_value, temp_var):
-        """ Calculate the temperature change from the start date to the end date of the data in the dataset
+        """ Calculate the temperature change from the start date to the end date of the data in the dataset.
+        Uses the precomputed linear trend when available, otherwise the first year vs last year difference
         Args:
             city_value (str): Name of the city to query in the databas
             temp_value (str): String of either "Fahrenheit" or "Celsius"
@@ -176,10 +541,85 @@ class WeatherRecords:
         Returns:
             float: Change in temp_var rounded to 2 decimals
         """
+        climatology = self.city_climatology(city_value)
+        if climatology is not None and climatology["trends"][temp_var] is not None:
+            return self.trend_change(climatology, temp_var, temp_value)
 
         # Calulcate and return the dataframe for the city
         df = self.calc_city_df(city_value, temp_value)
 
+        return self.temp_change(df, temp_var)
+
+    def city_climatology(self, city_value):
+        """ Get the precomputed trend and anomaly statistics of a city, served from the aggregate cache
+        Args:
+            city_value (str): Name of the city to query in the database
+        Returns:
+            dict: First and last year, trends (degrees Fahrenheit per decade with the bounds of their 95% confidence
+                interval) and decadal anomalies, or None if the statistics have not been computed for the city
+        """
+        key = (city_value, "climatology")
+        return self.cached(key, lambda: self.read_city_climatology(city_value))
+
+    @timed("aggregation", step="read_city_climatology")
+    def read_city_climatology(self, city_value):
+        """ Read the precomputed trend and anomaly statistics of a city from the backend
+        Args:
+            city_value (str): Name of the city to query in the database
+        Returns:
+            dict: See city_climatology
+        """
+        climatology, decades = self.backend.city_climatology(self.city_id(city_value))
+        if climatology.empty:
+            return None
+
+        row = climatology.iloc[0]
+        value = lambda v: None if v is None or v != v else float(v)
+        trends = {}
+        for i in ["MaxTemp", "MinTemp", "AvgTemp"]:
+            slope = value(row[i + "TrendF"])
+            trends[i] = None if slope is None else {
+                "per_decade": slope,
+                "low": value(row[i + "TrendLowF"]),
+                "high": value(row[i + "TrendHighF"])
+            }
+
+        return {
+            "first_year": int(row.FirstYear),
+            "last_year": int(row.LastYear),
+            "baseline": value(row.BaselineAvgTempF),
+            "trends": trends,
+            "decades": [int(d) for d in decades.Decade],
+            "decade_means": [value(v) for v in decades.AvgTempF],
+            "anomalies": [value(v) for v in decades.AnomalyF]
+        }
+
+    @staticmethod
+    def trend_change(climatology, temp_var, temp_value="Celsius"):
+        """ Calculate the change in a temperature variable over a city's records implied by its linear trend
+        Args:
+            climatology (dict): Statistics returned by city_climatology
+            temp_var (str): Name of the temperature variable
+            temp_value (str): String of either "Fahrenheit" or "Celsius"
+        Returns:
+            float: The trend per decade times the number of decades covered, rounded to 2 decimals
+        """
+        change = climatology["trends"][temp_var]["per_decade"] * (
+            climatology["last_year"] - climatology["first_year"]) / 10
+        if temp_value == "Celsius":
+            change = change * 5 / 9
+
+        return round(change, 2)
+
+    @staticmethod
+    def temp_change(df, temp_var):
+        """ Calculate the change in a temperature variable between the first and last years of a city dataframe
+        Args:
+            df (pd.DataFrame): Yearly temperatures returned by calc_city_df
+            temp_var (str): Name of the temperature variable to calculate the temp change of
+        Returns:
+            float: Change in temp_var rounded to 2 decimals
+        """
         # Calculate change in temperature between min and max years
         start_year = min(df.Year)
         end_year = max(df.Year)
@@ -187,65 +627,177 @@ class WeatherRecords:
         end_temp = df.loc[df["Year"] == end_year, temp_var].unique()[0]
         temp_change = end_temp - start_temp
 
-        return round(temp_change, 2)
+        return round(float(temp_change), 2)
 
-    def get_daily_history(self, city_value):
+    @timed("aggregation", step="city_summary")
+    def city_summary(self, city_value, temp_vars=["MaxTemp", "MinTemp", "AvgTemp"]):
+        """ Calculate everything the historical view of a city displays, in both temperature units, from a single
+        cached aggregate. The result is sent to the browser once per city, so switching unit is handled client-side.
+        Args:
+            city_value (str): Name of the city to query in the database
+            temp_vars (list): List of strings of the temperature metrics to display
+        Returns:
+            dict: JSON serialisable city label, year range, years, and per unit the yearly values and changes of each
+                temp_var, their trends per decade and the decadal anomalies
+        """
+        climatology = self.city_climatology(city_value)
+        summary = {
+            "city": city_value,
+            "year_range": self.calc_year_range(city_value),
+            "decades": climatology["decades"] if climatology else [],
+            "units": {}
+        }
+
+        for temp_value in self.temperature_options:
+            df = self.calc_city_df(city_value, temp_value, temp_vars)
+            summary["years"] = df.Year.tolist()
+            unit = {
+                "values": {i: compact_values(df[i]) for i in temp_vars},
+                "changes": {},
+                "trends": {},
+                "anomalies": []
+            }
+
+            # Changes are read from the precomputed trends, falling back to the first year vs last year difference
+            scale = 5 / 9 if temp_value == "Celsius" else 1
+            for i in temp_vars:
+                trend = climatology["trends"].get(i) if climatology else None
+                if trend is None:
+                    unit["changes"][i] = self.temp_change(df, i)
+                    unit["trends"][i] = None
+                else:
+                    unit["changes"][i] = self.trend_change(climatology, i, temp_value)
+                    unit["trends"][i] = {k: None if v is None else round(v * scale, 3) for k, v in trend.items()}
+            if climatology:
+                unit["anomalies"] = [None if v is None else round(v * scale, 3) for v in climatology["anomalies"]]
+
+            summary["units"][temp_value] = unit
+
+        return summary
+
+    def city_monthly(self, city_value):
+        """ Get the monthly temperatures of a city (averaged across its stations), served from the aggregate cache
+        Args:
+            city_value (str): Name of the city to query in the database
+        Returns:
+            pd.DataFrame: Date (first day of the month), AvgTemp, MaxTemp and MinTemp for each month in degrees
+                Fahrenheit, in date order
+        """
+        key = (city_value, "monthly")
+        return self.cached(key, lambda: self.read_city_monthly(city_value))
+
+    @timed("aggregation", step="read_city_monthly")
+    def read_city_monthly(self, city_value):
+        """ Calculate the monthly temperatures of a city from the monthly StationRecords
+        Args:
+            city_value (str): Name of the city to query in the database
+        Returns:
+            pd.DataFrame: See city_monthly
+        """
+        import pandas as pd
+
+        # Query the backend and calculate the average, max and min values for each month in a single pass
+        df = self.backend.city_records(self.city_id(city_value))
+        df = df[['Year', 'Month', 'AvgTemp', 'MaxTemp', 'MinTemp']].astype(float)
+        df = df.groupby(['Year', 'Month']).agg({'AvgTemp': 'mean', 'MaxTemp': 'max', 'MinTemp': 'min'}).reset_index()
+        df['Date'] = pd.to_datetime(pd.DataFrame({'year': df.Year, 'month': df.Month, 'day': 1}))
+
+        return df.loc[:, ['Date', 'AvgTemp', 'MaxTemp', 'MinTemp']]
+
+    def export_series(self, city_values=None, resolution="yearly", start_year=None, end_year=None, columns=None,
+                      batch_size=5000):
+        """ Stream the yearly or monthly temperature series of cities straight from the backend, bypassing the
+        aggregate caches, for bulk exports
+        Args:
+            city_values (list): Names of the cities. None exports every city
+            resolution (str): "yearly" or "monthly"
+            start_year (int): First year exported. None for no lower bound
+            end_year (int): Last year exported. None for no upper bound
+            columns (list): Temperature columns exported (see backends.EXPORT_COLUMNS). None exports them all
+            batch_size (int): Number of rows per batch
+        Returns:
+            tuple: (list of column names, generator of lists of row tuples)
+        """
+        from backends import EXPORT_COLUMNS
+
+        columns = list(EXPORT_COLUMNS) if columns is None else list(columns)
+        city_ids = None
+        if city_values is not None:
+            city_ids = [i for i in (self.city_id(c) for c in dict.fromkeys(city_values)) if i is not None]
+
+        keys = ['City', 'CityId', 'Year'] if resolution == "yearly" else ['City', 'CityId', 'Year', 'Month']
+        batches = self.backend.export_series(resolution, city_ids, start_year, end_year, columns, batch_size)
+
+        return keys + columns, batches
+
+    def city_daily_baseline(self, city_value):
+        """ Get the daily maximum temperatures of a city in the first year of its daily records, served from the
+        aggregate cache
+        Args:
+            city_value (str): Name of the city to query in the database
+        Returns:
+            tuple: (baseline year, np.ndarray of the 365 daily maximum temperatures in degrees Fahrenheit indexed by
+                day of the year from 0, np.nan where a day is missing), or None if the city has no daily records
+        """
+        key = (city_value, "daily_baseline")
+        return self.cached(key, lambda: self.read_city_daily_baseline(city_value))
+
+    @timed("aggregation", step="read_city_daily_baseline")
+    def read_city_daily_baseline(self, city_value):
+        """ Read the daily baseline of a city from the backend into a 365 day array
+        Args:
+            city_value (str): Name of the city to query in the database
+        Returns:
+            tuple: See city_daily_baseline
+        """
+        import numpy as np
+
+        df = self.backend.city_daily_baseline(self.city_id(city_value))
+        if df.empty:
+            return None
+
+        temps = np.full(365, np.nan)
+        temps[df.DayOfYear.values.astype(int) - 1] = df.MaxTemp.values.astype(float)
+
+        return int(df.Year.iloc[0]), temps
+
+    @staticmethod
+    def day_of_year(date):
+        """ Get the day of the year in a 365 day calendar, counting from 0 (29 February counts as 28 February)
+        Args:
+            date (datetime.date): The date
+        Returns:
+            int: The day of the year
+        """
+        day = min(date.day, 28) if date.month == 2 else date.day
+        return datetime.date(2001, date.month, day).timetuple().tm_yday - 1
+
+    @timed("aggregation", step="get_daily_history")
+    def get_daily_history(self, city_value, today=None):
         """ Get 12 day weather history from the earliest records in the database
         Args:
             city_value (str): Name of the city to query in the databas
-            temp_value (str): String of either "Fahrenheit" or "Celsius"
+            today (datetime.date): Date the window is centred on. Defaults to today's date
         Returns:
-            pd.DataFrame: Dataframe with the city (for debugging), date, maxtemp for the 12 day period
+            pd.DataFrame: Dataframe with the baseline year as the column name and the maxtemp for the 7 days before
+                to the 5 days after today in that year, or None if the city has no daily records
         """
-        try:
-            # Get min year of data from DB (either 60's, 70's or 80's)
-            select_data = """
-            SELECT
-                CONCAT(City, ", " ,State, ", " ,Country) as City,
-                MIN(YEAR(Date)) as 'Year'
-            FROM DailyAvg
-            JOIN StationDetails ON StationDetails.StationId = DailyAvg.StationId
-            WHERE CONCAT(City, ", " ,State, ", " ,Country) = {}
-            GROUP BY CONCAT(City, ", " ,State, ", " ,Country);
-            """.format(("'" + city_value + "'"))
-
-            df_minyear = self.run_sql_query(select_data)
-            start_year = int(df_minyear['Year'])
-
-            # Calculate the comparative period based on the start_year
-            now = datetime.datetime.now()
-            comparative_period = now.year - (now.year - start_year)
-            start_date = datetime.date(comparative_period, now.month, now.day) - datetime.timedelta(days=7)
-            end_date = datetime.date(comparative_period, now.month, now.day) + datetime.timedelta(days=5)
-
-            # Format the start and end date for SQL
-            start_date = ("'" + start_date.strftime('%Y-%m-%d') + "'")
-            end_date = ("'" + end_date.strftime('%Y-%m-%d') + "'")
-
-            # Get comparative daily temperatures
-            select_data = """
-            SELECT
-                Date,
-                ROUND(AVG(MaxTemp),2) as MaxTemp
-            FROM DailyAvg
-            JOIN StationDetails ON StationDetails.StationId = DailyAvg.StationId
-            WHERE
-                CONCAT(City, ", " ,State, ", " ,Country) = {}
-                AND Date >= {} AND Date <= {}
-            GROUP BY Date
-            ORDER BY Date
-            """.format(("'" + city_value + "'"), start_date, end_date)
-
-            df = self.run_sql_query(select_data)
-
-            # Rename column and drop date
-            df = df.rename(columns={'MaxTemp': df.Date[0].year})
-            df = df.drop(columns='Date')
-
-            return df
-        except TypeError:
+        import numpy as np
+        import pandas as pd
+
+        baseline = self.city_daily_baseline(city_value)
+        if baseline is None:
             return
+        year, temps = baseline
+
+        # Take the comparative period as a single slice of the 365 day array, wrapping across the end of the year
+        today = today or datetime.date.today()
+        day = self.day_of_year(today)
+        window = np.take(temps, np.arange(day - 7, day + 6), mode='wrap')
+
+        return pd.DataFrame({year: window})
 
+    @timed("aggregation", step="get_recent_weather")
     def get_recent_weather(self, city_value, temp_value="Celsius"):
         """ Get 7 day weather history + 5 day forecast from today's date
         Args:
@@ -255,21 +807,26 @@ class WeatherRecords:
             pd.DataFrame: Dataframe with the date, max, min and average temperatures for the past 7 days + forecast of coming 5
         """
 
-        # Setup for get_7day_history function
-        file = open("/Users/todddequincey/globalwarming/app/apixu_weather_api_key.txt")
-        api_key = file.read()
-        client = ApixuClient(api_key)
+        import numpy as np
+        import pandas as pd
+
+        # Track the city's popularity for the background refresh
+        if self.scheduler is not None:
+            self.scheduler.record(city_value)
 
         # List of dictionatries of the data
         data = []
 
-        # Get 7 day weather history
-        # Individual API calls for historical data req, due to restrictions of free API
+        # Get 7 day weather history + 5 day forecast
+        # Individual API calls for historical data req, due to restrictions of free API. These are issued concurrently
+        # and past days are cached, so a warm call only needs the forecast
         now = datetime.datetime.now()  # TODO: Deal with time zones
-        for i in range(0, 8):
-            history = client.history(q=city_value, since=datetime.date(now.year, now.month, now.day) - datetime.timedelta(days=i))
-            for day in history['forecast']['forecastday']:
-                results = {
+        today = datetime.date(now.year, now.month, now.day)
+        history, forecast = self.apixu.recent_days(city_value, today)
+
+        # Today's actuals are taken from the first day of the forecast
+        for day in history + forecast[:1]:
+            results = {
                     "Date": day['date'],
                     "Last 7 Days": day['day']['maxtemp_f'],
                     "Forecast": np.nan,
@@ -282,11 +839,10 @@ class WeatherRecords:
                     "Condition": day['day']['condition']['text'],
                     "UV": day['day']['uv']
                 }
-                data.append(results)
+            data.append(results)
 
-        # Get 5 day forecast
-        forecast = client.forecast(q=city_value, days=6)
-        for day in forecast['forecast']['forecastday']:
+        # Add the 5 day forecast
+        for day in forecast:
             results = {
                     "Date": day['date'],
                     "Last 7 Days": np.nan,
@@ -303,21 +859,21 @@ class WeatherRecords:
             data.append(results)
 
         # Create dataframe of results
-        df = pd.DataFrame(data, columns=['Date',
-                                        'AvgHumid',
-                                        'AvgVisib',
-                                        'Condition',
-                                        'MaxWind',
-                                        'TotalPrecip',
-                                        'UV',
-                                        'MinTemp',
-                                        'AvgTemp',
-                                        'Forecast',
-                                        'Last 7 Days'])
-        df = df.sort_values('Date')
+        df = pd.DataFrame(data, columns=RECENT_WEATHER_COLUMNS)
+        df = df.sort_values('Date', kind='mergesort')  # Stable sort so history rows are kept ahead of forecast rows
         df = df.drop_duplicates('Date')  # Drop dups in case of overlap of forecast + history dates
-        df = df.reset_index(drop=True)
-        df.loc[7, "Forecast"] = df.loc[7, "Last 7 Days"]  # Replace today np.nan forecast with actual MaxTemp
+
+        # Keep a row for every day of the window, including the days the API did not return in time, so the rows
+        # stay aligned with the baseline year
+        history_dates = [(today - datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7, 0, -1)]
+        forecast_dates = [day['date'] for day in forecast] or [
+            (today + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(6)]
+        dates = history_dates + [d for d in forecast_dates if d not in history_dates]
+        df = df.set_index('Date').reindex(dates).rename_axis('Date').reset_index()
+
+        # Replace today np.nan forecast with actual MaxTemp
+        today_row = df['Date'] == forecast_dates[0]
+        df.loc[today_row, "Forecast"] = df.loc[today_row, "Last 7 Days"]
 
         # Get and join historical data to the df
         try:
@@ -0,0 +1,106 @@
+""" Microbenchmarks of the WeatherRecords methods behind the dashboard's callbacks.
+
+Times calc_city_df, calc_cities_df, calc_temp_change, get_daily_history and get_recent_weather against a synthetic
+dataset and a local fake of the Apixu API, cold (caches cleared before each call) and warm.
+
+Usage (from the repository root):
+    python benchmarks/bench_callbacks.py [--cities 20] [--stations 3] [--years 60] [--repeat 50]
+        [--backend memory|feather] [--save-baseline NAME] [--compare NAME]
+"""
+import argparse
+import itertools
+import sys
+
+from common import add_dataset_args, build_environment, compare_baseline, peak_memory_mb, print_results
+from common import save_baseline, time_calls
+
+
+def run(args):
+    """ Run the microbenchmarks
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    Returns:
+        dict: Benchmark name to latency summary
+    """
+    from apixu_weather import ApixuWeather
+    from weather_records import WeatherRecords
+
+    backend, apixu_server, api_key_file = build_environment(args)
+    apixu = ApixuWeather(api_key_file=api_key_file, base_url=apixu_server.url)
+    wr = WeatherRecords(backend=backend, apixu=apixu)
+    wr_records = WeatherRecords(backend=backend, apixu=apixu, use_summary_table=False)
+
+    # Cycle through the cities so cold calls are not served by another cache along the way
+    cities = itertools.cycle(wr.cities)
+    city_value = wr.cities[0]
+
+    def cold(method, *method_args, records=False):
+        instance = wr_records if records else wr
+
+        def call():
+            city = next(cities)
+            instance.invalidate_city_cache(city)
+            method(instance, city, *method_args)
+        return call
+
+    def compare_cold(records=False):
+        instance = wr_records if records else wr
+        compare = wr.cities[:5]
+
+        def call():
+            instance.invalidate_city_cache()
+            instance.calc_cities_df(compare, "Celsius")
+        return call
+
+    def recent_weather_cold_forecast():
+        apixu.forecast_cache.invalidate()
+        wr.get_recent_weather(next(cities), "Celsius")
+
+    # Fill the history cache so the forecast is the only upstream call of a cold forecast
+    for city in wr.cities:
+        wr.get_recent_weather(city, "Celsius")
+
+    benchmarks = [
+        ("calc_city_df summary (cold)", cold(WeatherRecords.calc_city_df, "Celsius")),
+        ("calc_city_df records (cold)", cold(WeatherRecords.calc_city_df, "Celsius", records=True)),
+        ("calc_city_df (warm)", lambda: wr.calc_city_df(city_value, "Celsius")),
+        ("calc_cities_df x5 summary (cold)", compare_cold()),
+        ("calc_cities_df x5 records (cold)", compare_cold(records=True)),
+        ("calc_temp_change (cold)", cold(WeatherRecords.calc_temp_change, "Celsius", "AvgTemp")),
+        ("calc_temp_change (warm)", lambda: wr.calc_temp_change(city_value, "Celsius", "AvgTemp")),
+        ("city_summary (cold)", cold(WeatherRecords.city_summary)),
+        ("get_daily_history (cold)", cold(WeatherRecords.get_daily_history)),
+        ("get_daily_history (warm)", lambda: wr.get_daily_history(city_value)),
+        ("get_recent_weather (cold forecast)", recent_weather_cold_forecast),
+        ("get_recent_weather (warm)", lambda: wr.get_recent_weather(city_value, "Celsius")),
+    ]
+
+    results = {}
+    try:
+        for name, func in benchmarks:
+            func()
+            results[name] = time_calls(func, args.repeat)
+    finally:
+        apixu_server.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_dataset_args(parser)
+    parser.add_argument('--repeat', type=int, default=50, help='Timed calls of each benchmark')
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    print("\nPeak memory: {} MB".format(peak_memory_mb()))
+
+    if args.save_baseline:
+        print("Baseline saved to {}".format(save_baseline(args.save_baseline, results, vars(args))))
+    if args.compare and compare_baseline(args.compare, results, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+""" Microbenchmark of the yearly city aggregation in WeatherRecords.
+
+Compares the previous implementation (convert every monthly row, three groupbys and two joins, and a separate query
+per temperature unit) with the current one (a single groupby-agg pass over the Fahrenheit records, converted after
+aggregation) on a synthetic 60-year, multi-station city.
+
+Usage (from the repository root):
+    python benchmarks/bench_city_aggregation.py [--stations 12] [--years 60] [--repeat 20] [--decimal]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "app"))
+
+from weather_records import WeatherRecords  # noqa: E402
+
+
+TEMP_VARS = ["MaxTemp", "MinTemp", "AvgTemp"]
+
+
+def synthetic_city_records(stations=12, years=60, start_year=1959, decimal=False, seed=0):
+    """ Generate the monthly records of a city, as returned by backend.city_records
+    Args:
+        stations (int): Number of stations in the city
+        years (int): Number of years of records per station
+        start_year (int): First year of records
+        decimal (bool): Return Decimal temperatures, as pymysql does for DECIMAL columns
+        seed (int): Random seed
+    Returns:
+        pd.DataFrame: StationId, Year, Month, MaxTemp, MinTemp and AvgTemp of each station-month
+    """
+    rng = np.random.RandomState(seed)
+    station_ids = np.repeat(np.arange(stations) + 720000, years * 12)
+    year = np.tile(np.repeat(np.arange(start_year, start_year + years), 12), stations)
+    month = np.tile(np.arange(1, 13), stations * years)
+
+    seasonal = 55 + 20 * np.sin((month - 4) / 12.0 * 2 * np.pi)
+    avg = np.round(seasonal + rng.normal(0, 3, len(month)), 1)
+    df = pd.DataFrame({
+        'StationId': station_ids,
+        'Year': year,
+        'Month': month,
+        'MaxTemp': np.round(avg + 15 + rng.normal(0, 2, len(month)), 1),
+        'MinTemp': np.round(avg - 15 + rng.normal(0, 2, len(month)), 1),
+        'AvgTemp': avg
+    })
+    if decimal:
+        for i in TEMP_VARS:
+            df[i] = [Decimal(str(v)) for v in df[i]]
+
+    return df
+
+
+class SyntheticBackend:
+    """ In-memory backend serving one synthetic city """
+
+    def __init__(self, records):
+        self.records = records
+
+    def data_version(self, name="Cities"):
+        return "1"
+
+    def load_cities(self):
+        return pd.DataFrame({'CityId': [1], 'City': ["Synthetic City"]})
+
+    def city_records(self, city_id):
+        return self.records.copy()
+
+
+def previous_calc_city_df(records, city_value, temp_value):
+    """ The aggregation as it was before the single-pass rewrite """
+    df = records.copy()
+    df['City'] = city_value
+
+    # Convert every monthly row, column by column
+    if temp_value == "Celsius":
+        for i in TEMP_VARS:
+            df[i] = round((df.loc[:, i] - 32) * 5 / 9, 1)
+
+    df_max = df.groupby(['City', 'Year']).max().reset_index()
+    df_min = df.groupby(['City', 'Year']).min().reset_index()
+    df_avg = df.groupby(['City', 'Year']).mean().reset_index()
+
+    df = df_avg[['Year', 'AvgTemp', 'City']]
+    df = df.join(df_max.MaxTemp)
+    df = df.join(df_min.MinTemp)
+
+    return df.reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=12, help="Stations in the synthetic city")
+    parser.add_argument("--years", type=int, default=60, help="Years of monthly records per station")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs of each variant")
+    parser.add_argument("--decimal", action="store_true", help="Use Decimal temperatures, as returned by pymysql")
+    args = parser.parse_args()
+
+    records = synthetic_city_records(args.stations, args.years, decimal=args.decimal)
+    city_value = "Synthetic City"
+    index_path = os.path.join(tempfile.mkdtemp(), "city_index.json")
+    wr = WeatherRecords(backend=SyntheticBackend(records), use_summary_table=False, apixu=object(),
+                        city_index_path=index_path)
+
+    def previous():
+        # One query and aggregation per unit
+        previous_calc_city_df(records, city_value, "Fahrenheit")
+        previous_calc_city_df(records, city_value, "Celsius")
+
+    def current_cold():
+        # One aggregation, each unit is derived from the cached Fahrenheit result
+        wr.invalidate_city_cache()
+        wr.calc_city_df(city_value, "Fahrenheit", TEMP_VARS)
+        wr.calc_city_df(city_value, "Celsius", TEMP_VARS)
+
+    def current_unit_switch():
+        # Switching unit once the city is cached
+        wr.calc_city_df(city_value, "Celsius", TEMP_VARS)
+
+    print("{:,} monthly records ({} stations x {} years){}".format(
+        len(records), args.stations, args.years, ", Decimal values" if args.decimal else ""))
+    for name, func in [("previous (both units)", previous),
+                       ("single pass (both units)", current_cold),
+                       ("unit switch (cached)", current_unit_switch)]:
+        func()
+        times = timeit.repeat(func, number=1, repeat=args.repeat)
+        print("{:<26} best {:8.2f} ms   median {:8.2f} ms".format(
+            name, min(times) * 1000, float(np.median(times)) * 1000))
+
+
+if __name__ == '__main__':
+    main()
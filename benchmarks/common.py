@@ -0,0 +1,186 @@
+""" Shared setup, measurement and baseline helpers of the benchmark suite """
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCHMARKS_DIR, os.pardir, "app")
+DATA_WRANGLING_DIR = os.path.join(BENCHMARKS_DIR, os.pardir, "data_wrangling")
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, "baselines")
+
+for path in (APP_DIR, DATA_WRANGLING_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def add_dataset_args(parser):
+    """ Add the synthetic dataset and baseline arguments to a command line parser
+    Args:
+        parser (argparse.ArgumentParser): Parser to add the arguments to
+    """
+    parser.add_argument('--cities', type=int, default=20, help='Number of synthetic cities')
+    parser.add_argument('--stations', type=int, default=3, help='Weather stations per city')
+    parser.add_argument('--years', type=int, default=60, help='Years of monthly records per station')
+    parser.add_argument('--backend', choices=['memory', 'feather'], default='memory',
+                        help='Serve the dataset from memory or from the columnar store (requires pyarrow)')
+    parser.add_argument('--apixu-latency', type=float, default=0.05, help='Seconds of latency of the fake Apixu API')
+    parser.add_argument('--save-baseline', metavar='NAME', help='Save the results as a named baseline')
+    parser.add_argument('--compare', metavar='NAME', help='Compare the results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown against the baseline reported as a regression')
+
+
+def build_environment(args):
+    """ Generate the dataset, start the fake Apixu server and move into a scratch working directory (the app writes
+    its city index, station index and history cache to the working directory)
+    Args:
+        args (argparse.Namespace): Parsed arguments of add_dataset_args
+    Returns:
+        tuple: (backend, FakeApixuServer, api key file path)
+    """
+    from fake_apixu import FakeApixuServer
+    from synthetic import MemoryBackend, generate_dataset, write_feather_store
+
+    workdir = tempfile.mkdtemp(prefix="globalwarming-bench-")
+    os.chdir(workdir)
+
+    dataset = generate_dataset(args.cities, args.stations, args.years)
+    if args.backend == 'feather':
+        from backends import FeatherBackend
+        backend = FeatherBackend(write_feather_store(dataset, os.path.join(workdir, "store")))
+    else:
+        backend = MemoryBackend(dataset)
+
+    api_key_file = os.path.join(workdir, "apixu_key.txt")
+    with open(api_key_file, "w") as file:
+        file.write("benchmark")
+
+    return backend, FakeApixuServer(args.apixu_latency).start(), api_key_file
+
+
+def percentile(values, q):
+    """ Percentile of a list of values by linear interpolation
+    Args:
+        values (list): Values
+        q (float): Percentile between 0 and 100
+    Returns:
+        float: The percentile, or None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarise(latencies, elapsed=None, errors=0):
+    """ Summarise a list of latencies
+    Args:
+        latencies (list): Latencies in seconds
+        elapsed (float): Wall clock seconds the latencies were collected over, for the throughput
+        errors (int): Number of failed calls
+    Returns:
+        dict: count, errors, p50/p95/p99/max in milliseconds and throughput in calls per second
+    """
+    total = elapsed if elapsed is not None else sum(latencies)
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else None,
+        "throughput_per_s": round(len(latencies) / total, 2) if total else None
+    }
+
+
+def time_calls(func, repeat):
+    """ Time repeated calls of a function
+    Args:
+        func (callable): Function with no arguments
+        repeat (int): Number of calls
+    Returns:
+        dict: Summary of the latencies (see summarise)
+    """
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call_start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_start)
+    return summarise(latencies, time.perf_counter() - start)
+
+
+def peak_memory_mb():
+    """ Peak resident memory of the process
+    Returns:
+        float: Megabytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def print_results(results):
+    """ Print benchmark results as a table
+    Args:
+        results (dict): Benchmark name to summary
+    """
+    print("{:<36} {:>7} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+        "benchmark", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "per sec"))
+    for name, r in results.items():
+        print("{:<36} {:>7} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+            name, r["count"], r["errors"], r["p50_ms"], r["p95_ms"], r["p99_ms"], r["throughput_per_s"]))
+
+
+def save_baseline(name, results, config):
+    """ Save results as a named baseline in benchmarks/baselines
+    Args:
+        name (str): Baseline name
+        results (dict): Benchmark name to summary
+        config (dict): Arguments the results were produced with
+    Returns:
+        str: Path of the baseline file
+    """
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    path = os.path.join(BASELINES_DIR, name + ".json")
+    with open(path, "w") as file:
+        json.dump({"config": config, "results": results, "saved": time.strftime("%Y-%m-%d %H:%M:%S")}, file,
+                  indent=1, sort_keys=True)
+    return path
+
+
+def compare_baseline(name, results, threshold=0.2):
+    """ Compare results with a named baseline and print the changes in p50 and p95 latency
+    Args:
+        name (str): Baseline name
+        results (dict): Benchmark name to summary
+        threshold (float): Relative slowdown reported as a regression
+    Returns:
+        list: Names of the benchmarks which regressed
+    """
+    with open(os.path.join(BASELINES_DIR, name + ".json")) as file:
+        baseline = json.load(file)["results"]
+
+    regressions = []
+    print("\nCompared with baseline '{}':".format(name))
+    for bench, r in results.items():
+        if bench not in baseline:
+            continue
+        changes = []
+        for metric in ("p50_ms", "p95_ms"):
+            old, new = baseline[bench].get(metric), r.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            changes.append("{} {:+.1%}".format(metric, change))
+            if change > threshold and bench not in regressions:
+                regressions.append(bench)
+        print("  {:<36} {}{}".format(bench, ", ".join(changes), "  REGRESSION" if bench in regressions else ""))
+
+    return regressions
@@ -0,0 +1,87 @@
+""" Local fake of the Apixu history and forecast API, with a configurable response latency """
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+
+def forecast_day(date, max_temp=70.0):
+    """ Build an Apixu forecastday entry
+    Args:
+        date (datetime.date): Date of the entry
+        max_temp (float): Maximum temperature in degrees Fahrenheit
+    Returns:
+        dict: The forecastday
+    """
+    return {
+        'date': date.strftime('%Y-%m-%d'),
+        'day': {
+            'maxtemp_f': max_temp,
+            'mintemp_f': max_temp - 20,
+            'avgtemp_f': max_temp - 10,
+            'maxwind_kph': 12.0,
+            'totalprecip_mm': 0.0,
+            'avgvis_km': 10.0,
+            'avghumidity': 55.0,
+            'condition': {'text': 'Sunny'},
+            'uv': 5.0
+        }
+    }
+
+
+class FakeApixuServer:
+    """ Serves /history.json and /forecast.json on a local port in a background thread """
+
+    def __init__(self, latency=0.05):
+        """
+        Args:
+            latency (float): Seconds each response is delayed by, to mimic the network round trip
+        """
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                server.requests += 1
+                time.sleep(server.latency)
+
+                if url.path.endswith("history.json"):
+                    days = [forecast_day(datetime.datetime.strptime(params['dt'][0], '%Y-%m-%d').date())]
+                else:
+                    today = datetime.date.today()
+                    days = [forecast_day(today + datetime.timedelta(days=i)) for i in range(int(params['days'][0]))]
+
+                body = json.dumps({'forecast': {'forecastday': days}}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client gave up waiting, e.g. after its request timeout
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="FakeApixu", daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self._httpd.server_address[1])
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,185 @@
+""" Load test of the dashboard's callback endpoints.
+
+Serves the Dash app in-process against a synthetic dataset and a local fake of the Apixu API, then drives concurrent
+simulated users through it. Each user repeatedly searches for a city and selects it, which fires the city summary,
+forecast and station map callbacks as the browser would (switching unit is handled client-side, so it makes no
+request). With --export-ratio, that fraction of the selections also downloads the city's monthly series from the
+bulk export API.
+
+Usage (from the repository root):
+    python benchmarks/load_test.py [--users 20] [--duration 30] [--cities 20] [--stations 3] [--years 60]
+        [--backend memory|feather] [--export-ratio 0.1] [--save-baseline NAME] [--compare NAME]
+"""
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from common import add_dataset_args, build_environment, compare_baseline, peak_memory_mb, print_results
+from common import save_baseline, summarise
+
+
+def callback_payload(outputs, inputs, state=()):
+    """ Build the body of a request to /_dash-update-component
+    Args:
+        outputs (list): (component id, property) of each output of the callback
+        inputs (list): (component id, property, value) of each input
+        state (list): (component id, property, value) of each state
+    Returns:
+        dict: The request body
+    """
+    if len(outputs) > 1:
+        output = "..{}..".format("...".join("{}.{}".format(i, p) for i, p in outputs))
+        outputs_list = [{"id": i, "property": p} for i, p in outputs]
+    else:
+        output = "{}.{}".format(*outputs[0])
+        outputs_list = {"id": outputs[0][0], "property": outputs[0][1]}
+
+    return {
+        "output": output,
+        "outputs": outputs_list,
+        "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+        "state": [{"id": i, "property": p, "value": v} for i, p, v in state],
+        "changedPropIds": ["{}.{}".format(inputs[0][0], inputs[0][1])]
+    }
+
+
+def user_actions(city_value):
+    """ The requests made by the browser when a user searches for and selects a city
+    Args:
+        city_value (str): City dropdown label
+    Returns:
+        list: (name, payload) pairs
+    """
+    search_value = city_value.split(",")[0][:4]
+    return [
+        ("city search", callback_payload(
+            [("city-selector", "options"), ("city-selector", "value")],
+            [("city-selector", "search_value", search_value), ("station-map", "clickData", None)],
+            [("city-selector", "value", city_value)])),
+        ("city summary", callback_payload(
+            [("city-summary", "data"), ("tile1_year_range", "children"), ("tile2_year_range", "children"),
+             ("tile3_year_range", "children")],
+            [("city-selector", "value", city_value)])),
+        ("forecast", callback_payload(
+            [("forecast-data", "data")],
+            [("city-selector", "value", city_value)])),
+        ("station map", callback_payload(
+            [("station-map", "figure")],
+            [("city-selector", "value", city_value)])),
+    ]
+
+
+def run(args):
+    """ Run the load test
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    Returns:
+        dict: Callback name to latency summary
+    """
+    from apixu_weather import ApixuWeather
+    from werkzeug.serving import make_server
+
+    backend, apixu_server, api_key_file = build_environment(args)
+
+    # Import the app from the scratch working directory and point it at the synthetic data
+    import app as dashboard
+    dashboard.wr._backend = backend
+    dashboard.wr._apixu = ApixuWeather(api_key_file=api_key_file, base_url=apixu_server.url)
+    cities = dashboard.wr.cities
+
+    # Serve the app on a free local port, without logging every request
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, dashboard.app.server, threaded=True)
+    threading.Thread(target=server.serve_forever, name="DashServer", daemon=True).start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def user(seed):
+        session = requests.Session()
+        rng = random.Random(seed)
+        session.get(url + "/")
+        while not stop.is_set():
+            # Popular cities are picked more often, like real traffic
+            city_value = cities[min(int(rng.expovariate(0.2)), len(cities) - 1)]
+            for name, payload in user_actions(city_value):
+                start = time.perf_counter()
+                try:
+                    response = session.post(url + "/_dash-update-component", json=payload, timeout=30)
+                    ok = response.status_code in (200, 204)
+                except requests.RequestException:
+                    ok = False
+                with lock:
+                    if ok:
+                        latencies[name].append(time.perf_counter() - start)
+                    else:
+                        errors[name] += 1
+
+            # Some users also download the series of the city, reading the whole streamed response
+            if rng.random() < args.export_ratio:
+                start = time.perf_counter()
+                try:
+                    response = session.get(url + "/api/export", params={"city": city_value, "resolution": "monthly"},
+                                           timeout=30)
+                    ok = response.status_code == 200
+                except requests.RequestException:
+                    ok = False
+                with lock:
+                    if ok:
+                        latencies["export"].append(time.perf_counter() - start)
+                    else:
+                        errors["export"] += 1
+            time.sleep(args.think_time)
+
+    users = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(args.users)]
+    start = time.perf_counter()
+    for thread in users:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in users:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    apixu_server.stop()
+
+    results = {name: summarise(latencies[name], elapsed, errors[name]) for name in sorted(set(latencies) | set(errors))}
+    callbacks = [name for name in set(latencies) | set(errors) if name != "export"]
+    results["all callbacks"] = summarise(
+        [v for name in callbacks for v in latencies[name]], elapsed, sum(errors[name] for name in callbacks))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_dataset_args(parser)
+    parser.add_argument('--users', type=int, default=20, help='Number of concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run the test for')
+    parser.add_argument('--think-time', type=float, default=0.5, help='Seconds each user waits between cities')
+    parser.add_argument('--export-ratio', type=float, default=0.0,
+                        help='Fraction of the city selections which also export the city\'s monthly series')
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    print("\nPeak memory: {} MB".format(peak_memory_mb()))
+
+    if args.save_baseline:
+        print("Baseline saved to {}".format(save_baseline(args.save_baseline, results, vars(args))))
+    if args.compare and compare_baseline(args.compare, results, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
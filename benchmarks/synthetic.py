@@ -0,0 +1,214 @@
+""" Synthetic GSOD-shaped dataset and an in-memory backend for the benchmarks.
+
+The dataset has the shape of the cleaned wrangling outputs (station details, monthly StationRecords and the
+DailyAvg baselines), so it can be served directly from memory or written to the columnar store read by FeatherBackend.
+"""
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from common import DATA_WRANGLING_DIR  # noqa: F401 (puts the pipeline package on the path)
+from pipeline.climatology import compute_climatology
+from pipeline.columnar import build_columnar_store
+
+
+def generate_dataset(cities=20, stations_per_city=3, years=60, start_year=1959, seed=0):
+    """ Generate a synthetic dataset
+    Args:
+        cities (int): Number of cities
+        stations_per_city (int): Number of weather stations in each city
+        years (int): Years of monthly records per station
+        start_year (int): First year of monthly records. The daily baseline covers this year
+        seed (int): Random seed
+    Returns:
+        dict: station_details, records (monthly StationRecords) and daily (DailyAvg) DataFrames
+    """
+    rng = np.random.RandomState(seed)
+    n_stations = cities * stations_per_city
+
+    # Stations scattered around each city centre, with a warming trend that varies by city
+    city_lat = rng.uniform(-60, 70, cities)
+    city_lon = rng.uniform(-180, 180, cities)
+    city_of_station = np.repeat(np.arange(cities), stations_per_city)
+    station_ids = np.arange(n_stations) + 700000
+    station_details = pd.DataFrame({
+        'StationId': station_ids,
+        'City': ["City {}".format(c) for c in city_of_station],
+        'State': ["State {}".format(c % 7) for c in city_of_station],
+        'Country': ["Country {}".format(c % 3) for c in city_of_station],
+        'Lat': city_lat[city_of_station] + rng.normal(0, 0.2, n_stations),
+        'Lon': city_lon[city_of_station] + rng.normal(0, 0.2, n_stations)
+    })
+    base_temp = 70 - np.abs(city_lat) * 0.5
+    trend = rng.uniform(0, 0.05, cities)
+
+    # Monthly records of every station
+    n_months = years * 12
+    station = np.repeat(np.arange(n_stations), n_months)
+    year = np.tile(np.repeat(np.arange(start_year, start_year + years), 12), n_stations)
+    month = np.tile(np.arange(1, 13), n_stations * years)
+    city = city_of_station[station]
+    seasonal = 15 * np.sin((month - 4) / 12.0 * 2 * np.pi) * np.sign(city_lat[city])
+    temp = base_temp[city] + seasonal + trend[city] * (year - start_year) + rng.normal(0, 2, len(station))
+    records = pd.DataFrame({
+        'StationId': station_ids[station],
+        'Year': year,
+        'Month': month,
+        'Temp': np.round(temp, 1),
+        'MaxTemp': np.round(temp + 15 + rng.normal(0, 2, len(station)), 1),
+        'MinTemp': np.round(temp - 15 + rng.normal(0, 2, len(station)), 1)
+    })
+
+    # Daily maximum temperatures of every station in the first year
+    dates = pd.date_range(datetime.date(start_year, 1, 1), datetime.date(start_year, 12, 31))
+    day_station = np.repeat(np.arange(n_stations), len(dates))
+    day_of_year = np.tile(np.arange(len(dates)), n_stations)
+    day_city = city_of_station[day_station]
+    daily_max = (base_temp[day_city] + 15 + 15 * np.sin((day_of_year - 100) / 365.0 * 2 * np.pi)
+                 * np.sign(city_lat[day_city]) + rng.normal(0, 4, len(day_station)))
+    daily = pd.DataFrame({
+        'StationId': station_ids[day_station],
+        'Date': np.tile(dates.values, n_stations),
+        'MaxTemp': np.round(daily_max, 1)
+    })
+
+    return {'station_details': station_details, 'records': records, 'daily': daily}
+
+
+def write_feather_store(dataset, out_dir):
+    """ Write a dataset to the columnar store read by FeatherBackend (requires pyarrow)
+    Args:
+        dataset (dict): Dataset returned by generate_dataset
+        out_dir (str): Folder to write the store to
+    Returns:
+        str: out_dir
+    """
+    source_dir = os.path.join(out_dir, "source")
+    os.makedirs(source_dir, exist_ok=True)
+    paths = []
+    for name in ['station_details', 'records', 'daily']:
+        path = os.path.join(source_dir, name + ".feather")
+        dataset[name].to_feather(path)
+        paths.append(path)
+    build_columnar_store(paths[0], paths[1], paths[2], out_dir)
+
+    return out_dir
+
+
+class MemoryBackend:
+    """ Backend serving a synthetic dataset from memory, with the same methods as the app's backends.
+    Every call filters the full frames, so its cost grows with the dataset like a scan would """
+
+    def __init__(self, dataset):
+        """
+        Args:
+            dataset (dict): Dataset returned by generate_dataset
+        """
+        details = dataset['station_details']
+        labels = details.City + ", " + details.State + ", " + details.Country
+        self.cities = pd.DataFrame({'City': labels.unique()})
+        self.cities['CityId'] = range(1, len(self.cities) + 1)
+        station_city = pd.Series(labels.map(self.cities.set_index('City').CityId).values, index=details.StationId)
+
+        self.stations = pd.DataFrame({
+            'StationId': details.StationId.astype(str),
+            'CityId': station_city.values,
+            'Lat': details.Lat,
+            'Lon': details.Lon
+        })
+        self.records = dataset['records'].assign(CityId=dataset['records'].StationId.map(station_city))
+        self.daily = dataset['daily'].assign(CityId=dataset['daily'].StationId.map(station_city))
+
+        yearly = self.records.groupby(['CityId', 'Year']).agg({'MaxTemp': 'max', 'MinTemp': 'min', 'Temp': 'mean'})
+        yearly = yearly.reset_index().rename(columns={'MaxTemp': 'MaxTempF', 'MinTemp': 'MinTempF', 'Temp': 'AvgTempF'})
+        self.yearly = yearly
+        self.climatology, self.decades = compute_climatology(yearly)
+
+        # National CO2 emissions of each country over the years of the summaries, growing by 3% a year
+        countries = pd.Series(details.Country.values, index=labels.values).groupby(level=0).first()
+        self.city_countries = pd.DataFrame({'CityId': self.cities.CityId, 'Country': self.cities.City.map(countries)})
+        co2 = pd.MultiIndex.from_product([sorted(countries.unique()), sorted(yearly.Year.unique())],
+                                         names=['Country', 'Year']).to_frame(index=False)
+        co2['Emissions'] = np.round((co2.Country.str.len() * 100) * 1.03 ** (co2.Year - co2.Year.min()), 3)
+        self.co2 = co2
+
+    def stats(self):
+        return {"records": len(self.records), "daily": len(self.daily)}
+
+    def data_version(self, name="Cities"):
+        return "synthetic-{}".format(len(self.records))
+
+    def load_cities(self):
+        return self.cities.loc[:, ['CityId', 'City']]
+
+    def load_stations(self):
+        return self.stations
+
+    def load_country_co2(self):
+        return self.co2, self.city_countries
+
+    def city_summary(self, city_id, temp_value="Celsius"):
+        df = self.yearly[self.yearly.CityId == city_id]
+        df = df.rename(columns={'MaxTempF': 'MaxTemp', 'MinTempF': 'MinTemp', 'AvgTempF': 'AvgTemp'})
+        return df.loc[:, ['Year', 'AvgTemp', 'MaxTemp', 'MinTemp']].reset_index(drop=True)
+
+    def cities_summary(self, city_ids, temp_value="Celsius"):
+        df = self.yearly[self.yearly.CityId.isin(city_ids)]
+        df = df.rename(columns={'MaxTempF': 'MaxTemp', 'MinTempF': 'MinTemp', 'AvgTempF': 'AvgTemp'})
+        return df.loc[:, ['CityId', 'Year', 'AvgTemp', 'MaxTemp', 'MinTemp']].reset_index(drop=True)
+
+    def city_climatology(self, city_id):
+        return (self.climatology[self.climatology.CityId == city_id].reset_index(drop=True),
+                self.decades.loc[self.decades.CityId == city_id, ['Decade', 'AvgTempF', 'AnomalyF']])
+
+    def city_records(self, city_id):
+        df = self.records[self.records.CityId == city_id]
+        return df.loc[:, ['StationId', 'Year', 'Month', 'MaxTemp', 'MinTemp', 'Temp']].rename(
+            columns={'Temp': 'AvgTemp'}).reset_index(drop=True)
+
+    def cities_records(self, city_ids):
+        df = self.records[self.records.CityId.isin(city_ids)]
+        return df.loc[:, ['CityId', 'StationId', 'Year', 'Month', 'MaxTemp', 'MinTemp', 'Temp']].rename(
+            columns={'Temp': 'AvgTemp'}).reset_index(drop=True)
+
+    def city_daily_baseline(self, city_id):
+        df = self.daily[self.daily.CityId == city_id]
+        df = df[~((df.Date.dt.month == 2) & (df.Date.dt.day == 29))]
+        day_of_year = df.Date.dt.dayofyear - (df.Date.dt.is_leap_year & (df.Date.dt.month > 2)).astype(int)
+        df = df.assign(DayOfYear=day_of_year, Year=df.Date.dt.year)
+        return df.groupby(['DayOfYear', 'Year']).MaxTemp.mean().round(2).reset_index()
+
+    def export_series(self, resolution="yearly", city_ids=None, start_year=None, end_year=None, columns=None,
+                      batch_size=5000):
+        from backends import EXPORT_COLUMNS
+
+        columns = list(EXPORT_COLUMNS) if columns is None else columns
+        keys = ['Year'] if resolution == "yearly" else ['Year', 'Month']
+        labels = self.cities.set_index('CityId').City
+        city_ids = sorted(labels.index) if city_ids is None else city_ids
+
+        for city_id in city_ids:
+            if city_id not in labels.index:
+                continue
+            df = self.records[self.records.CityId == city_id]
+            if start_year is not None:
+                df = df[df.Year >= start_year]
+            if end_year is not None:
+                df = df[df.Year <= end_year]
+            if df.empty:
+                continue
+
+            df = df.groupby(keys).agg(
+                {'MaxTemp': 'max', 'MinTemp': 'min', 'Temp': 'mean', 'StationId': 'nunique'}).reset_index()
+            df = df.rename(columns={'MaxTemp': 'MaxTempF', 'MinTemp': 'MinTempF', 'Temp': 'AvgTempF',
+                                    'StationId': 'NumberStations'})
+            for temp in ['MaxTemp', 'MinTemp', 'AvgTemp']:
+                df[temp + 'C'] = np.round((df[temp + 'F'] - 32) * 5 / 9, 3)
+            df.insert(0, 'CityId', city_id)
+            df.insert(0, 'City', labels[city_id])
+
+            rows = [tuple(row) for row in df.loc[:, ['City', 'CityId'] + keys + columns].astype(object).values.tolist()]
+            for i in range(0, len(rows), batch_size):
+                yield rows[i:i + batch_size]
@@ -0,0 +1,5 @@
+""" Command line data pipeline for building and refreshing the globalwarming database.
+
+Run from the data_wrangling folder, e.g.:
+    python -m pipeline --help
+"""
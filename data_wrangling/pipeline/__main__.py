@@ -0,0 +1,236 @@
+import argparse
+import glob
+import time
+
+import pandas as pd
+
+from pipeline import bulk_load
+from pipeline import cities
+from pipeline import climatology
+from pipeline import co2
+from pipeline import columnar
+from pipeline import daily_baseline
+from pipeline import db
+from pipeline import incremental
+from pipeline import ingest
+from pipeline import summary
+
+
+def run_cities(args):
+    """ Build the Cities dimension and map StationDetails to CityIds """
+    connection = db.connect_from_args(args)
+    try:
+        new_cities, mapped = cities.build_cities(connection)
+        print("Cities built: {} new cities, {} stations mapped".format(new_cities, mapped))
+        if args.index_out:
+            count = cities.write_city_index(connection, args.index_out)
+            print("City index of {} cities written to {}".format(count, args.index_out))
+    finally:
+        connection.close()
+
+
+def run_climatology(args):
+    """ Rebuild the CityClimatology and CityDecadeAnomaly tables from CityYearSummary """
+    connection = db.connect_from_args(args)
+    start = time.time()
+    try:
+        city_count, decade_count = climatology.refresh_climatology(connection, args.baseline_start, args.baseline_end)
+    finally:
+        connection.close()
+    print("Climatology refreshed: {} cities, {} city-decades in {:.1f}s".format(
+        city_count, decade_count, time.time() - start))
+
+
+def run_co2(args):
+    """ Rebuild the CountryYearCO2 table and optionally write the app's CO2 index """
+    connection = db.connect_from_args(args)
+    try:
+        rows = co2.refresh_country_co2(connection)
+        print("CountryYearCO2 refreshed: {} country-years".format(rows))
+        if args.index_out:
+            country_count, city_count = co2.write_co2_index(connection, args.index_out)
+            print("CO2 index of {} countries ({} cities) written to {}".format(
+                country_count, city_count, args.index_out))
+    finally:
+        connection.close()
+
+
+def run_columnar(args):
+    """ Build the columnar store used by the app's read-only FeatherBackend """
+    start = time.time()
+    counts = columnar.build_columnar_store(args.station_details, args.records, args.daily_avg, args.out)
+    print("Columnar store written to {}: {} cities, {} monthly records, {} daily records in {:.1f}s".format(
+        args.out, counts['cities'], counts['records'], counts['daily'], time.time() - start))
+
+
+def run_daily_baseline(args):
+    """ Rebuild the CityDailyBaseline table from DailyAvg """
+    connection = db.connect_from_args(args)
+    start = time.time()
+    try:
+        rows = daily_baseline.refresh_daily_baseline(connection)
+    finally:
+        connection.close()
+    print("CityDailyBaseline refreshed: {} rows in {:.1f}s".format(rows, time.time() - start))
+
+
+def run_incremental(args):
+    """ Ingest only the new or changed GSOD station files and upsert their station-years """
+    if args.record_only:
+        count = incremental.record_manifest(args.source, args.manifest, args.years)
+        print("{} station files recorded in {}".format(count, args.manifest))
+        return
+
+    connection = db.connect_from_args(args)
+    try:
+        result = incremental.ingest_incremental(
+            connection, args.source, args.manifest, args.years, workers=args.workers, chunk_size=args.chunk_size,
+            dry_run=args.dry_run)
+    finally:
+        connection.close()
+    print("Incremental ingestion: {} changed files ({} failed), {} station-years replaced, {} CityYearSummary rows "
+          "refreshed in {:.1f}s".format(result['changed'], result['failed'], result['station_years'],
+                                        result['summary_rows'], result['seconds']))
+    if result['station_years']:
+        print("Run `python -m pipeline climatology` to refresh the trends of the affected cities")
+
+
+def run_ingest(args):
+    """ Convert GSOD station files into partitioned monthly records """
+    start = time.time()
+    written = ingest.ingest(args.source, args.out, args.start_year, args.end_year,
+                            workers=args.workers, chunk_size=args.chunk_size, file_format=args.format)
+    print("Finished ingesting {} monthly records in {:.1f}s".format(sum(written.values()), time.time() - start))
+
+
+def run_load(args):
+    """ Bulk load partition files into a table, resuming from the checkpoint of an interrupted load """
+    partitions = sorted(set(path for pattern in args.files for path in glob.glob(pattern)))
+    connection = db.connect_from_args(args, local_infile=args.method == 'load-data')
+    try:
+        result = bulk_load.bulk_load(
+            connection, args.table, partitions, method=args.method, batch_size=args.batch_size,
+            checkpoint_path=args.checkpoint, defer_indexes=not args.keep_indexes)
+    finally:
+        connection.close()
+    print("{} loaded: {} rows from {} partitions ({} already loaded) in {:.1f}s, {:,.0f} rows/sec".format(
+        args.table, result['rows'], result['partitions_loaded'], result['partitions_skipped'], result['seconds'],
+        result['rows_per_sec']))
+
+
+def run_summary(args):
+    """ Refresh the CityYearSummary table, either fully or for the station-years of a newly loaded file """
+    connection = db.connect_from_args(args)
+    start = time.time()
+    try:
+        if args.records:
+            station_years = summary.touched_station_years(pd.read_feather(args.records, columns=['StationId', 'Year']))
+            rows = summary.refresh_incremental(connection, station_years)
+        else:
+            rows = summary.refresh_full(connection)
+    finally:
+        connection.close()
+    print("CityYearSummary refreshed: {} rows in {:.1f}s".format(rows, time.time() - start))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pipeline', description='globalwarming data pipeline')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    # GSOD ingestion
+    ingest_parser = subparsers.add_parser('ingest', help='Convert GSOD station files into monthly records')
+    ingest_parser.add_argument('--source', required=True, help='Folder containing one folder of station files per year')
+    ingest_parser.add_argument('--out', required=True, help='Folder to write one partition per year to')
+    ingest_parser.add_argument('--start-year', type=int, required=True, help='First year to ingest')
+    ingest_parser.add_argument('--end-year', type=int, required=True, help='Last year to ingest')
+    ingest_parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    ingest_parser.add_argument('--chunk-size', type=int, default=100000, help='Daily rows read at a time')
+    ingest_parser.add_argument('--format', choices=['csv', 'feather'], default='csv', help='Partition file format')
+    ingest_parser.set_defaults(func=run_ingest)
+
+    # Incremental ingestion
+    incremental_parser = subparsers.add_parser(
+        'incremental', help='Ingest only new or changed station files and upsert their station-years')
+    db.add_connection_args(incremental_parser)
+    incremental_parser.add_argument('--source', required=True,
+                                    help='Folder containing one folder of station files per year')
+    incremental_parser.add_argument('--manifest', default=incremental.MANIFEST_PATH,
+                                    help='Manifest of the checksums of the ingested files')
+    incremental_parser.add_argument('--years', type=int, nargs='+', help='Only scan these years (default: all)')
+    incremental_parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    incremental_parser.add_argument('--chunk-size', type=int, default=100000, help='Daily rows read at a time')
+    incremental_parser.add_argument('--dry-run', action='store_true', help='Only report the changed files')
+    incremental_parser.add_argument('--record-only', action='store_true',
+                                    help='Record the current files in the manifest without ingesting them (run once '
+                                         'after a full load)')
+    incremental_parser.set_defaults(func=run_incremental)
+
+    # Bulk loader
+    load_parser = subparsers.add_parser('load', help='Bulk load partition files into a table')
+    db.add_connection_args(load_parser)
+    load_parser.add_argument('--table', required=True, choices=bulk_load.LOAD_TABLES,
+                             help='Table to load')
+    load_parser.add_argument('--files', required=True, nargs='+', help='Partition files or glob patterns')
+    load_parser.add_argument('--method', choices=['load-data', 'insert'], default='load-data',
+                             help='LOAD DATA LOCAL INFILE (CSV only) or batched multi-row inserts')
+    load_parser.add_argument('--batch-size', type=int, default=5000, help='Rows per batch for --method insert')
+    load_parser.add_argument('--checkpoint', default='load_checkpoint.json',
+                             help='Checkpoint file used to resume an interrupted load')
+    load_parser.add_argument('--keep-indexes', action='store_true',
+                             help='Keep the secondary indexes during the load instead of rebuilding them afterwards')
+    load_parser.set_defaults(func=run_load)
+
+    # Cities dimension
+    cities_parser = subparsers.add_parser('cities', help='Build the Cities dimension from StationDetails')
+    db.add_connection_args(cities_parser)
+    cities_parser.add_argument('--index-out', help="Also write the app's city index to this file")
+    cities_parser.set_defaults(func=run_cities)
+
+    # Summary table refresh
+    summary_parser = subparsers.add_parser('summary', help='Refresh the CityYearSummary table')
+    db.add_connection_args(summary_parser)
+    summary_parser.add_argument(
+        '--records',
+        help='Feather file of newly loaded monthly StationRecords. Only the city-years it touches are recomputed. '
+             'If omitted, the whole table is rebuilt')
+    summary_parser.set_defaults(func=run_summary)
+
+    # Trend and anomaly statistics
+    climatology_parser = subparsers.add_parser(
+        'climatology', help='Refresh the CityClimatology and CityDecadeAnomaly tables (run after summary)')
+    db.add_connection_args(climatology_parser)
+    climatology_parser.add_argument('--baseline-start', type=int, default=climatology.BASELINE_START,
+                                    help='First year of the anomaly baseline')
+    climatology_parser.add_argument('--baseline-end', type=int, default=climatology.BASELINE_END,
+                                    help='Last year of the anomaly baseline')
+    climatology_parser.set_defaults(func=run_climatology)
+
+    # National CO2 emissions aligned to the yearly summaries, for the app's overlay
+    co2_parser = subparsers.add_parser(
+        'co2', help='Refresh the CountryYearCO2 table from CO2 (run after summary)')
+    db.add_connection_args(co2_parser)
+    co2_parser.add_argument('--index-out', help='Also write the CO2 index read by the app to this path')
+    co2_parser.set_defaults(func=run_co2)
+
+    # Day of year baselines for the forecast comparison
+    daily_baseline_parser = subparsers.add_parser(
+        'daily-baseline', help='Refresh the CityDailyBaseline table from DailyAvg')
+    db.add_connection_args(daily_baseline_parser)
+    daily_baseline_parser.set_defaults(func=run_daily_baseline)
+
+    # Columnar store for read-only deployments
+    columnar_parser = subparsers.add_parser(
+        'columnar', help='Build the memory-mapped columnar store read by the app\'s FeatherBackend')
+    columnar_parser.add_argument('--station-details', required=True, help='Path of station_details_cleaned.feather')
+    columnar_parser.add_argument('--records', required=True, help='Path of 1960-2018_monthly_cleaned.feather')
+    columnar_parser.add_argument('--daily-avg', required=True, help='Path of daily_avg.feather')
+    columnar_parser.add_argument('--out', required=True, help='Folder to write the store to')
+    columnar_parser.set_defaults(func=run_columnar)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Tables which can be bulk loaded from partition files
+LOAD_TABLES = ['StationDetails', 'StationRecords', 'DailyAvg']
+
+# Secondary indexes from sql_table_definition.sql which are dropped during a load and rebuilt afterwards, as
+# {table: {index name: columns}}. StationRecords and DailyAvg are only read by station, through their clustered
+# primary keys, so they have none. Indexes backing a foreign key cannot be dropped (MySQL error 1553, even with
+# FOREIGN_KEY_CHECKS = 0), so idx_StationDetails_CityId, the only index on FK_StationDetails_Cities(CityId), is kept
+# during StationDetails loads
+SECONDARY_INDEXES = {}
+
+
+class Checkpoint:
+    """ Records which partitions of a load have been committed, so an interrupted load can be resumed """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the JSON checkpoint file. None disables checkpointing
+        """
+        self.path = path
+        self.done = {}
+        if path and os.path.exists(path):
+            with open(path) as file:
+                self.done = json.load(file)
+
+    @staticmethod
+    def _key(table, partition):
+        return "{}:{}".format(table, os.path.abspath(partition))
+
+    @staticmethod
+    def _signature(partition):
+        stat = os.stat(partition)
+        return [stat.st_size, int(stat.st_mtime)]
+
+    def is_done(self, table, partition):
+        """ Check whether a partition has already been loaded (and has not changed since)
+        Args:
+            table (str): Table name
+            partition (str): Path of the partition file
+        Returns:
+            bool: True if the partition can be skipped
+        """
+        entry = self.done.get(self._key(table, partition))
+        return entry is not None and entry['signature'] == self._signature(partition)
+
+    def mark_done(self, table, partition, rows):
+        """ Record a committed partition
+        Args:
+            table (str): Table name
+            partition (str): Path of the partition file
+            rows (int): Number of rows loaded
+        """
+        self.done[self._key(table, partition)] = {'rows': rows, 'signature': self._signature(partition)}
+        if self.path:
+            # Write to a temporary file first so the checkpoint file is never left half written
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.done, file, indent=1)
+            os.replace(tmp_path, self.path)
+
+
+def existing_indexes(cursor, table):
+    """ Get the names of the indexes on a table
+    Args:
+        cursor: Database cursor
+        table (str): Table name
+    Returns:
+        set: Index names
+    """
+    cursor.execute(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", [table])
+    return set(row[0] for row in cursor.fetchall())
+
+
+def drop_secondary_indexes(connection, table):
+    """ Drop the secondary indexes of a table before a load (indexes already dropped by an interrupted run are skipped)
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        table (str): Table name
+    """
+    with connection.cursor() as cursor:
+        indexes = existing_indexes(cursor, table)
+        for name in SECONDARY_INDEXES.get(table, {}):
+            if name in indexes:
+                cursor.execute("ALTER TABLE `{}` DROP INDEX `{}`".format(table, name))
+
+
+def create_secondary_indexes(connection, table):
+    """ Rebuild the secondary indexes of a table after a load
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        table (str): Table name
+    """
+    with connection.cursor() as cursor:
+        indexes = existing_indexes(cursor, table)
+        for name, columns in SECONDARY_INDEXES.get(table, {}).items():
+            if name not in indexes:
+                cursor.execute("ALTER TABLE `{}` ADD INDEX `{}` {}".format(table, name, columns))
+
+
+def load_data_infile(cursor, table, path):
+    """ Load a CSV partition with LOAD DATA LOCAL INFILE
+    Args:
+        cursor: Database cursor of a connection opened with local_infile=True
+        table (str): Table name
+        path (str): Path of the CSV file. The header row names the columns and NULLs are written as \\N
+    Returns:
+        int: Number of rows loaded
+    """
+    with open(path, newline='') as file:
+        columns = next(csv.reader(file))
+
+    return cursor.execute(
+        "LOAD DATA LOCAL INFILE %s INTO TABLE `{}` "
+        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+        "LINES TERMINATED BY '\\n' IGNORE 1 LINES ({})".format(table, ", ".join("`{}`".format(c) for c in columns)),
+        [os.path.abspath(path)])
+
+
+def read_batches(path, batch_size):
+    """ Read a CSV or feather partition in batches
+    Args:
+        path (str): Path of the partition file
+        batch_size (int): Number of rows per batch
+    Returns:
+        generator: pd.DataFrame batches
+    """
+    if path.endswith(".feather"):
+        df = pd.read_feather(path)
+        for i in range(0, len(df), batch_size):
+            yield df.iloc[i:i + batch_size]
+    else:
+        for df in pd.read_csv(path, chunksize=batch_size, na_values=["\\N"], keep_default_na=False):
+            yield df
+
+
+def insert_batches(cursor, table, path, batch_size):
+    """ Load a partition with batched multi-row INSERT statements
+    Args:
+        cursor: Database cursor
+        table (str): Table name
+        path (str): Path of the CSV or feather file
+        batch_size (int): Number of rows per executemany call
+    Returns:
+        int: Number of rows loaded
+    """
+    rows = 0
+    for df in read_batches(path, batch_size):
+        # pymysql rewrites executemany of an INSERT ... VALUES statement into multi-row inserts
+        sql = "INSERT INTO `{}` ({}) VALUES ({})".format(
+            table, ", ".join("`{}`".format(c) for c in df.columns), ", ".join(["%s"] * len(df.columns)))
+        values = df.astype(object).where(df.notnull(), None).values.tolist()
+        values = [[v.item() if isinstance(v, np.generic) else v for v in row] for row in values]
+        cursor.executemany(sql, values)
+        rows += len(values)
+
+    return rows
+
+
+def bulk_load(connection, table, partitions, method="load-data", batch_size=5000, checkpoint_path=None,
+              defer_indexes=True, log=print):
+    """ Load partition files into a table, one transaction per partition.
+
+    Foreign key and unique checks are disabled and secondary indexes are dropped for the duration of the load and
+    rebuilt once every partition has been loaded. Committed partitions are recorded in a checkpoint file, so
+    re-running an interrupted load resumes from the first partition which was not committed.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection (opened with local_infile=True for
+            the "load-data" method)
+        table (str): Table name (e.g. StationRecords)
+        partitions (list): Paths of the partition files (CSV for "load-data", CSV or feather for "insert")
+        method (str): "load-data" (LOAD DATA LOCAL INFILE) or "insert" (batched multi-row inserts)
+        batch_size (int): Rows per executemany call for the "insert" method
+        checkpoint_path (str): Path of the checkpoint file. None disables resuming
+        defer_indexes (bool): Drop the secondary indexes during the load and rebuild them afterwards
+        log (callable): Function used to report progress
+    Returns:
+        dict: Number of partitions loaded and skipped, rows loaded and throughput in rows/sec
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    loaded = skipped = total_rows = 0
+    start = time.time()
+
+    with connection.cursor() as cursor:
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+        cursor.execute("SET UNIQUE_CHECKS = 0")
+    if defer_indexes:
+        drop_secondary_indexes(connection, table)
+
+    try:
+        for partition in sorted(partitions):
+            if checkpoint.is_done(table, partition):
+                skipped += 1
+                continue
+
+            # Load the partition in a single transaction, then record it in the checkpoint
+            partition_start = time.time()
+            with connection.cursor() as cursor:
+                if method == "load-data":
+                    rows = load_data_infile(cursor, table, partition)
+                else:
+                    rows = insert_batches(cursor, table, partition, batch_size)
+            connection.commit()
+            checkpoint.mark_done(table, partition, rows)
+
+            loaded += 1
+            total_rows += rows
+            elapsed = time.time() - partition_start
+            log("{}: {} rows in {:.1f}s ({:,.0f} rows/sec)".format(
+                os.path.basename(partition), rows, elapsed, rows / elapsed if elapsed else 0))
+
+        # Rebuild the indexes once every partition is loaded. After an interruption they stay dropped until the
+        # resumed load completes
+        if defer_indexes:
+            log("Rebuilding secondary indexes on {}...".format(table))
+            create_secondary_indexes(connection, table)
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SET UNIQUE_CHECKS = 1")
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+
+    elapsed = time.time() - start
+    return {
+        "partitions_loaded": loaded,
+        "partitions_skipped": skipped,
+        "rows": total_rows,
+        "seconds": elapsed,
+        "rows_per_sec": total_rows / elapsed if elapsed else 0
+    }
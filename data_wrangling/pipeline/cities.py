@@ -0,0 +1,97 @@
+import json
+import os
+
+from pipeline.db import CITY_LABEL
+
+
+# Format of the city index file read by the app (app/city_index.py)
+CITY_INDEX_FORMAT = 1
+
+
+def build_cities(connection):
+    """ Populate the Cities dimension from StationDetails and map every station to its CityId.
+    Existing CityIds are kept, so the step can be re-run after new stations have been loaded.
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+    Returns:
+        tuple: (number of new cities, number of stations mapped)
+    """
+    with connection.cursor() as cursor:
+        # Add any new cities, in the order the stations were loaded
+        new_cities = cursor.execute("""
+            INSERT IGNORE INTO Cities (City, State, Country, Label)
+            SELECT City, State, Country, Label
+            FROM (
+                SELECT
+                    IFNULL(StationDetails.City,'') as City,
+                    IFNULL(StationDetails.State,'') as State,
+                    IFNULL(StationDetails.Country,'') as Country,
+                    {} as Label,
+                    MIN(StationDetails.StationId) as FirstStation
+                FROM StationDetails
+                WHERE StationDetails.CityId IS NULL
+                GROUP BY 1, 2, 3, 4
+                ORDER BY FirstStation
+            ) as NewCities
+            """.format(CITY_LABEL))
+
+        # Map the stations to their city
+        mapped = cursor.execute("""
+            UPDATE StationDetails
+            JOIN Cities ON Cities.Label = {}
+            SET StationDetails.CityId = Cities.CityId
+            WHERE StationDetails.CityId IS NULL OR StationDetails.CityId <> Cities.CityId
+            """.format(CITY_LABEL))
+
+        # Bump the data version so the app knows to rebuild its city index
+        if new_cities or mapped:
+            bump_data_version(cursor, 'Cities')
+    connection.commit()
+
+    return new_cities, mapped
+
+
+def bump_data_version(cursor, name):
+    """ Increment the version of a dataset in the DataVersion table
+    Args:
+        cursor: Database cursor
+        name (str): Name of the dataset (e.g. Cities)
+    """
+    cursor.execute(
+        "INSERT INTO DataVersion (Name, Version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE Version = Version + 1",
+        [name])
+
+
+def data_version(cursor, name):
+    """ Get the version of a dataset from the DataVersion table
+    Args:
+        cursor: Database cursor
+        name (str): Name of the dataset (e.g. Cities)
+    Returns:
+        str: The version, or "0" if the dataset has never been versioned
+    """
+    cursor.execute("SELECT Version FROM DataVersion WHERE Name = %s", [name])
+    row = cursor.fetchone()
+    return str(row[0]) if row else "0"
+
+
+def write_city_index(connection, path):
+    """ Write the on-disk city index read by the app at startup, so app processes never query the cities themselves
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        path (str): Path of the JSON index file
+    Returns:
+        int: Number of cities in the index
+    """
+    with connection.cursor() as cursor:
+        version = data_version(cursor, 'Cities')
+        cursor.execute("SELECT CityId, Label FROM Cities ORDER BY CityId")
+        rows = [[int(city_id), label] for city_id, label in cursor.fetchall()]
+
+    # Write to a temporary file first so the app never reads a half written index
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"format": CITY_INDEX_FORMAT, "version": version, "cities": rows}, file)
+    os.replace(tmp_path, path)
+
+    return len(rows)
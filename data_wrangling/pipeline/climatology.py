@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+# Metrics of CityYearSummary a trend is fitted to, and their prefix in CityClimatology
+TREND_METRICS = {'MaxTempF': 'MaxTemp', 'MinTempF': 'MinTemp', 'AvgTempF': 'AvgTemp'}
+
+# WMO reference period the anomalies are measured against
+BASELINE_START = 1961
+BASELINE_END = 1990
+
+# Minimum number of years of data required in the baseline period
+MIN_BASELINE_YEARS = 20
+
+CLIMATOLOGY_COLUMNS = [
+    'CityId', 'FirstYear', 'LastYear', 'NumberYears',
+    'MaxTempTrendF', 'MaxTempTrendLowF', 'MaxTempTrendHighF',
+    'MinTempTrendF', 'MinTempTrendLowF', 'MinTempTrendHighF',
+    'AvgTempTrendF', 'AvgTempTrendLowF', 'AvgTempTrendHighF',
+    'BaselineAvgTempF']
+
+DECADE_COLUMNS = ['CityId', 'Decade', 'AvgTempF', 'AnomalyF', 'NumberYears']
+
+
+def trend_statistics(years, values, confidence=0.95):
+    """ Fit a least squares line to every row of a matrix at once, ignoring missing values
+    Args:
+        years (np.ndarray): Year of each column
+        values (np.ndarray): (cities, years) matrix of yearly values, np.nan where a city has no data
+        confidence (float): Confidence level of the interval around the slope
+    Returns:
+        tuple: Arrays of the slope (per year), the lower and upper bounds of its confidence interval and the number of
+            years fitted, one value per row. Rows with fewer than 3 years get np.nan
+    """
+    mask = ~np.isnan(values)
+    n = mask.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Centre each row on its own mean year and mean value
+        x_mean = np.where(mask, years, 0).sum(axis=1) / n
+        y_mean = np.where(mask, values, 0).sum(axis=1) / n
+        dx = np.where(mask, years - x_mean[:, None], 0)
+        dy = np.where(mask, values - y_mean[:, None], 0)
+
+        sxx = (dx ** 2).sum(axis=1)
+        slope = (dx * dy).sum(axis=1) / sxx
+
+        # Standard error of the slope and the Student's t interval around it
+        residuals = np.where(mask, dy - slope[:, None] * dx, 0)
+        dof = n - 2
+        standard_error = np.sqrt((residuals ** 2).sum(axis=1) / dof / sxx)
+        t = stats.t.ppf((1 + confidence) / 2, np.maximum(dof, 1))
+        margin = t * standard_error
+
+    slope[n < 3] = np.nan
+    margin[n < 3] = np.nan
+
+    return slope, slope - margin, slope + margin, n
+
+
+def compute_climatology(df, baseline_start=BASELINE_START, baseline_end=BASELINE_END, confidence=0.95):
+    """ Calculate the trend and anomaly statistics of every city from its yearly temperatures
+    Args:
+        df (pd.DataFrame): CityYearSummary rows with CityId, Year, MaxTempF, MinTempF and AvgTempF
+        baseline_start (int): First year of the baseline period
+        baseline_end (int): Last year of the baseline period
+        confidence (float): Confidence level of the trend intervals
+    Returns:
+        tuple: (climatology, decades) DataFrames with the CLIMATOLOGY_COLUMNS (trends in degrees Fahrenheit per
+            decade) and the DECADE_COLUMNS (decadal mean and anomaly against the baseline)
+    """
+    df = df.loc[:, ['CityId', 'Year'] + list(TREND_METRICS)]
+    df[list(TREND_METRICS)] = df[list(TREND_METRICS)].astype(float)
+
+    # Trends of each metric, fitted to a (city x year) matrix in one pass
+    years = df.groupby('CityId').Year.agg(['min', 'max'])
+    climatology = pd.DataFrame({'FirstYear': years['min'], 'LastYear': years['max']})
+    for metric, name in TREND_METRICS.items():
+        matrix = df.pivot(index='CityId', columns='Year', values=metric).reindex(climatology.index)
+        slope, low, high, n = trend_statistics(matrix.columns.values.astype(float), matrix.values, confidence)
+        climatology[name + 'TrendF'] = slope * 10
+        climatology[name + 'TrendLowF'] = low * 10
+        climatology[name + 'TrendHighF'] = high * 10
+        if name == 'AvgTemp':
+            climatology['NumberYears'] = n
+
+    # Mean temperature over the baseline period, where enough of it is covered
+    in_baseline = df[(df.Year >= baseline_start) & (df.Year <= baseline_end)]
+    baseline = in_baseline.groupby('CityId').AvgTempF.agg(['mean', 'count'])
+    climatology['BaselineAvgTempF'] = baseline['mean'].where(baseline['count'] >= MIN_BASELINE_YEARS)
+
+    # Decadal means and their anomalies against the baseline
+    df['Decade'] = df.Year // 10 * 10
+    decades = df.groupby(['CityId', 'Decade']).AvgTempF.agg(['mean', 'count']).reset_index()
+    decades.columns = ['CityId', 'Decade', 'AvgTempF', 'NumberYears']
+    decades['AnomalyF'] = decades.AvgTempF - decades.CityId.map(climatology.BaselineAvgTempF)
+
+    climatology = climatology.reset_index()
+    return climatology.loc[:, CLIMATOLOGY_COLUMNS].round(4), decades.loc[:, DECADE_COLUMNS].round(4)
+
+
+def _values(df):
+    """ Convert a frame to rows of Python values with NULLs for missing values
+    Args:
+        df (pd.DataFrame): Frame to convert
+    Returns:
+        list: Rows of values
+    """
+    values = df.astype(object).where(df.notnull(), None).values.tolist()
+    return [[v.item() if isinstance(v, np.generic) else v for v in row] for row in values]
+
+
+def refresh_climatology(connection, baseline_start=BASELINE_START, baseline_end=BASELINE_END):
+    """ Rebuild the CityClimatology and CityDecadeAnomaly tables from CityYearSummary. Run after the summary step
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        baseline_start (int): First year of the baseline period
+        baseline_end (int): Last year of the baseline period
+    Returns:
+        tuple: (number of cities, number of city-decades) written
+    """
+    df = pd.read_sql("SELECT CityId, Year, MaxTempF, MinTempF, AvgTempF FROM CityYearSummary", connection)
+    climatology, decades = compute_climatology(df, baseline_start, baseline_end)
+
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM CityDecadeAnomaly")
+        cursor.execute("DELETE FROM CityClimatology")
+        for table, frame in [('CityClimatology', climatology), ('CityDecadeAnomaly', decades)]:
+            cursor.executemany(
+                "INSERT INTO {} ({}) VALUES ({})".format(
+                    table, ", ".join(frame.columns), ", ".join(["%s"] * len(frame.columns))),
+                _values(frame))
+    connection.commit()
+
+    return len(climatology), len(decades)
@@ -0,0 +1,81 @@
+import json
+import os
+
+from pipeline.cities import bump_data_version
+from pipeline.cities import data_version
+
+
+# Format of the CO2 index file read by the app (app/co2_index.py)
+CO2_INDEX_FORMAT = 2
+
+
+def co2_index_version(cursor):
+    """ Get the version of the data in the CO2 index, which changes when either the cities or the emissions change
+    Args:
+        cursor: Database cursor
+    Returns:
+        str: The Cities and CountryYearCO2 versions, e.g. "3.2"
+    """
+    return "{}.{}".format(data_version(cursor, 'Cities'), data_version(cursor, 'CountryYearCO2'))
+
+
+def refresh_country_co2(connection):
+    """ Rebuild the CountryYearCO2 table from CO2, aligned to the yearly city temperatures: one row for every year of
+    CityYearSummary of each country's cities, with the national emissions of that year (NULL where CO2 has none).
+    Countries without any emissions data are left out. Run after the summary step. The CountryYearCO2 data version is
+    bumped so the app rebuilds its CO2 index
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+    Returns:
+        int: Number of country-years written
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM CountryYearCO2")
+        rows = cursor.execute("""
+            INSERT INTO CountryYearCO2 (Country, Year, Emissions)
+            SELECT CountryYears.Country, CountryYears.Year, CO2.Emissions
+            FROM (
+                SELECT DISTINCT Cities.Country as Country, CityYearSummary.Year as Year
+                FROM CityYearSummary
+                JOIN Cities ON Cities.CityId = CityYearSummary.CityId
+            ) as CountryYears
+            LEFT JOIN CO2 ON CO2.Country = CountryYears.Country AND CO2.Year = CountryYears.Year
+            WHERE CountryYears.Country IN (SELECT DISTINCT Country FROM CO2)
+            """)
+        bump_data_version(cursor, 'CountryYearCO2')
+    connection.commit()
+
+    return rows
+
+
+def write_co2_index(connection, path):
+    """ Write the on-disk CO2 index read by the app, so the emissions overlay never queries the database
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        path (str): Path of the JSON index file
+    Returns:
+        tuple: (number of countries, number of cities) in the index
+    """
+    with connection.cursor() as cursor:
+        version = co2_index_version(cursor)
+        cursor.execute("SELECT Country, Year, Emissions FROM CountryYearCO2 ORDER BY Country, Year")
+        countries = {}
+        for country, year, emissions in cursor.fetchall():
+            series = countries.setdefault(country, {"years": [], "emissions": []})
+            series["years"].append(int(year))
+            series["emissions"].append(None if emissions is None else round(float(emissions), 3))
+
+        cursor.execute("""
+            SELECT CityId, Country
+            FROM Cities
+            WHERE Country IN (SELECT DISTINCT Country FROM CountryYearCO2)
+            ORDER BY CityId""")
+        cities = [[int(city_id), country] for city_id, country in cursor.fetchall()]
+
+    # Write to a temporary file first so the app never reads a half written index
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"format": CO2_INDEX_FORMAT, "version": version, "countries": countries, "cities": cities}, file)
+    os.replace(tmp_path, path)
+
+    return len(countries), len(cities)
@@ -0,0 +1,92 @@
+import os
+
+import pandas as pd
+
+from pipeline.climatology import compute_climatology
+
+
+def city_labels(details):
+    """ Create the "City, State, Country" label shown in the app's city dropdown
+    Args:
+        details (pd.DataFrame): Station details with City, State and Country columns
+    Returns:
+        pd.Series: The label of each station's city
+    """
+    return (details.City.fillna('') + ", " + details.State.fillna('') + ", " + details.Country.fillna(''))
+
+
+def write_partitioned(df, path):
+    """ Write a frame as an Arrow IPC (Feather V2) dataset partitioned by CityId
+    Args:
+        df (pd.DataFrame): Frame with a CityId column
+        path (str): Folder of the dataset. Existing partitions are replaced
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(
+        table,
+        path,
+        format="ipc",
+        partitioning=ds.partitioning(pa.schema([("CityId", pa.int32())]), flavor="hive"),
+        existing_data_behavior="delete_matching")
+
+
+def build_columnar_store(station_details_path, records_path, daily_avg_path, out_dir):
+    """ Build the columnar store read by the app's FeatherBackend from the cleaned feather files of the
+    wrangling notebook. Records and daily averages are partitioned by CityId, so the app only maps the partition of
+    the selected city.
+    Args:
+        station_details_path (str): Path of station_details_cleaned.feather
+        records_path (str): Path of 1960-2018_monthly_cleaned.feather
+        daily_avg_path (str): Path of daily_avg.feather
+        out_dir (str): Folder to write the store to
+    Returns:
+        dict: Number of cities, monthly records and daily records written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Assign a CityId to each city, in the order the stations appear
+    details = pd.read_feather(station_details_path)
+    details['City'] = city_labels(details)
+    cities = pd.DataFrame({'City': details.City.unique()})
+    cities['CityId'] = range(1, len(cities) + 1)
+    cities = cities.loc[:, ['CityId', 'City']]
+    cities.to_feather(os.path.join(out_dir, "cities.feather"))
+
+    # Lookup of StationId to CityId (station ids are compared as strings as the files store them as ints)
+    station_city = details.loc[:, ['StationId', 'City']].merge(cities, on='City')
+    station_city = pd.Series(station_city.CityId.values, index=station_city.StationId.astype(str))
+
+    # Station locations, for the app's nearest-station index
+    stations = details.loc[:, ['StationId', 'City', 'Lat', 'Lon']].merge(cities, on='City')
+    stations = stations[stations.Lat.notnull() & stations.Lon.notnull()]
+    stations = stations.loc[:, ['StationId', 'CityId', 'Lat', 'Lon']].reset_index(drop=True)
+    stations['StationId'] = stations.StationId.astype(str)
+    stations[['Lat', 'Lon']] = stations[['Lat', 'Lon']].astype(float)
+    stations.to_feather(os.path.join(out_dir, "stations.feather"))
+
+    # Monthly records, partitioned by city
+    records = pd.read_feather(records_path, columns=['StationId', 'Year', 'Month', 'MaxTemp', 'MinTemp', 'Temp'])
+    records['CityId'] = records.StationId.astype(str).map(station_city)
+    records = records[records.CityId.notnull()]
+    records['CityId'] = records.CityId.astype('int32')
+    write_partitioned(records, os.path.join(out_dir, "records"))
+
+    # Trend and anomaly statistics of each city
+    yearly = records.groupby(['CityId', 'Year']).agg({'MaxTemp': 'max', 'MinTemp': 'min', 'Temp': 'mean'})
+    yearly = yearly.reset_index().rename(columns={'MaxTemp': 'MaxTempF', 'MinTemp': 'MinTempF', 'Temp': 'AvgTempF'})
+    climatology, decades = compute_climatology(yearly)
+    climatology.to_feather(os.path.join(out_dir, "climatology.feather"))
+    decades.to_feather(os.path.join(out_dir, "decades.feather"))
+
+    # Daily averages, partitioned by city
+    daily = pd.read_feather(daily_avg_path, columns=['StationId', 'Date', 'MaxTemp'])
+    daily['Date'] = pd.to_datetime(daily.Date)
+    daily['CityId'] = daily.StationId.astype(str).map(station_city)
+    daily = daily[daily.CityId.notnull()]
+    daily['CityId'] = daily.CityId.astype('int32')
+    write_partitioned(daily, os.path.join(out_dir, "daily"))
+
+    return {"cities": len(cities), "records": len(records), "daily": len(daily)}
@@ -0,0 +1,37 @@
+# Average the daily maximum temperature of each city's stations over the first year of its daily records (the 60's,
+# 70's or 80's baseline), keyed by the day of the year in a 365 day calendar. 29 February is dropped so every year
+# maps onto the same 365 days
+BASELINE_SELECT = """
+    SELECT
+        StationDetails.CityId as CityId,
+        DAYOFYEAR(DATE_FORMAT(DailyAvg.Date, '2001-%m-%d')) as DayOfYear,
+        StartYears.Year as Year,
+        ROUND(AVG(DailyAvg.MaxTemp),2) as MaxTemp
+    FROM DailyAvg
+    JOIN StationDetails ON DailyAvg.StationId = StationDetails.StationId
+    JOIN (
+        SELECT StationDetails.CityId as CityId, MIN(YEAR(DailyAvg.Date)) as Year
+        FROM DailyAvg
+        JOIN StationDetails ON DailyAvg.StationId = StationDetails.StationId
+        WHERE StationDetails.CityId IS NOT NULL
+        GROUP BY StationDetails.CityId
+    ) as StartYears ON StartYears.CityId = StationDetails.CityId AND YEAR(DailyAvg.Date) = StartYears.Year
+    WHERE NOT (MONTH(DailyAvg.Date) = 2 AND DAY(DailyAvg.Date) = 29)
+    GROUP BY StationDetails.CityId, DayOfYear, StartYears.Year
+    """
+
+
+def refresh_daily_baseline(connection):
+    """ Rebuild the CityDailyBaseline table from DailyAvg
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+    Returns:
+        int: Number of city-days written
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM CityDailyBaseline")
+        rows = cursor.execute("INSERT INTO CityDailyBaseline (CityId, DayOfYear, Year, MaxTemp) {}".format(
+            BASELINE_SELECT))
+    connection.commit()
+
+    return rows
@@ -0,0 +1,48 @@
+import pymysql
+
+
+# SQL expression of the city label shown in the app's city dropdown (e.g. "New York, New York, United States")
+CITY_LABEL = ("CONCAT(IFNULL(StationDetails.City,''), \", \", IFNULL(StationDetails.State,''), \", \", "
+              "IFNULL(StationDetails.Country,''))")
+
+
+def connect(host='localhost', user='root', password='', db='globalwarming', local_infile=False):
+    """ Open a connection to the globalwarming database for pipeline steps
+    Args:
+        host (str): MySQL host
+        user (str): MySQL user
+        password (str): MySQL password
+        db (str): Database name
+        local_infile (bool): Allow LOAD DATA LOCAL INFILE on this connection
+    Returns:
+        pymysql.connections.Connection: Connection with autocommit disabled so each step controls its transactions
+    """
+    return pymysql.connect(
+        host=host,
+        user=user,
+        password=password,
+        db=db,
+        charset='utf8mb4',
+        local_infile=local_infile,
+        autocommit=False)
+
+
+def add_connection_args(parser):
+    """ Add the database connection arguments to an argparse parser
+    Args:
+        parser (argparse.ArgumentParser): Parser to add the arguments to
+    """
+    parser.add_argument('--host', default='localhost', help='MySQL host')
+    parser.add_argument('--user', default='root', help='MySQL user')
+    parser.add_argument('--password', default='', help='MySQL password')
+    parser.add_argument('--db', default='globalwarming', help='Database name')
+
+
+def connect_from_args(args, **kwargs):
+    """ Open a connection using the arguments added by add_connection_args
+    Args:
+        args (argparse.Namespace): Parsed command line arguments
+    Returns:
+        pymysql.connections.Connection
+    """
+    return connect(host=args.host, user=args.user, password=args.password, db=args.db, **kwargs)
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pipeline import ingest
+from pipeline import summary
+
+
+# Manifest of the source files already ingested, with their checksums
+MANIFEST_PATH = "ingest_manifest.json"
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """ Calculate the SHA-1 checksum of a file
+    Args:
+        path (str): Path of the file
+        block_size (int): Number of bytes read at a time
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """ Checksums of the GSOD station files which have been ingested, keyed by their path relative to the source
+    folder. Files whose size and modification time are unchanged are not re-hashed """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the JSON manifest file. Created on save if it does not exist
+        """
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.files = json.load(file)
+
+    def check(self, source_dir, relpath):
+        """ Check whether a source file is new or has changed since it was recorded
+        Args:
+            source_dir (str): Source folder
+            relpath (str): Path of the file relative to the source folder
+        Returns:
+            tuple: (changed, entry) where entry is the manifest entry to record once the file has been ingested
+        """
+        stat = os.stat(os.path.join(source_dir, relpath))
+        entry = self.files.get(relpath)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == int(stat.st_mtime):
+            return False, entry
+
+        # Only hash files whose size or modification time differ. A touched but identical file is not re-ingested
+        new_entry = {'sha1': file_digest(os.path.join(source_dir, relpath)), 'size': stat.st_size,
+                     'mtime': int(stat.st_mtime)}
+        return entry is None or entry['sha1'] != new_entry['sha1'], new_entry
+
+    def record(self, relpath, entry):
+        self.files[relpath] = entry
+
+    def save(self):
+        """ Write the manifest, via a temporary file so it is never left half written """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.files, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def scan(source_dir, manifest, years=None):
+    """ Find the station files which are new or have changed since the last ingestion
+    Args:
+        source_dir (str): Folder containing one folder of station CSV files per year
+        manifest (Manifest): Manifest of the ingested files
+        years (list): Only scan these years. Defaults to every year folder
+    Returns:
+        tuple: (list of (relpath, manifest entry) of the changed files, number of unchanged files, dict of relpath to
+            manifest entry of unchanged files whose entry needs updating)
+    """
+    if years is None:
+        years = sorted(int(d) for d in os.listdir(source_dir) if d.isdigit())
+
+    changed = []
+    unchanged = 0
+    touched = {}
+    for year in years:
+        try:
+            paths = ingest.station_files(source_dir, year)
+        except FileNotFoundError:
+            continue
+        for path in paths:
+            relpath = os.path.relpath(path, source_dir)
+            is_changed, entry = manifest.check(source_dir, relpath)
+            if is_changed:
+                changed.append((relpath, entry))
+            else:
+                unchanged += 1
+                if manifest.files.get(relpath) != entry:
+                    touched[relpath] = entry
+
+    return changed, unchanged, touched
+
+
+def file_station_year(relpath):
+    """ Get the (StationId, Year) of a GSOD station file from its path (<year>/<station id>.csv)
+    Args:
+        relpath (str): Path of the file relative to the source folder
+    Returns:
+        tuple: (StationId, Year), or None if the path does not follow the GSOD layout
+    """
+    year, name = os.path.split(relpath)
+    station = os.path.splitext(name)[0]
+    if not (year.isdigit() and station.isdigit()):
+        return None
+
+    # StationIds are read as integers by ingest, so leading zeros are dropped
+    return str(int(station)), int(year)
+
+
+def known_stations(connection, station_ids, batch_size=1000):
+    """ Get the stations which are in StationDetails, as StationRecords only holds records of known stations
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        station_ids (list): StationIds to look up
+        batch_size (int): Number of StationIds per query
+    Returns:
+        set: StationIds found in StationDetails
+    """
+    station_ids = sorted(set(station_ids))
+    found = set()
+    with connection.cursor() as cursor:
+        for i in range(0, len(station_ids), batch_size):
+            batch = station_ids[i:i + batch_size]
+            cursor.execute("SELECT StationId FROM StationDetails WHERE StationId IN ({})".format(
+                ", ".join(["%s"] * len(batch))), batch)
+            found.update(str(row[0]) for row in cursor.fetchall())
+    return found
+
+
+def upsert_station_years(connection, df, station_years, batch_size=500):
+    """ Replace the monthly StationRecords of a set of station-years in a single transaction.
+
+    Every month of the station-years is deleted before the new records are inserted, so months which a corrected
+    station file no longer has (or which no longer pass the completeness filter) are removed too.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        df (pd.DataFrame): Monthly records with the ingest.MONTHLY_COLUMNS, for the station-years only
+        station_years (set): Set of (StationId, Year) tuples being replaced
+        batch_size (int): Number of station-years deleted, and rows inserted, per statement
+    Returns:
+        tuple: (rows deleted, rows inserted)
+    """
+    pairs = sorted(station_years)
+    deleted = inserted = 0
+
+    try:
+        with connection.cursor() as cursor:
+            for i in range(0, len(pairs), batch_size):
+                batch = pairs[i:i + batch_size]
+                deleted += cursor.execute(
+                    "DELETE FROM StationRecords WHERE (StationId, Year) IN ({})".format(
+                        ", ".join(["(%s, %s)"] * len(batch))),
+                    [v for pair in batch for v in pair])
+
+            # pymysql rewrites executemany of an INSERT ... VALUES statement into multi-row inserts
+            df = df.round(3).loc[:, ingest.MONTHLY_COLUMNS]
+            df['StationId'] = df.StationId.astype(str)
+            sql = "INSERT INTO StationRecords ({}) VALUES ({})".format(
+                ", ".join("`{}`".format(c) for c in df.columns), ", ".join(["%s"] * len(df.columns)))
+            values = df.astype(object).where(df.notnull(), None).values.tolist()
+            values = [[v.item() if isinstance(v, np.generic) else v for v in row] for row in values]
+            for i in range(0, len(values), batch_size):
+                cursor.executemany(sql, values[i:i + batch_size])
+                inserted += len(values[i:i + batch_size])
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+    return deleted, inserted
+
+
+def ingest_incremental(connection, source_dir, manifest_path=MANIFEST_PATH, years=None, workers=None,
+                       chunk_size=100000, dry_run=False, log=print):
+    """ Ingest only the GSOD station files which are new or have changed since the last run, e.g. a new year of data
+    or a corrected station file.
+
+    Changed files are found by checksum against the manifest and processed into monthly records on a process pool.
+    The records of stations in StationDetails replace the station-years they cover in StationRecords, and the
+    CityYearSummary rows of the affected city-years are recomputed. The manifest is only updated once the
+    database changes are committed, and files which fail to process are retried on the next run.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        source_dir (str): Folder containing one folder of station CSV files per year
+        manifest_path (str): Path of the manifest of ingested files
+        years (list): Only scan these years. Defaults to every year folder
+        workers (int): Number of worker processes. Defaults to the number of CPUs
+        chunk_size (int): Number of daily rows read at a time
+        dry_run (bool): Only report the changed files
+        log (callable): Function used to report progress
+    Returns:
+        dict: Numbers of changed, unchanged and failed files, station-years replaced, rows deleted and inserted,
+            stations skipped because they are not in StationDetails, summary rows written and seconds taken
+    """
+    start = time.time()
+    manifest = Manifest(manifest_path)
+    changed, unchanged, touched = scan(source_dir, manifest, years)
+    log("{} new or changed station files, {} unchanged".format(len(changed), unchanged))
+
+    result = {'changed': len(changed), 'unchanged': unchanged, 'failed': 0, 'station_years': 0, 'deleted': 0,
+              'inserted': 0, 'unknown_stations': 0, 'summary_rows': 0}
+    if dry_run or not changed:
+        if not dry_run and touched:
+            for relpath, entry in touched.items():
+                manifest.record(relpath, entry)
+            manifest.save()
+        result['seconds'] = time.time() - start
+        return result
+
+    # Process the changed files into monthly records
+    frames = []
+    processed = {}
+    tasks = [(os.path.join(source_dir, relpath), chunk_size) for relpath, _ in changed]
+    entries = dict(changed)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, df, error in executor.map(ingest._process_station_file, tasks, chunksize=16):
+            relpath = os.path.relpath(path, source_dir)
+            if error is not None:
+                log("{} error with {}".format(error, path))
+                result['failed'] += 1
+                continue
+            processed[relpath] = entries[relpath]
+            if len(df):
+                frames.append(df)
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ingest.MONTHLY_COLUMNS)
+    df['StationId'] = df.StationId.astype('int64').astype(str)
+
+    # Station-years covered by the processed files, including files whose records are all incomplete
+    station_years = summary.touched_station_years(df)
+    station_years.update(p for p in (file_station_year(relpath) for relpath in processed) if p is not None)
+
+    # Only stations in StationDetails are kept in StationRecords
+    stations = known_stations(connection, [s for s, _ in station_years])
+    unknown = set(s for s, _ in station_years) - stations
+    station_years = set(p for p in station_years if p[0] in stations)
+    df = df[df.StationId.isin(stations)]
+    result['unknown_stations'] = len(unknown)
+    if unknown:
+        log("{} stations skipped as they are not in StationDetails".format(len(unknown)))
+
+    # Replace the station-years, then recompute the affected city-years of the summary
+    result['deleted'], result['inserted'] = upsert_station_years(connection, df, station_years)
+    result['station_years'] = len(station_years)
+    log("StationRecords: {} station-years replaced ({} rows deleted, {} inserted)".format(
+        len(station_years), result['deleted'], result['inserted']))
+    result['summary_rows'] = summary.refresh_incremental(connection, station_years)
+
+    # Record the ingested files only once the database changes are committed
+    for relpath, entry in list(processed.items()) + list(touched.items()):
+        manifest.record(relpath, entry)
+    manifest.save()
+
+    result['seconds'] = time.time() - start
+    return result
+
+
+def record_manifest(source_dir, manifest_path=MANIFEST_PATH, years=None):
+    """ Record every current station file in the manifest without ingesting it, e.g. after a full load with the
+    `ingest` and `load` steps, so the next incremental run only picks up later changes
+    Args:
+        source_dir (str): Folder containing one folder of station CSV files per year
+        manifest_path (str): Path of the manifest of ingested files
+        years (list): Only record these years. Defaults to every year folder
+    Returns:
+        int: Number of files recorded
+    """
+    manifest = Manifest(manifest_path)
+    changed, _, touched = scan(source_dir, manifest, years)
+    for relpath, entry in changed + list(touched.items()):
+        manifest.record(relpath, entry)
+    manifest.save()
+
+    return len(changed) + len(touched)
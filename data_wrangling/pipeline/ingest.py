@@ -0,0 +1,242 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+# GSOD columns read from each station file, and their names in StationRecords
+SOURCE_COLUMNS = {
+    'STATION': 'StationId',
+    'DATE': 'Date',
+    'TEMP': 'Temp',
+    'DEWP': 'Dew',
+    'SLP': 'SLP',
+    'STP': 'StationPressure',
+    'VISIB': 'Visib',
+    'WDSP': 'WindSpeed',
+    'MXSPD': 'MaxWindSpeed',
+    'GUST': 'Gust',
+    'MAX': 'MaxTemp',
+    'MIN': 'MinTemp',
+    'PRCP': 'Precip',
+    'SNDP': 'SnowDepth'
+}
+
+# Explicit dtypes, so pandas does not have to infer them (or upcast) chunk by chunk
+SOURCE_DTYPES = dict({k: 'float64' for k in SOURCE_COLUMNS}, STATION='int64', DATE='str')
+
+# Daily measurements which are averaged into the monthly records
+VALUE_COLUMNS = ['Temp', 'Dew', 'SLP', 'StationPressure', 'Visib', 'WindSpeed', 'MaxWindSpeed', 'Gust',
+                 'MaxTemp', 'MinTemp', 'Precip', 'SnowDepth']
+
+# Column order of the StationRecords table
+MONTHLY_COLUMNS = ['StationId', 'Year', 'Month', 'Temp', 'Dew', 'SLP', 'StationPressure', 'Visib', 'WindSpeed',
+                   'MaxWindSpeed', 'Gust', 'AvgMaxTemp', 'AvgMinTemp', 'Precip', 'SnowDepth', 'MaxTemp',
+                   'MaxMinTemp', 'MinMaxTemp', 'MinTemp', 'NumberDailyRecords']
+
+# Minimum number of daily records required in each month (no more than 5% missing, leap years excluded)
+DAYS_IN_MONTH = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
+MIN_DAILY_RECORDS = {month: int(round(days * 0.95, 0)) for month, days in DAYS_IN_MONTH.items()}
+
+# Minimum number of complete months required in a station-year
+MIN_MONTHS = int(round(12 * 0.95, 0))
+
+
+class MonthlyAccumulator:
+    """ Incrementally aggregates chunks of daily GSOD records into monthly records.
+    Only running sums, counts, maxima and minima are held, so memory does not grow with the number of daily rows.
+    """
+
+    def __init__(self):
+        self.sums = None
+        self.counts = None
+        self.maxima = None
+        self.minima = None
+        self.sizes = None
+
+    @staticmethod
+    def _combine(current, new, how):
+        """ Combine the aggregate of a new chunk with the running aggregate
+        Args:
+            current (pd.DataFrame): Running aggregate (or None)
+            new (pd.DataFrame): Aggregate of the new chunk
+            how (str): "sum", "max" or "min"
+        Returns:
+            pd.DataFrame: The combined aggregate
+        """
+        if current is None:
+            return new
+        return getattr(pd.concat([current, new]).groupby(level=[0, 1, 2]), how)()
+
+    def add(self, chunk):
+        """ Add a chunk of cleaned daily records
+        Args:
+            chunk (pd.DataFrame): Daily records with StationId, Year, Month and the VALUE_COLUMNS
+        """
+        grouped = chunk.groupby(['StationId', 'Year', 'Month'])
+        self.sums = self._combine(self.sums, grouped[VALUE_COLUMNS].sum(), "sum")
+        self.counts = self._combine(self.counts, grouped[VALUE_COLUMNS].count(), "sum")
+        self.maxima = self._combine(self.maxima, grouped[['MaxTemp', 'MinTemp']].max(), "max")
+        self.minima = self._combine(self.minima, grouped[['MaxTemp', 'MinTemp']].min(), "min")
+        self.sizes = self._combine(self.sizes, grouped.size().to_frame('NumberDailyRecords'), "sum")
+
+    def result(self):
+        """ Calculate the monthly records
+        Returns:
+            pd.DataFrame: Monthly records with the MONTHLY_COLUMNS
+        """
+        if self.sums is None:
+            return pd.DataFrame(columns=MONTHLY_COLUMNS)
+
+        # Averages of the values which were recorded (matching DataFrame.mean, which skips missing values)
+        df = self.sums / self.counts.where(self.counts > 0)
+        df['AvgMaxTemp'] = df.MaxTemp
+        df['AvgMinTemp'] = df.MinTemp
+        df['MaxTemp'] = self.maxima.MaxTemp
+        df['MaxMinTemp'] = self.maxima.MinTemp
+        df['MinMaxTemp'] = self.minima.MaxTemp
+        df['MinTemp'] = self.minima.MinTemp
+        df['NumberDailyRecords'] = self.sizes.NumberDailyRecords
+
+        return df.reset_index().loc[:, MONTHLY_COLUMNS]
+
+
+def clean_chunk(df):
+    """ Clean a chunk of a GSOD station file
+    Args:
+        df (pd.DataFrame): Chunk read with the SOURCE_COLUMNS
+    Returns:
+        pd.DataFrame: Renamed columns, missing values (999.9 and 9999.9) replaced with np.NaN and Year and Month added
+    """
+    df = df.rename(columns=SOURCE_COLUMNS)
+    df[VALUE_COLUMNS] = df[VALUE_COLUMNS].replace([999.9, 9999.9], np.nan)
+    df['Year'] = df.Date.str.slice(0, 4).astype('int16')
+    df['Month'] = df.Date.str.slice(5, 7).astype('int8')
+
+    return df.drop(columns='Date')
+
+
+def filter_complete(df):
+    """ Keep only complete months (no more than 5% of days missing) of complete station-years
+    (no more than 5% of months missing)
+    Args:
+        df (pd.DataFrame): Monthly records
+    Returns:
+        pd.DataFrame: The monthly records which meet both thresholds
+    """
+    # Missing daily records
+    df = df[df.NumberDailyRecords >= df.Month.map(MIN_DAILY_RECORDS)]
+
+    # Missing monthly records
+    months = df.groupby(['StationId', 'Year']).Month.transform('count')
+
+    return df[months >= MIN_MONTHS]
+
+
+def process_station_file(path, chunk_size=100000):
+    """ Stream a GSOD station file in chunks and calculate its complete monthly records
+    Args:
+        path (str): Path of the station CSV file
+        chunk_size (int): Number of daily rows read at a time
+    Returns:
+        pd.DataFrame: Monthly records of the station
+    """
+    accumulator = MonthlyAccumulator()
+    reader = pd.read_csv(path, usecols=list(SOURCE_COLUMNS), dtype=SOURCE_DTYPES, chunksize=chunk_size)
+    for chunk in reader:
+        accumulator.add(clean_chunk(chunk))
+
+    return filter_complete(accumulator.result())
+
+
+def _process_station_file(args):
+    """ Process pool entry point for process_station_file """
+    path, chunk_size = args
+    try:
+        return path, process_station_file(path, chunk_size), None
+    except Exception as e:
+        return path, None, "{}: {}".format(type(e).__name__, e)
+
+
+def write_partition(df, out_dir, year, file_format="csv"):
+    """ Write the monthly records of a year as a partition of the output folder
+    Args:
+        df (pd.DataFrame): Monthly records of the year
+        out_dir (str): Output folder
+        year (int): Year of the partition
+        file_format (str): "csv" (NULLs written as \\N, ready for LOAD DATA) or "feather"
+    Returns:
+        str: Path of the partition file
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "year={}.{}".format(year, file_format))
+    tmp_path = path + ".tmp"
+
+    # Write to a temporary file first so an interrupted run never leaves a partial partition
+    df = df.round(3).reset_index(drop=True)
+    if file_format == "feather":
+        df.to_feather(tmp_path)
+    else:
+        df.to_csv(tmp_path, index=False, na_rep="\\N")
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def station_files(source_dir, year):
+    """ List the station files of a year
+    Args:
+        source_dir (str): Folder containing one folder of station CSV files per year
+        year (int): Year to list
+    Returns:
+        list: Paths of the station files
+    """
+    year_dir = os.path.join(source_dir, str(year))
+    return sorted(os.path.join(year_dir, f) for f in os.listdir(year_dir) if f.endswith(".csv"))
+
+
+def ingest(source_dir, out_dir, start_year, end_year, workers=None, chunk_size=100000, file_format="csv",
+           log=print):
+    """ Convert the GSOD station files of a range of years into partitioned monthly records.
+
+    Station files are processed in parallel on a process pool and streamed in chunks, so peak memory is bounded by
+    the chunk size and the monthly rows of one year rather than the size of the dataset.
+
+    Args:
+        source_dir (str): Folder containing one folder of station CSV files per year
+        out_dir (str): Folder to write one partition per year to
+        start_year (int): First year to ingest
+        end_year (int): Last year to ingest
+        workers (int): Number of worker processes. Defaults to the number of CPUs
+        chunk_size (int): Number of daily rows read at a time
+        file_format (str): Partition file format, "csv" or "feather"
+        log (callable): Function used to report progress
+    Returns:
+        dict: Year to number of monthly records written
+    """
+    written = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for year in range(start_year, end_year + 1):
+            try:
+                files = station_files(source_dir, year)
+            except FileNotFoundError:
+                log("No station files for {}".format(year))
+                continue
+
+            # Fan the station files of the year out across the process pool
+            frames = []
+            tasks = [(path, chunk_size) for path in files]
+            for path, df, error in executor.map(_process_station_file, tasks, chunksize=16):
+                if error is not None:
+                    log("{} error with {}".format(error, path))
+                elif len(df):
+                    frames.append(df)
+
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=MONTHLY_COLUMNS)
+            write_partition(df, out_dir, year, file_format)
+            written[year] = len(df)
+            log("{}: {} station files, {} monthly records".format(year, len(files), len(df)))
+
+    return written
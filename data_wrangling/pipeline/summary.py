@@ -0,0 +1,96 @@
+# Aggregate the monthly StationRecords of a city into yearly max, min and average temperatures in both units.
+# Celsius values are derived from the Fahrenheit aggregates (max, min and mean commute with the linear conversion)
+SUMMARY_SELECT = """
+    SELECT
+        StationDetails.CityId as CityId,
+        StationRecords.Year as Year,
+        MAX(StationRecords.MaxTemp) as MaxTempF,
+        MIN(StationRecords.MinTemp) as MinTempF,
+        AVG(StationRecords.Temp) as AvgTempF,
+        ROUND((MAX(StationRecords.MaxTemp) - 32) * 5 / 9, 3) as MaxTempC,
+        ROUND((MIN(StationRecords.MinTemp) - 32) * 5 / 9, 3) as MinTempC,
+        ROUND((AVG(StationRecords.Temp) - 32) * 5 / 9, 3) as AvgTempC,
+        COUNT(DISTINCT StationRecords.StationId) as NumberStations
+    FROM StationRecords
+    JOIN StationDetails ON StationRecords.StationId = StationDetails.StationId
+    WHERE StationDetails.CityId IS NOT NULL {where}
+    GROUP BY StationDetails.CityId, StationRecords.Year
+    """
+
+SUMMARY_COLUMNS = "CityId, Year, MaxTempF, MinTempF, AvgTempF, MaxTempC, MinTempC, AvgTempC, NumberStations"
+
+
+def touched_station_years(df):
+    """ Get the (StationId, Year) pairs contained in a frame of newly loaded monthly records
+    Args:
+        df (pd.DataFrame): Monthly StationRecords with StationId and Year columns
+    Returns:
+        set: Set of (StationId, Year) tuples
+    """
+    pairs = df.loc[:, ['StationId', 'Year']].drop_duplicates()
+    return set((str(s), int(y)) for s, y in pairs.itertuples(index=False))
+
+
+def refresh_full(connection):
+    """ Rebuild the whole CityYearSummary table from StationRecords
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+    Returns:
+        int: Number of summary rows written
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM CityYearSummary")
+        rows = cursor.execute("INSERT INTO CityYearSummary ({}) {}".format(
+            SUMMARY_COLUMNS, SUMMARY_SELECT.format(where="")))
+    connection.commit()
+
+    return rows
+
+
+def refresh_incremental(connection, station_years, batch_size=500):
+    """ Recompute only the CityYearSummary rows affected by a set of loaded (StationId, Year) pairs.
+
+    The cities of the touched stations are looked up, then the summary rows for those cities and years are
+    deleted and recomputed from StationRecords in a single transaction.
+
+    Args:
+        connection (pymysql.connections.Connection): Database connection
+        station_years (set): Set of (StationId, Year) tuples touched by a load
+        batch_size (int): Number of cities recomputed per statement
+    Returns:
+        int: Number of summary rows written
+    """
+    if not station_years:
+        return 0
+
+    stations = sorted(set(s for s, _ in station_years))
+    years = sorted(set(y for _, y in station_years))
+    rows = 0
+
+    with connection.cursor() as cursor:
+        # Cities which contain any of the touched stations
+        cities = set()
+        for i in range(0, len(stations), batch_size):
+            batch = stations[i:i + batch_size]
+            cursor.execute(
+                "SELECT DISTINCT CityId FROM StationDetails WHERE CityId IS NOT NULL AND StationId IN ({})".format(
+                    ", ".join(["%s"] * len(batch))),
+                batch)
+            cities.update(row[0] for row in cursor.fetchall())
+        cities = sorted(cities)
+
+        # Delete and recompute the affected city-years
+        year_params = ", ".join(["%s"] * len(years))
+        for i in range(0, len(cities), batch_size):
+            batch = cities[i:i + batch_size]
+            city_params = ", ".join(["%s"] * len(batch))
+            cursor.execute(
+                "DELETE FROM CityYearSummary WHERE CityId IN ({}) AND Year IN ({})".format(city_params, year_params),
+                batch + years)
+            where = "AND StationDetails.CityId IN ({}) AND StationRecords.Year IN ({})".format(city_params, year_params)
+            rows += cursor.execute(
+                "INSERT INTO CityYearSummary ({}) {}".format(SUMMARY_COLUMNS, SUMMARY_SELECT.format(where=where)),
+                batch + years)
+    connection.commit()
+
+    return rows
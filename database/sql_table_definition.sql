@@ -2,6 +2,27 @@
 CREATE DATABASE `globalwarming`;
 USE `globalwarming`;
 
+-- Create table of cities (built by: python -m pipeline cities)
+-- Label is the "City, State, Country" text shown in the app's city dropdown
+CREATE TABLE `Cities` (
+  `CityId` INT(11) NOT NULL AUTO_INCREMENT,
+  `City` VARCHAR(100) NOT NULL,
+  `State` VARCHAR(100) NOT NULL DEFAULT '',
+  `Country` VARCHAR(100) NOT NULL,
+  `Label` VARCHAR(310) NOT NULL,
+  PRIMARY KEY (`CityId`),
+  UNIQUE KEY `Label` (`Label`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- Version of each dataset, bumped by the pipeline whenever it changes. The app only rebuilds its on-disk city index
+-- when the Cities version differs from the version the index was built from
+CREATE TABLE `DataVersion` (
+  `Name` VARCHAR(64) NOT NULL,
+  `Version` INT(11) NOT NULL DEFAULT 1,
+  `UpdatedAt` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`Name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
 -- Create table with weather stations
 CREATE TABLE `StationDetails` (
   `StationId` VARCHAR(12) NOT NULL,
@@ -14,11 +35,14 @@ CREATE TABLE `StationDetails` (
   `Country` VARCHAR(100) NOT NULL,
   `Lat` DECIMAL(10,8) DEFAULT NULL, 
   `Lon` DECIMAL(11,8) DEFAULT NULL, 
+  `CityId` INT(11) DEFAULT NULL,
   PRIMARY KEY (`StationId`),
-  UNIQUE KEY `StationId` (`StationId`) USING BTREE
+  UNIQUE KEY `StationId` (`StationId`) USING BTREE,
+  KEY `idx_StationDetails_CityId` (`CityId`,`StationId`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
--- Create table with monthly weather station records
+-- Create table with monthly weather station records. InnoDB clusters the rows by the primary key, so the records of
+-- a city's stations are read with range scans of it and need no secondary index
 CREATE TABLE `StationRecords` (
   `StationId` varchar(12) NOT NULL,
   `Year` int(4) NOT NULL,
@@ -55,7 +79,95 @@ CREATE TABLE `DailyAvg` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
+-- Create table with yearly temperature summaries for each city (built by: python -m pipeline summary)
+CREATE TABLE `CityYearSummary` (
+  `CityId` INT(11) NOT NULL,
+  `Year` int(4) NOT NULL,
+  `MaxTempF` decimal(7,3) DEFAULT NULL,
+  `MinTempF` decimal(7,3) DEFAULT NULL,
+  `AvgTempF` decimal(7,3) DEFAULT NULL,
+  `MaxTempC` decimal(7,3) DEFAULT NULL,
+  `MinTempC` decimal(7,3) DEFAULT NULL,
+  `AvgTempC` decimal(7,3) DEFAULT NULL,
+  `NumberStations` int(4) DEFAULT NULL,
+  PRIMARY KEY (`CityId`,`Year`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- Create table of the daily maximum temperature of each city in the first year of its daily records, by day of the
+-- year in a 365 day calendar (built by: python -m pipeline daily-baseline)
+CREATE TABLE `CityDailyBaseline` (
+  `CityId` INT(11) NOT NULL,
+  `DayOfYear` int(3) NOT NULL,
+  `Year` int(4) NOT NULL,
+  `MaxTemp` decimal(6,2) DEFAULT NULL,
+  PRIMARY KEY (`CityId`,`DayOfYear`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- Create table of the temperature trends of each city (built by: python -m pipeline climatology)
+-- Trends are least squares slopes of the CityYearSummary values in degrees Fahrenheit per decade, with their 95%
+-- confidence interval. BaselineAvgTempF is the mean temperature over 1961-1990
+CREATE TABLE `CityClimatology` (
+  `CityId` INT(11) NOT NULL,
+  `FirstYear` int(4) NOT NULL,
+  `LastYear` int(4) NOT NULL,
+  `NumberYears` int(4) NOT NULL,
+  `MaxTempTrendF` decimal(8,4) DEFAULT NULL,
+  `MaxTempTrendLowF` decimal(8,4) DEFAULT NULL,
+  `MaxTempTrendHighF` decimal(8,4) DEFAULT NULL,
+  `MinTempTrendF` decimal(8,4) DEFAULT NULL,
+  `MinTempTrendLowF` decimal(8,4) DEFAULT NULL,
+  `MinTempTrendHighF` decimal(8,4) DEFAULT NULL,
+  `AvgTempTrendF` decimal(8,4) DEFAULT NULL,
+  `AvgTempTrendLowF` decimal(8,4) DEFAULT NULL,
+  `AvgTempTrendHighF` decimal(8,4) DEFAULT NULL,
+  `BaselineAvgTempF` decimal(7,3) DEFAULT NULL,
+  PRIMARY KEY (`CityId`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- Create table of the decadal mean temperature of each city and its anomaly against the 1961-1990 baseline
+CREATE TABLE `CityDecadeAnomaly` (
+  `CityId` INT(11) NOT NULL,
+  `Decade` int(4) NOT NULL,
+  `AvgTempF` decimal(7,3) DEFAULT NULL,
+  `AnomalyF` decimal(7,3) DEFAULT NULL,
+  `NumberYears` int(2) NOT NULL,
+  PRIMARY KEY (`CityId`,`Decade`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
 -- Set foreign key constraints
+ALTER TABLE StationDetails
+ADD FOREIGN KEY FK_StationDetails_Cities(CityId)
+REFERENCES Cities(CityId)
+ON DELETE NO ACTION
+ON UPDATE NO ACTION;
+
+
+ALTER TABLE CityYearSummary
+ADD FOREIGN KEY FK_CityYearSummary_Cities(CityId)
+REFERENCES Cities(CityId)
+ON DELETE NO ACTION
+ON UPDATE NO ACTION;
+
+ALTER TABLE CityDailyBaseline
+ADD FOREIGN KEY FK_CityDailyBaseline_Cities(CityId)
+REFERENCES Cities(CityId)
+ON DELETE NO ACTION
+ON UPDATE NO ACTION;
+
+ALTER TABLE CityClimatology
+ADD FOREIGN KEY FK_CityClimatology_Cities(CityId)
+REFERENCES Cities(CityId)
+ON DELETE NO ACTION
+ON UPDATE NO ACTION;
+
+ALTER TABLE CityDecadeAnomaly
+ADD FOREIGN KEY FK_CityDecadeAnomaly_Cities(CityId)
+REFERENCES Cities(CityId)
+ON DELETE NO ACTION
+ON UPDATE NO ACTION;
+
+
 ALTER TABLE StationRecords
 ADD FOREIGN KEY FK_StationRecords_StationDetails(StationId)
 REFERENCES StationDetails(StationId)
@@ -92,6 +204,15 @@ CREATE TABLE `CO2` (
   PRIMARY KEY (`Country`,`Year`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
+-- Create table of the national CO2 emissions of each country for every year of the yearly temperature summaries of
+-- its cities, NULL where CO2 has no value (built by: python -m pipeline co2)
+CREATE TABLE `CountryYearCO2` (
+  `Country` varchar(100) NOT NULL,
+  `Year` int(4) NOT NULL,
+  `Emissions` float DEFAULT NULL,
+  PRIMARY KEY (`Country`,`Year`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
 ALTER TABLE Countries
 ADD FOREIGN KEY FK_Countries_CO2(Country)
 REFERENCES CO2(Country)
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The app modules use flat imports (they are run from app/), the pipeline is run from data_wrangling/ and the fake Apixu
+# server lives with the benchmarks
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for path in (os.path.join(ROOT_DIR, "app"), os.path.join(ROOT_DIR, "data_wrangling"),
+             os.path.join(ROOT_DIR, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def server():
+    """ Fake Apixu API served on a local port """
+    from fake_apixu import FakeApixuServer
+
+    server = FakeApixuServer(latency=0.01).start()
+    yield server
+    server.stop()
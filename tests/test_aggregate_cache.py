@@ -0,0 +1,110 @@
+import threading
+import time
+
+from aggregate_cache import AggregateCache
+
+
+def compute_concurrently(cache, key, compute, callers=8):
+    """ Call get_or_compute from several threads at once, returning their results """
+    results = [None] * callers
+    errors = [None] * callers
+    barrier = threading.Barrier(callers)
+
+    def call(i):
+        barrier.wait()
+        try:
+            results[i] = cache.get_or_compute(key, compute)
+        except Exception as error:
+            errors[i] = error
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_misses_compute_once():
+    cache = AggregateCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"rows": 42}
+
+    results, errors = compute_concurrently(cache, ("London", "Fahrenheit"), compute)
+
+    assert len(calls) == 1
+    assert errors == [None] * 8
+    assert all(result is results[0] for result in results)
+    assert cache.stats()["waits"] == 7
+    assert cache.get(("London", "Fahrenheit")) == {"rows": 42}
+
+
+def test_waiters_get_the_error_and_the_key_is_computed_again():
+    cache = AggregateCache()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        time.sleep(0.1)
+        raise ValueError("Database unavailable")
+
+    results, errors = compute_concurrently(cache, ("London", "Fahrenheit"), fail)
+
+    assert len(calls) == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert cache.get_or_compute(("London", "Fahrenheit"), lambda: "recovered") == "recovered"
+
+
+def test_different_keys_are_computed_independently():
+    cache = AggregateCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "London"
+
+    thread = threading.Thread(target=cache.get_or_compute, args=(("London", "Fahrenheit"), slow))
+    thread.start()
+    started.wait(5)
+
+    assert cache.get_or_compute(("Paris", "Fahrenheit"), lambda: "Paris") == "Paris"
+    release.set()
+    thread.join()
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = AggregateCache(max_size=2)
+    cache.set(("London",), 1)
+    cache.set(("Paris",), 2)
+    cache.get(("London",))
+    cache.set(("Rome",), 3)
+
+    assert cache.get(("Paris",)) is None
+    assert cache.get(("London",)) == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_missed():
+    cache = AggregateCache(ttl=0.05)
+    cache.set(("London",), 1)
+    time.sleep(0.1)
+
+    assert cache.get(("London",)) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_invalidate_a_city():
+    cache = AggregateCache()
+    cache.set(("London", "Celsius"), 1)
+    cache.set(("London", "Fahrenheit"), 2)
+    cache.set(("Paris", "Celsius"), 3)
+
+    assert cache.invalidate("London") == 2
+    assert cache.stats()["size"] == 1
+    assert cache.invalidate() == 1
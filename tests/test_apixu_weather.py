@@ -0,0 +1,138 @@
+import datetime
+import time
+
+import pytest
+
+from apixu_weather import ApixuWeather
+
+
+TODAY = datetime.date.today()
+
+
+def make_client(server, tmp_path, **kwargs):
+    api_key_file = tmp_path / "apixu_key.txt"
+    api_key_file.write_text("test")
+    return ApixuWeather(api_key_file=str(api_key_file), base_url=server.url,
+                        history_cache_path=str(tmp_path / "history.sqlite"), **kwargs)
+
+
+def test_cold_render_fetches_history_and_forecast(server, tmp_path):
+    apixu = make_client(server, tmp_path)
+
+    history, forecast = apixu.recent_days("London", TODAY)
+
+    assert [day["date"] for day in history] == [
+        (TODAY - datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(7, 0, -1)]
+    assert len(forecast) == 6
+    assert apixu.upstream_calls == 8
+    assert server.requests == 8
+
+
+def test_warm_render_only_fetches_the_forecast(server, tmp_path):
+    make_client(server, tmp_path).recent_days("London", TODAY)
+
+    # A new client shares the persistent history cache but not the forecast, like another worker after a restart
+    apixu = make_client(server, tmp_path)
+    history_calls = []
+    history = apixu.history
+    apixu.history = lambda city_value, date: history_calls.append(date) or history(city_value, date)
+    requests = server.requests
+
+    history_days, forecast = apixu.recent_days("London", TODAY)
+
+    assert len(history_days) == 7 and len(forecast) == 6
+    assert history_calls == []
+    assert apixu.upstream_calls == 1
+    assert server.requests - requests == 1
+
+    # The forecast is then fresh, so a second render makes no upstream call
+    apixu.recent_days("London", TODAY)
+    assert apixu.upstream_calls == 1
+
+
+def test_cached_history_days_are_not_fetched_again(server, tmp_path):
+    apixu = make_client(server, tmp_path)
+    apixu.history_cache.set("London", {"date": (TODAY - datetime.timedelta(days=3)).strftime('%Y-%m-%d'), "day": {}})
+
+    assert len(apixu.missing_history("London", TODAY)) == 6
+    apixu.recent_days("London", TODAY)
+
+    assert apixu.upstream_calls == 7
+    assert apixu.missing_history("London", TODAY) == []
+
+
+def test_slow_api_degrades_to_the_cached_days(server, tmp_path):
+    apixu = make_client(server, tmp_path, timeout=0.1, forecast_ttl=0, forecast_max_stale=0)
+    apixu.recent_days("London", TODAY)
+
+    # Every request now outlasts the deadline of twice the request timeout
+    server.latency = 1.0
+    start = time.monotonic()
+    history, forecast = apixu.recent_days("London", TODAY + datetime.timedelta(days=2))
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.5
+    assert len(history) == 5
+    assert len(forecast) == 6
+
+
+def test_failing_api_without_cache_returns_no_days(tmp_path):
+    api_key_file = tmp_path / "apixu_key.txt"
+    api_key_file.write_text("test")
+    apixu = ApixuWeather(api_key_file=str(api_key_file), base_url="http://127.0.0.1:9", timeout=0.5,
+                         history_cache_path=":memory:")
+
+    assert apixu.recent_days("London", TODAY) == ([], [])
+
+
+def test_recent_weather_keeps_a_row_for_each_missing_day(server, tmp_path):
+    from synthetic import MemoryBackend, generate_dataset
+    from weather_records import WeatherRecords
+
+    backend = MemoryBackend(generate_dataset(cities=1, stations_per_city=1, years=5))
+    city_value = backend.cities.City[0]
+    apixu = make_client(server, tmp_path, timeout=0.1)
+    wr = WeatherRecords(backend=backend, apixu=apixu, city_index_path=str(tmp_path / "city_index.json"),
+                        station_index_path=str(tmp_path / "station_index.npz"),
+                        co2_index_path=str(tmp_path / "co2_index.json"))
+
+    # Only the history days cached by a render two days ago and the fresh forecast are available in time
+    apixu.recent_days(city_value, TODAY - datetime.timedelta(days=2))
+    server.latency = 1.0
+    df = wr.get_recent_weather(city_value, "Fahrenheit")
+
+    assert list(df.Date) == [(TODAY + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(-7, 6)]
+    assert df["Last 7 Days"].isnull().tolist() == [False] * 5 + [True] * 2 + [False] + [True] * 5
+    assert df["Forecast"][7] == df["Last 7 Days"][7]
+
+
+def test_api_key_is_read_from_the_environment(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("GLOBALWARMING_APIXU_KEY", "from-env")
+    monkeypatch.delenv("GLOBALWARMING_APIXU_KEY_FILE", raising=False)
+    apixu = ApixuWeather(base_url=server.url, history_cache_path=":memory:")
+
+    assert apixu.api_key == "from-env"
+    assert len(apixu.recent_days("London", TODAY)[0]) == 7
+
+
+def test_api_key_file_is_read_from_the_environment(tmp_path, monkeypatch):
+    api_key_file = tmp_path / "apixu_key.txt"
+    api_key_file.write_text("from-file\n")
+    monkeypatch.delenv("GLOBALWARMING_APIXU_KEY", raising=False)
+    monkeypatch.setenv("GLOBALWARMING_APIXU_KEY_FILE", str(api_key_file))
+
+    assert ApixuWeather(history_cache_path=":memory:").api_key == "from-file"
+
+
+def test_missing_api_key_fails_clearly(server, monkeypatch):
+    monkeypatch.delenv("GLOBALWARMING_APIXU_KEY", raising=False)
+    monkeypatch.delenv("GLOBALWARMING_APIXU_KEY_FILE", raising=False)
+    apixu = ApixuWeather(base_url=server.url, history_cache_path=":memory:")
+
+    with pytest.raises(RuntimeError, match="GLOBALWARMING_APIXU_KEY"):
+        apixu.recent_days("London", TODAY)
+    assert server.requests == 0
+
+    apixu = ApixuWeather(api_key_file="/missing/apixu_key.txt", history_cache_path=":memory:")
+    with pytest.raises(RuntimeError, match="/missing/apixu_key.txt"):
+        apixu.api_key
@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+from load_test import callback_payload
+
+
+@pytest.fixture(scope="module")
+def dashboard(tmp_path_factory):
+    """ The app pointed at a synthetic dataset, run from a scratch working directory (it writes its indexes and caches
+    there) """
+    from apixu_weather import ApixuWeather
+    from synthetic import MemoryBackend, generate_dataset
+
+    cwd = os.getcwd()
+    os.chdir(str(tmp_path_factory.mktemp("app")))
+    import app as dashboard
+    dashboard.wr._backend = MemoryBackend(generate_dataset(cities=3, stations_per_city=1, years=5))
+    dashboard.wr._apixu = ApixuWeather(api_key="test", history_cache_path=":memory:")
+
+    yield dashboard
+
+    sys.modules.pop("app", None)
+    os.chdir(cwd)
+
+
+def forecast_traces(dashboard, server, city_value):
+    dashboard.wr.apixu.base_url = server.url
+    client = dashboard.app.server.test_client()
+    response = client.post("/_dash-update-component", json=callback_payload(
+        [("forecast-data", "data")], [("city-selector", "value", city_value)]))
+    assert response.status_code == 200
+    data = response.get_json()["response"]["forecast-data"]["data"]
+    response.close()
+    return [trace["name"] for trace in data["traces"]]
+
+
+def test_forecast_includes_the_baseline_year(dashboard, server):
+    city_value = dashboard.wr.backend.cities.City[0]
+    year = dashboard.wr.city_daily_baseline(city_value)[0]
+
+    assert forecast_traces(dashboard, server, city_value) == ["Last 7 Days", "Forecast", str(year)]
+
+
+def test_forecast_of_a_city_without_daily_records(dashboard, server, monkeypatch):
+    backend = dashboard.wr.backend
+    monkeypatch.setattr(backend, "city_daily_baseline",
+                        lambda city_id: pd.DataFrame({"DayOfYear": [], "Year": [], "MaxTemp": []}))
+    city_value = backend.cities.City[1]
+
+    assert forecast_traces(dashboard, server, city_value) == ["Last 7 Days", "Forecast"]
+
+
+def test_export_streams_the_monthly_series_of_a_city(dashboard):
+    backend = dashboard.wr.backend
+    city_value = backend.cities.City[0]
+    client = dashboard.app.server.test_client()
+
+    response = client.get("/api/export", query_string={"city": city_value, "resolution": "monthly",
+                                                       "start_year": 1960, "end_year": 1961,
+                                                       "columns": "AvgTempF,NumberStations"})
+    assert response.status_code == 200
+    rows = response.get_data(as_text=True).splitlines()
+    response.close()
+
+    city_id = backend.cities.CityId[0]
+    records = backend.records[(backend.records.CityId == city_id) & backend.records.Year.between(1960, 1961)]
+    assert rows[0] == "City,CityId,Year,Month,AvgTempF,NumberStations"
+    assert len(rows) == 1 + 24
+    assert rows[1].endswith(",{},1960,1,{},1".format(city_id, records.Temp.iloc[0]))
+
+
+def test_export_of_every_city(dashboard):
+    client = dashboard.app.server.test_client()
+
+    response = client.get("/api/export", query_string={"format": "ndjson", "columns": "AvgTempC"})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    response.close()
+
+    assert len(rows) == len(dashboard.wr.backend.yearly)
+    assert list(rows[0]) == ["City", "CityId", "Year", "AvgTempC"]
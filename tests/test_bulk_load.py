@@ -0,0 +1,209 @@
+import os
+import re
+
+import pytest
+
+from pipeline import bulk_load
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "database",
+                           "sql_table_definition.sql")
+
+
+def current_schema():
+    """ The statements of sql_table_definition.sql, without the old tables kept at the end of the file """
+    with open(SCHEMA_PATH) as file:
+        return file.read().split("-- OLD KEPT JUST IN CASE")[0]
+
+
+def schema_indexes(schema):
+    """ Map each table of the schema to its indexes, as index name to list of columns """
+    indexes = {}
+    for table, body in re.findall(r"CREATE TABLE `(\w+)` \((.*?)\n\) ENGINE", schema, re.S):
+        table_indexes = indexes.setdefault(table, {})
+        for kind, name, columns in re.findall(r"(PRIMARY KEY|KEY `(\w+)`) \(([^)]*)\)", body):
+            table_indexes["PRIMARY" if kind == "PRIMARY KEY" else name] = re.findall(r"`(\w+)`", columns)
+    return indexes
+
+
+def schema_foreign_keys(schema):
+    """ List the (table, foreign key name, column) of the foreign keys of the schema """
+    return re.findall(r"ALTER TABLE (\w+)\s+ADD FOREIGN KEY (\w+)\((\w+)\)", schema)
+
+
+def test_deferred_indexes_match_the_schema():
+    indexes = schema_indexes(current_schema())
+
+    for table, deferred in bulk_load.SECONDARY_INDEXES.items():
+        assert table in bulk_load.LOAD_TABLES
+        for name, columns in deferred.items():
+            assert indexes[table][name] == re.findall(r"`(\w+)`", columns)
+
+
+def test_deferred_indexes_are_not_needed_by_foreign_keys():
+    schema = current_schema()
+    indexes = schema_indexes(schema)
+
+    # MySQL refuses to drop the last index starting with the column of a foreign key
+    for table, name, column in schema_foreign_keys(schema):
+        deferred = bulk_load.SECONDARY_INDEXES.get(table, {})
+        kept = [columns for index, columns in indexes[table].items() if index not in deferred]
+        assert any(columns[0] == column for columns in kept), "{} needs an index of {}".format(name, table)
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.connection.statements.append(sql)
+        if sql.startswith("SELECT DISTINCT INDEX_NAME"):
+            self.rows = [(name,) for name in self.connection.indexes]
+        return 0
+
+    def executemany(self, sql, values):
+        if self.connection.fail_on is not None and values[0][0] == self.connection.fail_on:
+            raise RuntimeError("Connection lost")
+        self.connection.rows.extend(values)
+
+    def fetchall(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class FakeConnection:
+    """ Records the statements and rows of a load in place of a MySQL connection """
+
+    def __init__(self, indexes=(), fail_on=None):
+        self.indexes = set(indexes)
+        self.fail_on = fail_on
+        self.statements = []
+        self.rows = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def write_partitions(directory):
+    paths = []
+    for year in (2000, 2001):
+        path = os.path.join(str(directory), "year={}.csv".format(year))
+        with open(path, "w") as file:
+            file.write("StationId,Year,Month,Temp\n")
+            file.write("A,{0},1,10.5\nB,{0},1,\\N\n".format(year))
+        paths.append(path)
+    return paths
+
+
+def test_interrupted_load_resumes_from_the_checkpoint(tmp_path):
+    partitions = write_partitions(tmp_path)
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    connection = FakeConnection(indexes=["PRIMARY"])
+    result = bulk_load.bulk_load(connection, "StationRecords", partitions[:1], method="insert",
+                                 checkpoint_path=checkpoint, log=lambda message: None)
+    assert result["rows"] == 2
+    assert connection.rows[1] == ["B", 2000, 1, None]
+
+    # The second run skips the committed partition and only loads the new one
+    connection = FakeConnection(indexes=["PRIMARY"])
+    result = bulk_load.bulk_load(connection, "StationRecords", partitions, method="insert",
+                                 checkpoint_path=checkpoint, log=lambda message: None)
+    assert (result["partitions_skipped"], result["partitions_loaded"], result["rows"]) == (1, 1, 2)
+    assert [row[1] for row in connection.rows] == [2001, 2001]
+
+
+def test_failed_partition_is_not_checkpointed(tmp_path):
+    partitions = write_partitions(tmp_path)
+    checkpoint = str(tmp_path / "checkpoint.json")
+
+    with pytest.raises(RuntimeError):
+        bulk_load.bulk_load(FakeConnection(fail_on="A"), "StationRecords", partitions, method="insert",
+                            checkpoint_path=checkpoint, log=lambda message: None)
+
+    assert not bulk_load.Checkpoint(checkpoint).is_done("StationRecords", partitions[0])
+
+
+def test_station_details_load_keeps_the_foreign_key_index(tmp_path):
+    path = str(tmp_path / "stations.csv")
+    with open(path, "w") as file:
+        file.write("StationId,City,Country,CityId\nA,London,United Kingdom,1\n")
+    connection = FakeConnection(indexes=["PRIMARY", "StationId", "idx_StationDetails_CityId"])
+
+    bulk_load.bulk_load(connection, "StationDetails", [path], method="insert", log=lambda message: None)
+
+    assert not any("DROP INDEX" in sql or "ADD INDEX" in sql for sql in connection.statements)
+
+
+@pytest.fixture
+def mysql_connection():
+    """ Connection to a scratch database holding the real schema, on the MySQL server given by
+    GLOBALWARMING_TEST_MYSQL_HOST (with GLOBALWARMING_TEST_MYSQL_USER and GLOBALWARMING_TEST_MYSQL_PASSWORD) """
+    host = os.environ.get("GLOBALWARMING_TEST_MYSQL_HOST")
+    if not host:
+        pytest.skip("GLOBALWARMING_TEST_MYSQL_HOST is not set")
+    import pymysql
+
+    user = os.environ.get("GLOBALWARMING_TEST_MYSQL_USER", "root")
+    password = os.environ.get("GLOBALWARMING_TEST_MYSQL_PASSWORD", "")
+    connection = pymysql.connect(host=host, user=user, password=password, local_infile=True, autocommit=False)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP DATABASE IF EXISTS globalwarming_test")
+        cursor.execute("CREATE DATABASE globalwarming_test")
+        cursor.execute("USE globalwarming_test")
+        for statement in current_schema().split(";"):
+            statement = "\n".join(line for line in statement.splitlines() if not line.startswith("--")).strip()
+            if statement and not statement.startswith(("CREATE DATABASE", "USE")):
+                cursor.execute(statement)
+        cursor.execute("INSERT INTO Cities (City, State, Country, Label) "
+                       "VALUES ('London', '', 'United Kingdom', 'London, , United Kingdom')")
+    connection.commit()
+
+    yield connection
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP DATABASE globalwarming_test")
+    connection.close()
+
+
+@pytest.mark.parametrize("method", ["load-data", "insert"])
+def test_load_into_the_real_schema(mysql_connection, tmp_path, method):
+    stations = str(tmp_path / "stations.csv")
+    with open(stations, "w") as file:
+        file.write("StationId,City,State,Country,CityId\nA,London,,United Kingdom,1\nB,London,,United Kingdom,1\n")
+    partitions = write_partitions(tmp_path)
+
+    bulk_load.bulk_load(mysql_connection, "StationDetails", [stations], method=method, log=lambda message: None)
+    result = bulk_load.bulk_load(mysql_connection, "StationRecords", partitions, method=method,
+                                 log=lambda message: None)
+
+    assert result["rows"] == 4
+    with mysql_connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM StationRecords WHERE Temp IS NULL")
+        assert cursor.fetchone()[0] == 2
+        for table in ("StationDetails", "StationRecords"):
+            assert set(bulk_load.SECONDARY_INDEXES.get(table, {})) <= bulk_load.existing_indexes(cursor, table)
+
+
+def test_secondary_indexes_do_not_start_like_a_composite_primary_key():
+    # InnoDB clusters rows by the primary key, so lookups by its leading column are already range scans of the table
+    # and an index starting with that column mostly duplicates it while adding write cost
+    for table, indexes in schema_indexes(current_schema()).items():
+        primary = indexes.get("PRIMARY", [])
+        if len(primary) < 2:
+            continue
+        for name, columns in indexes.items():
+            assert name == "PRIMARY" or columns[0] != primary[0], "{}.{}".format(table, name)
@@ -0,0 +1,57 @@
+from city_search import CitySearch
+
+
+CITIES = [
+    "New York, New York, United States",
+    "Newark, New Jersey, United States",
+    "York, , United Kingdom",
+    "York, Pennsylvania, United States",
+    "Amsterdam, , Netherlands",
+    "Rotterdam, , Netherlands",
+    "Saint Petersburg, , Russia",
+]
+
+
+def test_label_prefixes_rank_before_word_prefixes_and_shorter_labels_first():
+    labels, total = CitySearch(CITIES).search("york")
+
+    assert labels == ["York, , United Kingdom", "York, Pennsylvania, United States",
+                      "New York, New York, United States"]
+    assert total == 3
+
+
+def test_prefix_of_every_query_word_ranks_first():
+    labels, _ = CitySearch(CITIES).search("new jer")
+
+    assert labels[0] == "Newark, New Jersey, United States"
+
+
+def test_query_is_normalised():
+    assert CitySearch(CITIES).search("  SAINT-pet ")[0] == ["Saint Petersburg, , Russia"]
+
+
+def test_misspelt_query_falls_back_to_trigrams():
+    labels, _ = CitySearch(CITIES).search("amsterdan")
+
+    assert labels[0] == "Amsterdam, , Netherlands"
+    assert "Saint Petersburg, , Russia" not in labels
+
+
+def test_prefix_matches_rank_before_trigram_matches():
+    labels, _ = CitySearch(CITIES).search("rotter")
+
+    assert labels[0] == "Rotterdam, , Netherlands"
+
+
+def test_short_queries_do_not_use_trigrams():
+    assert CitySearch(CITIES).search("xy") == ([], 0)
+    assert CitySearch(CITIES).search("") == ([], 0)
+
+
+def test_results_are_paginated():
+    search = CitySearch(CITIES)
+    labels, total = search.search("united")
+
+    assert total == 4
+    assert search.search("united", limit=3) == (labels[:3], 4)
+    assert search.search("united", limit=3, offset=3) == (labels[3:], 4)
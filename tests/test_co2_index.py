@@ -0,0 +1,57 @@
+import pandas as pd
+
+from co2_index import CO2Index
+
+
+class FakeBackend:
+    """ Backend holding the emissions of one country, with settable data versions """
+
+    def __init__(self):
+        self.versions = {"Cities": "1", "CountryYearCO2": "1"}
+        self.emissions = [100.0, 110.0]
+        self.loads = 0
+
+    def data_version(self, name="Cities"):
+        return self.versions[name]
+
+    def load_country_co2(self):
+        self.loads += 1
+        co2 = pd.DataFrame({"Country": ["France", "France"], "Year": [2000, 2001], "Emissions": self.emissions})
+        return co2, pd.DataFrame({"CityId": [1], "Country": ["France"]})
+
+
+def test_index_is_built_once_and_read_from_disk(tmp_path):
+    backend = FakeBackend()
+    path = str(tmp_path / "co2_index.json")
+
+    index = CO2Index(path, lambda: backend)
+    assert index.country(1) == "France"
+    assert index.emissions("France", [2000, 2001, 2002]) == [100.0, 110.0, None]
+
+    # Another process reads the file rather than the backend
+    assert CO2Index(path, lambda: backend).emissions("France", [2001]) == [110.0]
+    assert backend.loads == 1
+
+
+def test_refresh_picks_up_new_emissions(tmp_path):
+    backend = FakeBackend()
+    index = CO2Index(str(tmp_path / "co2_index.json"), lambda: backend)
+    index.emissions("France", [2000])
+    assert not index.refresh()
+
+    # Re-running `pipeline co2` bumps the CountryYearCO2 version without changing the cities
+    backend.emissions = [120.0, 130.0]
+    backend.versions["CountryYearCO2"] = "2"
+    assert index.refresh()
+    assert index.emissions("France", [2000]) == [120.0]
+    assert index.version == "1.2"
+
+
+def test_refresh_picks_up_new_cities(tmp_path):
+    backend = FakeBackend()
+    index = CO2Index(str(tmp_path / "co2_index.json"), lambda: backend)
+    index.country(1)
+
+    backend.versions["Cities"] = "2"
+    assert index.refresh()
+    assert backend.loads == 2
@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from connection_pool import ConnectionPool
+from connection_pool import PoolTimeout
+
+
+def connect():
+    return sqlite3.connect(":memory:", check_same_thread=False)
+
+
+def test_connections_are_reused():
+    pool = ConnectionPool(connect, min_size=1, max_size=2)
+
+    with pool.connection() as first:
+        first.execute("SELECT 1")
+    with pool.connection() as second:
+        pass
+
+    assert second is first
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["size"] == 1 and stats["idle"] == 1 and stats["in_use"] == 0
+
+
+def test_checkout_times_out_when_the_pool_is_full():
+    pool = ConnectionPool(connect, min_size=0, max_size=1, timeout=0.1)
+    connection = pool.checkout()
+
+    start = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.checkout()
+
+    assert time.monotonic() - start >= 0.1
+    assert pool.stats()["timeouts"] == 1
+    pool.checkin(connection)
+
+
+def test_checkout_waits_for_a_checkin():
+    pool = ConnectionPool(connect, min_size=0, max_size=1, timeout=5)
+    connection = pool.checkout()
+    threading.Timer(0.05, pool.checkin, args=(connection,)).start()
+
+    assert pool.checkout() is connection
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["wait_time_max"] >= 0.05
+
+
+def test_connections_failing_the_health_check_are_discarded():
+    pool = ConnectionPool(connect, min_size=1, max_size=1)
+    with pool.connection() as broken:
+        pass
+    broken.close()
+
+    with pool.connection() as connection:
+        connection.execute("SELECT 1")
+
+    assert connection is not broken
+    stats = pool.stats()
+    assert stats["health_check_failures"] == 1
+    assert stats["created"] == 2 and stats["closed"] == 1
+    assert stats["size"] == 1
+
+
+def test_stale_connections_are_recycled():
+    pool = ConnectionPool(connect, min_size=1, max_size=1, recycle=0.05)
+    with pool.connection() as old:
+        pass
+    time.sleep(0.1)
+
+    with pool.connection() as connection:
+        pass
+
+    assert connection is not old
+    stats = pool.stats()
+    assert stats["recycled"] == 1
+    assert stats["created"] == 2 and stats["closed"] == 1
+
+
+def test_connection_is_discarded_when_the_block_raises():
+    pool = ConnectionPool(connect, min_size=0, max_size=1)
+
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection() as connection:
+            connection.execute("SELECT * FROM Missing")
+
+    stats = pool.stats()
+    assert stats["closed"] == 1
+    assert stats["size"] == 0 and stats["in_use"] == 0
+
+
+def test_closed_pool_refuses_checkouts():
+    pool = ConnectionPool(connect, min_size=2, max_size=2)
+    pool.close()
+
+    with pytest.raises(PoolTimeout):
+        pool.checkout()
+    assert pool.stats()["closed"] == 2
+
+
+def test_invalid_sizes_are_rejected():
+    with pytest.raises(ValueError):
+        ConnectionPool(connect, min_size=3, max_size=2)
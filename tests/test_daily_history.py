@@ -0,0 +1,47 @@
+import datetime
+
+import numpy as np
+
+from weather_records import WeatherRecords
+
+
+def records_with_baseline(tmp_path):
+    """ WeatherRecords whose city has a baseline year with the day of the year (0 to 364) as its temperatures """
+    records = WeatherRecords(city_index_path=str(tmp_path / "city_index.json"),
+                             co2_index_path=str(tmp_path / "co2_index.json"))
+    records.city_daily_baseline = lambda city_value: (1950, np.arange(365, dtype=float))
+    return records
+
+
+def test_day_of_year_uses_a_365_day_calendar():
+    assert WeatherRecords.day_of_year(datetime.date(2019, 1, 1)) == 0
+    assert WeatherRecords.day_of_year(datetime.date(2019, 12, 31)) == 364
+    assert WeatherRecords.day_of_year(datetime.date(2020, 3, 1)) == 59
+    assert WeatherRecords.day_of_year(datetime.date(2020, 2, 29)) == WeatherRecords.day_of_year(
+        datetime.date(2020, 2, 28))
+
+
+def test_window_is_the_7_days_before_to_the_5_days_after(tmp_path):
+    df = records_with_baseline(tmp_path).get_daily_history("London", today=datetime.date(2019, 6, 10))
+
+    assert list(df.columns) == [1950]
+    assert df[1950].tolist() == list(range(153, 166))
+
+
+def test_window_wraps_back_across_new_year(tmp_path):
+    df = records_with_baseline(tmp_path).get_daily_history("London", today=datetime.date(2019, 1, 3))
+
+    assert df[1950].tolist() == [360, 361, 362, 363, 364, 0, 1, 2, 3, 4, 5, 6, 7]
+
+
+def test_window_wraps_forward_across_new_year(tmp_path):
+    df = records_with_baseline(tmp_path).get_daily_history("London", today=datetime.date(2019, 12, 30))
+
+    assert df[1950].tolist() == [356, 357, 358, 359, 360, 361, 362, 363, 364, 0, 1, 2, 3]
+
+
+def test_city_without_daily_records_has_no_history(tmp_path):
+    records = records_with_baseline(tmp_path)
+    records.city_daily_baseline = lambda city_value: None
+
+    assert records.get_daily_history("London", today=datetime.date(2019, 1, 3)) is None
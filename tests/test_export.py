@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+from decimal import Decimal
+
+import pytest
+
+from export import encode
+
+
+COLUMNS = ["City", "CityId", "Year", "AvgTempC", "NumberStations"]
+BATCHES = [
+    [("Paris, , France", 7, 1990, Decimal("11.250"), 3), ("Paris, , France", 7, 1991, None, 2)],
+    [("Oslo, , Norway", 9, 1990, Decimal("-0.500"), 1)]
+]
+
+
+def test_csv_has_a_header_and_a_chunk_per_batch():
+    chunks = list(encode("csv", COLUMNS, iter(BATCHES)))
+
+    assert len(chunks) == 2
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+    assert rows == [COLUMNS, ["Paris, , France", "7", "1990", "11.25", "3"], ["Paris, , France", "7", "1991", "", "2"],
+                    ["Oslo, , Norway", "9", "1990", "-0.5", "1"]]
+
+
+def test_csv_without_rows_is_the_header():
+    assert b"".join(encode("csv", COLUMNS, iter([]))) == b"City,CityId,Year,AvgTempC,NumberStations\n"
+
+
+def test_ndjson_has_an_object_per_row():
+    chunks = list(encode("ndjson", COLUMNS, iter(BATCHES)))
+
+    assert len(chunks) == 2
+    rows = [json.loads(line) for line in b"".join(chunks).decode("utf-8").splitlines()]
+    assert rows[0] == {"City": "Paris, , France", "CityId": 7, "Year": 1990, "AvgTempC": 11.25, "NumberStations": 3}
+    assert rows[1]["AvgTempC"] is None
+    assert len(rows) == 3
+
+
+def test_ndjson_without_rows_is_empty():
+    assert b"".join(encode("ndjson", COLUMNS, iter([]))) == b""
+
+
+def test_arrow_stream_round_trips():
+    pa = pytest.importorskip("pyarrow")
+
+    chunks = list(encode("arrow", COLUMNS, iter(BATCHES)))
+
+    # The schema, a chunk per record batch and the end of stream marker
+    assert len(chunks) == 4
+    reader = pa.ipc.open_stream(b"".join(chunks))
+    assert [str(field.type) for field in reader.schema] == ["string", "int64", "int64", "double", "int64"]
+    table = reader.read_all()
+    assert table.column("AvgTempC").to_pylist() == [11.25, None, -0.5]
+    assert table.column("City").to_pylist() == ["Paris, , France", "Paris, , France", "Oslo, , Norway"]
+
+
+def test_arrow_stream_without_rows_has_the_schema():
+    pa = pytest.importorskip("pyarrow")
+
+    table = pa.ipc.open_stream(b"".join(encode("arrow", COLUMNS, iter([])))).read_all()
+
+    assert table.num_rows == 0
+    assert table.column_names == COLUMNS
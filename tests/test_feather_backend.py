@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from backends import FeatherBackend
+from synthetic import generate_dataset
+from synthetic import write_feather_store
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    return write_feather_store(generate_dataset(cities=4, stations_per_city=2, years=40),
+                               str(tmp_path_factory.mktemp("store")))
+
+
+def test_city_climatology_matches_the_store(store):
+    import pandas as pd
+
+    backend = FeatherBackend(store)
+    climatology = pd.read_feather(os.path.join(store, "climatology.feather"))
+    decades = pd.read_feather(os.path.join(store, "decades.feather"))
+
+    for city_id in backend.cities.CityId:
+        row, city_decades = backend.city_climatology(city_id)
+        expected = decades[decades.CityId == city_id].sort_values('Decade')
+        assert row.CityId.tolist() == [city_id]
+        assert row.MaxTempTrendF[0] == climatology.loc[climatology.CityId == city_id, 'MaxTempTrendF'].iloc[0]
+        assert city_decades.columns.tolist() == ['Decade', 'AvgTempF', 'AnomalyF']
+        assert city_decades.Decade.tolist() == expected.Decade.tolist()
+
+
+def test_unknown_city_has_no_climatology(store):
+    row, decades = FeatherBackend(store).city_climatology(10 ** 6)
+
+    assert row.empty and decades.empty
+
+
+def test_climatology_is_read_once_per_data_version(store, monkeypatch):
+    import pyarrow.feather as feather
+
+    backend = FeatherBackend(store)
+    reads = []
+    read_table = feather.read_table
+    monkeypatch.setattr(feather, "read_table", lambda path, **kwargs: reads.append(path) or read_table(path, **kwargs))
+
+    for city_id in backend.cities.CityId:
+        backend.city_climatology(city_id)
+    assert len(reads) == 2
+
+    # Rebuilding the store changes the data version, so the files are read again
+    stat = os.stat(backend.cities_path)
+    os.utime(backend.cities_path, (stat.st_atime, stat.st_mtime + 10))
+    backend.city_climatology(1)
+    assert len(reads) == 4
@@ -0,0 +1,44 @@
+import numpy as np
+
+from figures import lttb_indices, unit_trace
+
+
+def test_short_series_keeps_every_point():
+    y = np.array([1.0, 3.0, 2.0, 5.0])
+
+    assert lttb_indices(y, 4).tolist() == [0, 1, 2, 3]
+    assert lttb_indices(y, 10).tolist() == [0, 1, 2, 3]
+    assert lttb_indices(y, 2).tolist() == [0, 1, 2, 3]
+
+
+def test_downsampled_indices_are_sorted_and_keep_the_ends():
+    y = np.sin(np.linspace(0, 20, 1000))
+
+    indices = lttb_indices(y, 50)
+
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert (np.diff(indices) > 0).all()
+
+
+def test_spike_is_preserved():
+    y = np.zeros(1000)
+    y[437] = 100.0
+    y[781] = -50.0
+
+    indices = lttb_indices(y, 20)
+
+    assert 437 in indices
+    assert 781 in indices
+
+
+def test_trace_downsamples_around_missing_values():
+    temps = np.arange(100, dtype=float)
+    temps[10:20] = np.nan
+
+    trace = unit_trace("AvgTemp", np.arange(1900, 2000), temps, max_points=30)
+
+    assert len(trace["x"]) == 30
+    assert trace["x"][0] == 1900 and trace["x"][-1] == 1999
+    assert None not in trace["y"]["Fahrenheit"]
+    assert trace["y"]["Celsius"][0] == round((0 - 32) * 5 / 9, 1)
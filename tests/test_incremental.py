@@ -0,0 +1,94 @@
+import os
+
+from pipeline import incremental
+
+
+def write_station_file(source_dir, year, station, content):
+    directory = os.path.join(str(source_dir), str(year))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "{}.csv".format(station))
+    with open(path, "w") as file:
+        file.write(content)
+    return path
+
+
+def set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_new_files_are_changed_until_recorded(tmp_path):
+    source = tmp_path / "gsod"
+    write_station_file(source, 2018, "01001099999", "a")
+    write_station_file(source, 2019, "01001099999", "b")
+    manifest_path = str(tmp_path / "manifest.json")
+
+    changed, unchanged, _ = incremental.scan(str(source), incremental.Manifest(manifest_path))
+    assert [relpath for relpath, _ in changed] == [os.path.join("2018", "01001099999.csv"),
+                                                   os.path.join("2019", "01001099999.csv")]
+    assert unchanged == 0
+
+    assert incremental.record_manifest(str(source), manifest_path) == 2
+    changed, unchanged, touched = incremental.scan(str(source), incremental.Manifest(manifest_path))
+    assert (changed, unchanged, touched) == ([], 2, {})
+
+
+def test_only_years_asked_for_are_scanned(tmp_path):
+    source = tmp_path / "gsod"
+    write_station_file(source, 2018, "01001099999", "a")
+    write_station_file(source, 2019, "01001099999", "b")
+
+    changed, _, _ = incremental.scan(str(source), incremental.Manifest(str(tmp_path / "manifest.json")),
+                                     years=[2019, 2020])
+
+    assert [relpath for relpath, _ in changed] == [os.path.join("2019", "01001099999.csv")]
+
+
+def test_corrected_file_is_changed(tmp_path):
+    source = tmp_path / "gsod"
+    path = write_station_file(source, 2019, "01001099999", "a")
+    set_mtime(path, 1500000000)
+    manifest_path = str(tmp_path / "manifest.json")
+    incremental.record_manifest(str(source), manifest_path)
+
+    write_station_file(source, 2019, "01001099999", "b")
+    set_mtime(path, 1500000000)
+    changed, unchanged, _ = incremental.scan(str(source), incremental.Manifest(manifest_path))
+
+    # Same size and modification time, so the file is trusted to be unchanged without hashing it
+    assert (changed, unchanged) == ([], 1)
+
+    set_mtime(path, 1600000000)
+    changed, unchanged, _ = incremental.scan(str(source), incremental.Manifest(manifest_path))
+    assert len(changed) == 1 and unchanged == 0
+    assert changed[0][1] == {"sha1": incremental.file_digest(path), "size": 1, "mtime": 1600000000}
+
+
+def test_touched_identical_file_is_not_changed(tmp_path):
+    source = tmp_path / "gsod"
+    path = write_station_file(source, 2019, "01001099999", "a")
+    set_mtime(path, 1500000000)
+    manifest_path = str(tmp_path / "manifest.json")
+    incremental.record_manifest(str(source), manifest_path)
+
+    set_mtime(path, 1600000000)
+    changed, unchanged, touched = incremental.scan(str(source), incremental.Manifest(manifest_path))
+
+    # The new modification time is recorded so the file is not hashed again on the next run
+    assert (changed, unchanged) == ([], 1)
+    assert touched[os.path.join("2019", "01001099999.csv")]["mtime"] == 1600000000
+
+
+def test_dry_run_only_reports_the_changed_files(tmp_path):
+    source = tmp_path / "gsod"
+    write_station_file(source, 2019, "01001099999", "a")
+    manifest_path = str(tmp_path / "manifest.json")
+
+    result = incremental.ingest_incremental(None, str(source), manifest_path, dry_run=True, log=lambda message: None)
+
+    assert (result["changed"], result["unchanged"]) == (1, 0)
+    assert not os.path.exists(manifest_path)
+
+
+def test_station_year_of_a_file():
+    assert incremental.file_station_year(os.path.join("2019", "01001099999.csv")) == ("1001099999", 2019)
+    assert incremental.file_station_year(os.path.join("2019", "notes.csv")) is None
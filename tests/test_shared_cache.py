@@ -0,0 +1,111 @@
+import os
+import time
+
+import pytest
+
+from shared_cache import SharedCache
+
+
+def entry_size(cache, value):
+    """ Size of the file of a cached value """
+    cache.set(("Size", "probe"), value)
+    size = os.path.getsize(cache._path(("Size", "probe")))
+    cache.invalidate("Size")
+    return size
+
+
+def age(cache, key, seconds):
+    """ Set back the last use of an entry """
+    when = time.time() - seconds
+    os.utime(cache._path(key), (when, when))
+
+
+def test_values_are_shared_between_instances(tmp_path):
+    directory = str(tmp_path / "cache")
+    SharedCache(directory).set(("London", "Celsius"), {"AvgTemp": [10.5, 11.0]})
+
+    assert SharedCache(directory).get(("London", "Celsius")) == {"AvgTemp": [10.5, 11.0]}
+    assert SharedCache(directory).get(("London", "Fahrenheit")) is None
+
+
+def test_expired_entries_are_misses_but_kept_for_stale_reads(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache"), ttl=60)
+    cache.set(("London", "Celsius"), 1)
+    cache.ttl = 0
+
+    time.sleep(0.01)
+    assert cache.get(("London", "Celsius")) is None
+    assert cache.get_entry(("London", "Celsius"))[0] == 1
+    assert cache.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entries_are_evicted_down_to_the_target(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache"))
+    size = entry_size(cache, "x" * 1000)
+    cache.max_bytes = 4 * size
+
+    for i, city in enumerate(["A", "B", "C", "D"]):
+        cache.set((city,), "x" * 1000)
+        age(cache, (city,), 100 - i)
+
+    # Reading B makes it the most recently used, so A and C are evicted when E passes max_bytes
+    assert cache.get(("B",)) == "x" * 1000
+    cache.set(("E",), "x" * 1000)
+
+    remaining = [city for city in "ABCDE" if cache.get((city,)) is not None]
+    assert remaining == ["B", "D", "E"]
+    assert cache.stats()["size_bytes"] <= cache.max_bytes * SharedCache.EVICT_TARGET
+
+
+def test_directory_is_only_scanned_when_the_estimate_is_over_max_bytes(tmp_path, monkeypatch):
+    cache = SharedCache(str(tmp_path / "cache"))
+    size = entry_size(cache, "x" * 1000)
+    cache.max_bytes = 3 * size
+    cache.evict()
+
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+
+    cache.set(("A",), "x" * 1000)
+    cache.set(("B",), "x" * 1000)
+    assert scans == []
+
+    cache.set(("C",), "x" * 1000)
+    cache.set(("D",), "x" * 1000)
+    assert scans == [1]
+
+
+def test_invalidate_removes_the_entries_of_a_city(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache"))
+    for key in [("London", "Celsius"), ("London", "Fahrenheit"), ("Paris", "Celsius")]:
+        cache.set(key, key)
+
+    assert cache.invalidate("London") == 2
+    assert cache.get(("London", "Celsius")) is None
+    assert cache.get(("Paris", "Celsius")) == ("Paris", "Celsius")
+
+    assert cache.invalidate() == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_get_or_compute_computes_a_miss_once(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache"))
+    calls = []
+
+    for _ in range(3):
+        assert cache.get_or_compute(("London",), lambda: calls.append(1) or 42) == 42
+
+    assert calls == [1]
+    assert SharedCache(cache.directory).get_or_compute(("London",), lambda: 0) == 42
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX permissions")
+def test_directory_writable_by_others_is_refused(tmp_path):
+    directory = tmp_path / "cache"
+    SharedCache(str(directory))
+    assert os.stat(str(directory)).st_mode & 0o777 == 0o700
+
+    os.chmod(str(directory), 0o777)
+    with pytest.raises(PermissionError):
+        SharedCache(str(directory))